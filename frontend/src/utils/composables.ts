@@ -1,4 +1,5 @@
 import { onMounted, onUnmounted, reactive, ref, watch } from 'vue'
+import { createResource } from 'frappe-ui'
 
 export function useScreenSize() {
 	const size = reactive({
@@ -98,3 +99,30 @@ export function useLocalStorage(key, initialValue) {
 	})
 	return value
 }
+
+// a resource for the mail list endpoints, which page with an opaque cursor instead of an offset
+export function useMailList(options) {
+	let cursor = null
+
+	const mails = createResource({
+		...options,
+		auto: true,
+		makeParams: () => ({ cursor }),
+		transform(data) {
+			const append = !!cursor
+			cursor = null
+			mails.nextCursor = data.next_cursor
+			mails.hasNextPage = !!data.next_cursor
+			return append ? [...(mails.data || []), ...data.mails] : data.mails
+		},
+	})
+
+	// reload fetches the first page again, next appends the following one
+	mails.next = () => {
+		if (!mails.nextCursor) return
+		cursor = mails.nextCursor
+		mails.reload()
+	}
+
+	return mails
+}
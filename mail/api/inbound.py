@@ -8,6 +8,7 @@ from frappe.utils import convert_utc_to_system_timezone, now
 
 from mail.api.auth import validate_email_ownership, validate_user
 from mail.mail.doctype.mail_sync_history.mail_sync_history import get_mail_sync_history
+from mail.mail.doctype.mime_message.mime_message import get_mime_messages
 from mail.utils.dt import convert_to_utc
 from mail.utils.rate_limiter import dynamic_rate_limit
 
@@ -162,10 +163,8 @@ def get_raw_incoming_mails(
 			"last_synced_mail": None,
 		}
 
-	MIME = frappe.qb.DocType("MIME Message")
-	mails = (
-		frappe.qb.from_(MIME).select(MIME.message).where(MIME.name.isin([d._message for d in data]))
-	).run(pluck="message")
+	messages = get_mime_messages([d._message for d in data])
+	mails = [messages[d._message] for d in data if d._message in messages]
 	return {
 		"mails": mails,
 		"last_synced_at": data[-1].processed_at,
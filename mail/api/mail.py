@@ -1,14 +1,48 @@
+import base64
+import json
 import re
+from collections import defaultdict
 from email.utils import parseaddr
 
 import frappe
 from bs4 import BeautifulSoup
+from frappe import _
+from frappe.query_builder import Order
 from frappe.translate import get_all_translations
-from frappe.utils import is_html
 
+from mail.mail.doctype.mail_search_index.mail_search_index import get_search_criterion
+from mail.utils import get_latest_content, get_snippet
 from mail.utils.cache import get_account_for_user, get_default_outgoing_email_for_user
 from mail.utils.user import has_role, is_system_manager
 
+MAIL_LIST_PAGE_LENGTH = 50
+MAIL_LIST_FIELDS = [
+	"name",
+	"sender",
+	"display_name",
+	"subject",
+	"snippet",
+	"creation",
+	"message_id",
+	"thread_id",
+]
+MAIL_FIELDS = [
+	"name",
+	"subject",
+	"body_html",
+	"body_plain",
+	"latest_content",
+	"sender",
+	"display_name",
+	"creation",
+	"modified",
+	"message_id",
+	"thread_id",
+	"in_reply_to_mail_name",
+	"in_reply_to_mail_type",
+	"folder",
+]
+
 
 def check_app_permission() -> bool:
 	"""Returns True if the user has permission to access the app."""
@@ -64,232 +98,221 @@ def get_translations() -> dict:
 
 
 @frappe.whitelist()
-def get_incoming_mails(start: int = 0) -> list:
-	"""Returns incoming mails for the current user."""
+def get_incoming_mails(cursor: str | None = None) -> dict:
+	"""Returns a page of incoming mails for the current user."""
 
 	account = get_account_for_user(frappe.session.user)
-	mails = frappe.get_all(
-		"Incoming Mail",
-		{"receiver": account, "docstatus": 1},
-		[
-			"name",
-			"sender",
-			"body_html",
-			"body_plain",
-			"display_name",
-			"subject",
-			"creation",
-			"in_reply_to_mail_name",
-			"in_reply_to_mail_type",
-			"message_id",
-		],
-		limit=50,
-		start=start,
-		order_by="created_at desc",
-	)
-
-	return get_mail_list(mails, "Incoming Mail")
+	return get_mail_page("Incoming Mail", {"receiver": account, "docstatus": 1}, "created_at", cursor)
 
 
 @frappe.whitelist()
-def get_sent_mails(start: int = 0) -> list:
-	"""Returns sent mails for the current user."""
+def get_sent_mails(cursor: str | None = None) -> dict:
+	"""Returns a page of sent mails for the current user."""
 
-	return get_outgoing_mails("Sent", start)
+	return get_outgoing_mails("Sent", cursor)
 
 
 @frappe.whitelist()
-def get_draft_mails(start: int = 0) -> list:
-	"""Returns draft mails for the current user."""
+def get_draft_mails(cursor: str | None = None) -> dict:
+	"""Returns a page of draft mails for the current user."""
 
-	return get_outgoing_mails("Draft", start)
+	return get_outgoing_mails("Draft", cursor)
 
 
-def get_outgoing_mails(status: str, start: int = 0) -> list:
-	"""Returns outgoing mails for the current user."""
+def get_outgoing_mails(status: str, cursor: str | None = None) -> dict:
+	"""Returns a page of outgoing mails for the current user."""
 
 	account = get_account_for_user(frappe.session.user)
 
 	if status == "Draft":
-		docstatus = 0
-		order_by = "modified desc"
+		# Drafts have no `created_at` until they are submitted.
+		docstatus, sort_field = 0, "modified"
 	else:
-		docstatus = 1
-		# TODO: fix sorting
-		order_by = "created_at desc"
-
-	mails = frappe.get_all(
-		"Outgoing Mail",
-		{"sender": account, "docstatus": docstatus, "status": status},
-		[
-			"name",
-			"subject",
-			"sender",
-			"body_html",
-			"body_plain",
-			"creation",
-			"display_name",
-			"in_reply_to_mail_name",
-			"in_reply_to_mail_type",
-			"message_id",
-		],
-		limit=50,
-		start=start,
-		order_by=order_by,
-	)
+		docstatus, sort_field = 1, "created_at"
 
-	return get_mail_list(mails, "Outgoing Mail")
+	filters = {"sender": account, "docstatus": docstatus, "status": status}
+	return get_mail_page("Outgoing Mail", filters, sort_field, cursor)
 
 
-def get_mail_list(mails, mail_type) -> list:
-	"""Returns a list of mails with additional details."""
+@frappe.whitelist()
+def search_mails(txt: str, cursor: str | None = None) -> dict:
+	"""Returns a page of the incoming and outgoing mails of the current user containing the words of the
+	text, newest first."""
 
-	for mail in mails[:]:
-		mail.mail_type = mail_type
-		thread = get_list_thread(mail)
-		thread_with_names = [email.name for email in thread]
-		mails_in_original_list = [email for email in mails if email.name in thread_with_names]
-		if len(mails_in_original_list) > 1:
-			latest_mail = max(mails_in_original_list, key=lambda x: x.creation)
-			mails_in_original_list.remove(latest_mail)
+	user = frappe.session.user
+	MSI = frappe.qb.DocType("Mail Search Index")
 
-			for email in mails_in_original_list:
-				mails.remove(email)
+	if not (criterion := get_search_criterion(MSI, txt)):
+		return {"mails": [], "next_cursor": None}
 
-	for mail in mails:
-		mail.latest_content = get_latest_content(mail.body_html, mail.body_plain)
-		mail.snippet = get_snippet(mail.latest_content) if mail.latest_content else ""
+	query = frappe.qb.from_(MSI).select(MSI.name, MSI.mail_type).where(criterion)
 
-	return mails
+	# Scoped as the permission query conditions of Incoming Mail and Outgoing Mail.
+	if not is_system_manager(user):
+		if not (account := get_account_for_user(user)):
+			return {"mails": [], "next_cursor": None}
 
+		query = query.where(MSI.account == account)
 
-def get_list_thread(mail) -> list:
-	"""Returns a list of mails in the thread."""
+	results, next_cursor = get_page(query, MSI, "created_at", cursor)
+	return {"mails": get_search_results(results), "next_cursor": next_cursor}
 
-	thread = []
-	processed = set()
 
-	def add_to_thread(mail):
-		if mail.name in processed:
-			return
-		processed.add(mail.name)
-		thread.append(mail)
+def get_search_results(results: list) -> list:
+	"""Returns the mails of the search results in order, with one query per mail type."""
 
-		if mail.in_reply_to_mail_name:
-			reply_mail = get_mail_details(mail.in_reply_to_mail_name, mail.in_reply_to_mail_type, False)
-			add_to_thread(reply_mail)
-		if mail.message_id:
-			replica_name = find_replica(mail, mail.mail_type)
-			if replica_name:
-				replica = get_mail_details(replica_name, reverse_type(mail.mail_type), False)
-				add_to_thread(replica)
+	mails = {}
+	for mail_type in {result.mail_type for result in results}:
+		names = [result.name for result in results if result.mail_type == mail_type]
+		mails_of_type = frappe.get_all(mail_type, {"name": ["in", names]}, MAIL_LIST_FIELDS)
 
-	add_to_thread(mail)
-	return thread
+		for mail in mails_of_type:
+			mail.mail_type = mail_type
+			mails[mail.name] = mail
 
+		set_missing_snippets(mails_of_type, mail_type)
 
-def get_latest_content(html, plain) -> str:
-	"""Returns the latest content from the mail."""
+	# Mails deleted without their index entry are skipped.
+	return [mails[result.name] for result in results if result.name in mails]
 
-	content = html if html else plain
-	if content is None:
-		return ""
 
-	if is_html(content):
-		soup = BeautifulSoup(content, "html.parser")
-		blockquote = soup.find("blockquote")
-		if blockquote:
-			blockquote.extract()
-		return soup.get_text(strip=True)
+def get_mail_page(mail_type: str, filters: dict, sort_field: str, cursor: str | None = None) -> dict:
+	"""Returns the mails matching the filters, newest first, after the cursor, and the cursor of the next page."""
 
-	return content
+	MAIL = frappe.qb.DocType(mail_type)
+	query = frappe.qb.from_(MAIL).select(*[MAIL[field] for field in MAIL_LIST_FIELDS])
 
+	for field, value in filters.items():
+		query = query.where(MAIL[field] == value)
 
-def get_snippet(content) -> str:
-	"""Returns a snippet of the content."""
+	mails, next_cursor = get_page(query, MAIL, sort_field, cursor)
+	return {"mails": get_mail_list(mails, mail_type), "next_cursor": next_cursor}
 
-	content = re.sub(
-		r"(?<=[.,])(?=[^\s])", r" ", content
-	)  # add space after . and , if not followed by a space
-	return " ".join(content.split()[:50])
 
+def get_page(query, table, sort_field: str, cursor: str | None = None) -> tuple[list, str | None]:
+	"""Returns the rows of the query, newest first by `sort_field` and name, after the cursor, and the cursor
+	of the next page (None on the last page).
 
-@frappe.whitelist()
-def get_mail_thread(name, mail_type) -> list:
-	"""Returns the mail thread for the given mail."""
+	The page is sought with a keyset condition on (`sort_field`, name), so that its cost does not depend on
+	how deep the page is.
+	"""
+
+	query = (
+		query.select(table[sort_field])
+		.orderby(table[sort_field], order=Order.desc)
+		.orderby(table.name, order=Order.desc)
+		.limit(MAIL_LIST_PAGE_LENGTH + 1)
+	)
 
-	mail = get_mail_details(name, mail_type, True)
-	mail.mail_type = mail_type
+	if cursor:
+		value, name = decode_cursor(cursor)
+		if value is None:
+			# Rows without a value are sorted last.
+			query = query.where(table[sort_field].isnull() & (table.name < name))
+		else:
+			query = query.where(
+				(table[sort_field] < value)
+				| ((table[sort_field] == value) & (table.name < name))
+				| table[sort_field].isnull()
+			)
 
-	original_replica = find_replica(mail, mail_type)
+	rows = query.run(as_dict=True)
 
-	thread = []
-	visited = set()
+	next_cursor = None
+	if len(rows) > MAIL_LIST_PAGE_LENGTH:
+		rows = rows[:MAIL_LIST_PAGE_LENGTH]
+		next_cursor = encode_cursor(rows[-1][sort_field], rows[-1].name)
 
-	def get_thread(mail, thread):
-		thread.append(mail)
-		if mail.name in visited:
-			return
-		visited.add(mail.name)
+	return rows, next_cursor
 
-		if mail.in_reply_to_mail_name:
-			reply_mail = get_mail_details(mail.in_reply_to_mail_name, mail.in_reply_to_mail_type, True)
-			get_thread(reply_mail, thread)
 
-		replica = find_replica(mail, mail.mail_type)
-		if replica and replica != name:
-			replica_type = reverse_type(mail.mail_type)
-			replica_mail = get_mail_details(replica, replica_type, True)
-			replica_mail.mail_type = replica_type
-			get_thread(replica_mail, thread)
-		else:
-			replies = []
-			replies += gather_thread_replies(name)
-			if original_replica:
-				replies += gather_thread_replies(original_replica)
+def encode_cursor(value, name: str) -> str:
+	"""Returns an opaque cursor for the position after the given sort value and name."""
 
-			for reply in replies:
-				if reply.name not in visited:
-					get_thread(reply, thread)
+	position = json.dumps([str(value) if value is not None else None, name])
+	return base64.urlsafe_b64encode(position.encode()).decode()
 
-	get_thread(mail, thread)
-	thread = remove_duplicates_and_sort(thread)
-	return thread
 
+def decode_cursor(cursor: str) -> tuple[str | None, str]:
+	"""Returns the sort value and name of the position encoded in the cursor."""
 
-def reverse_type(mail_type) -> str:
-	"""Returns the reverse mail type."""
+	try:
+		value, name = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+	except (ValueError, TypeError):
+		frappe.throw(_("Invalid cursor."))
 
-	return "Incoming Mail" if mail_type == "Outgoing Mail" else "Outgoing Mail"
+	return value, name
 
 
-def gather_thread_replies(mail_name) -> list:
-	"""Gathers all replies in the thread."""
+def get_mail_list(mails, mail_type) -> list:
+	"""Returns the latest mail of each thread in the list, with additional details."""
 
-	thread = []
-	thread += get_thread_from_replies("Outgoing Mail", mail_name)
-	thread += get_thread_from_replies("Incoming Mail", mail_name)
-	return thread
+	latest_mails = {}
+	for mail in mails:
+		mail.mail_type = mail_type
+		thread_id = get_thread_key(mail)
+		if thread_id not in latest_mails or mail.creation > latest_mails[thread_id].creation:
+			latest_mails[thread_id] = mail
 
+	mails = [mail for mail in mails if latest_mails[get_thread_key(mail)] is mail]
+	set_missing_snippets(mails, mail_type)
+
+	return mails
 
-def get_thread_from_replies(mail_type, mail_name) -> list:
-	"""Returns the thread from the replies."""
 
-	replies = []
-	emails = frappe.get_all(mail_type, {"in_reply_to_mail_name": mail_name, "docstatus": 1}, pluck="name")
-	for email in emails:
-		reply = get_mail_details(email, mail_type, True)
-		reply.mail_type = mail_type
-		replies.append(reply)
+def get_thread_key(mail) -> str:
+	"""Returns the thread id of the mail, falling back to its message id or name if it has none."""
 
-	return replies
+	return mail.thread_id or mail.message_id or mail.name
 
 
-def find_replica(mail, mail_type) -> str:
-	"""Returns the replica of the mail."""
+def set_missing_snippets(mails, mail_type) -> None:
+	"""Sets the snippet of the mails stored before snippets were set on ingest and not backfilled yet."""
+
+	if not (missing := {mail.name: mail for mail in mails if mail.snippet is None}):
+		return
 
-	replica_type = reverse_type(mail_type)
-	return frappe.db.exists(replica_type, {"message_id": mail.message_id})
+	for body in frappe.db.get_all(
+		mail_type, {"name": ["in", list(missing)]}, ["name", "body_html", "body_plain"]
+	):
+		missing[body.name].snippet = get_snippet(get_latest_content(body.body_html, body.body_plain))
+
+
+@frappe.whitelist()
+def get_mail_thread(name, mail_type) -> list:
+	"""Returns the mail thread for the given mail.
+
+	The mails of the thread are loaded by thread id, so that the number of queries does not depend on the
+	depth of the thread.
+	"""
+
+	if mail_type not in ["Incoming Mail", "Outgoing Mail"]:
+		frappe.throw(_("Invalid mail type."))
+
+	frappe.has_permission(mail_type, "read", name, throw=True)
+
+	user = frappe.session.user
+	mail = get_mail_details(name, mail_type)
+	thread = [mail]
+
+	# Thread ids are Message-IDs shared across mailboxes, so the thread is scoped to the mailbox of the user
+	# as the permission query conditions of Incoming Mail and Outgoing Mail.
+	is_scoped = not is_system_manager(user)
+	account = get_account_for_user(user) if is_scoped else None
+
+	# Outgoing Mail comes first, so that the sent copy of a mail delivered to a local mailbox is kept.
+	for thread_mail_type in ["Outgoing Mail", "Incoming Mail"]:
+		filters = {"thread_id": get_thread_key(mail), "docstatus": 1}
+		if is_scoped:
+			filters["sender" if thread_mail_type == "Outgoing Mail" else "receiver"] = account
+
+		for thread_mail in frappe.get_all(thread_mail_type, filters, MAIL_FIELDS):
+			thread_mail.mail_type = thread_mail_type
+			thread.append(thread_mail)
+
+	thread = remove_duplicates_and_sort(thread)
+	add_mail_details(thread)
+	return thread
 
 
 def remove_duplicates_and_sort(thread) -> list:
@@ -305,40 +328,52 @@ def remove_duplicates_and_sort(thread) -> list:
 def get_mail_details(name: str, type: str, include_all_details: bool = False) -> dict:
 	"""Returns the mail details."""
 
-	fields = [
-		"name",
-		"subject",
-		"body_html",
-		"body_plain",
-		"sender",
-		"display_name",
-		"creation",
-		"modified",
-		"message_id",
-		"in_reply_to_mail_name",
-		"in_reply_to_mail_type",
-		"folder",
-	]
-
-	mail = frappe.db.get_value(type, name, fields, as_dict=1)
+	mail = frappe.db.get_value(type, name, MAIL_FIELDS, as_dict=1)
 	mail.mail_type = type
 
-	if not include_all_details:
-		return mail
+	if include_all_details:
+		add_mail_details([mail])
 
-	if not mail.get("display_name"):
-		mail.display_name = frappe.db.get_value("User", mail.sender, "full_name")
-
-	mail.user_image = frappe.db.get_value("User", mail.sender, "user_image")
-	mail.latest_content = get_latest_content(mail.body_html, mail.body_plain)
-	mail.to = get_recipients(name, type, "To")
-	mail.cc = get_recipients(name, type, "Cc")
-	mail.bcc = get_recipients(name, type, "Bcc")
-	mail.body_html = extract_email_body(mail.body_html)
-	mail.mail_type = type
 	return mail
 
 
+def add_mail_details(mails: list) -> None:
+	"""Adds the recipients, sender profile and latest content to the mails, with one query for the recipients
+	and one for the users of all mails."""
+
+	if not mails:
+		return
+
+	recipients = get_recipients(mails)
+	emails = {mail.sender for mail in mails} | {r.email for rs in recipients.values() for r in rs}
+	users = {
+		user.name: user
+		for user in frappe.db.get_all(
+			"User", {"name": ["in", list(emails)]}, ["name", "full_name", "user_image"]
+		)
+	}
+
+	for mail in mails:
+		user = users.get(mail.sender) or frappe._dict()
+		mail_recipients = recipients.get((mail.mail_type, mail.name), [])
+
+		for recipient in mail_recipients:
+			if not recipient.display_name and recipient.email in users:
+				recipient.display_name = users[recipient.email].full_name
+
+		if not mail.get("display_name"):
+			mail.display_name = user.full_name
+
+		mail.user_image = user.user_image
+		if mail.latest_content is None:
+			mail.latest_content = get_latest_content(mail.body_html, mail.body_plain)
+
+		mail.to = [r for r in mail_recipients if r.type == "To"]
+		mail.cc = [r for r in mail_recipients if r.type == "Cc"]
+		mail.bcc = [r for r in mail_recipients if r.type == "Bcc"]
+		mail.body_html = extract_email_body(mail.body_html)
+
+
 def extract_email_body(html) -> str | None:
 	"""Extracts the email body from the html content."""
 
@@ -351,18 +386,18 @@ def extract_email_body(html) -> str | None:
 	return html
 
 
-def get_recipients(name, type, recipient_type) -> list:
-	"""Returns the recipients of the mail."""
+def get_recipients(mails: list) -> dict[tuple[str, str], list]:
+	"""Returns the recipients of the mails by mail type and name."""
 
-	recipients = frappe.get_all(
+	recipients = defaultdict(list)
+	for recipient in frappe.db.get_all(
 		"Mail Recipient",
-		{"parent": name, "parenttype": type, "type": recipient_type},
-		["email", "display_name", "type"],
-	)
-
-	for recipient in recipients:
-		if not recipient.display_name:
-			recipient.display_name = frappe.db.get_value("User", recipient.email, "full_name")
+		{"parent": ["in", [mail.name for mail in mails]]},
+		["parent", "parenttype", "email", "display_name", "type"],
+		order_by="idx asc",
+	):
+		parent = (recipient.pop("parenttype"), recipient.pop("parent"))
+		recipients[parent].append(recipient)
 
 	return recipients
 
@@ -1,14 +1,16 @@
+import re
+
 import frappe
 from frappe import _
-from frappe.query_builder import Case
 
+from mail.mail.doctype.outgoing_mail.outgoing_mail import record_open
 from mail.utils.rate_limiter import dynamic_rate_limit
 
 
 @frappe.whitelist(methods=["GET"], allow_guest=True)
 @dynamic_rate_limit()
 def open() -> None:
-	"""Updates Outgoing Mail opened status."""
+	"""Records the open of the Outgoing Mail, written to the database later by `flush_opens`."""
 
 	try:
 		id = frappe.request.args.get("id")
@@ -16,20 +18,11 @@ def open() -> None:
 		if not id:
 			frappe.throw(_("Tracking ID is required - {0}.").format(frappe.local.request_ip))
 
-		now = frappe.utils.now()
-		OM = frappe.qb.DocType("Outgoing Mail")
-		(
-			frappe.qb.update(OM)
-			.set(
-				OM.first_opened_at,
-				Case().when(OM.first_opened_at.isnull(), now).else_(OM.first_opened_at),
-			)
-			.set(OM.last_opened_at, now)
-			.set(OM.open_count, OM.open_count + 1)
-			.set(OM.last_opened_from_ip, frappe.local.request_ip)
-			.where((OM.docstatus == 1) & (OM.tracking_id == id))
-		).run()
-		frappe.db.commit()
+		# Tracking IDs are UUID hex strings, anything else would only fill the cache.
+		if not re.fullmatch(r"[0-9a-f]{32}", id):
+			frappe.throw(_("Invalid Tracking ID - {0}.").format(frappe.local.request_ip))
+
+		record_open(id, frappe.local.request_ip)
 	except Exception:
 		frappe.log_error(title="mail.api.track.open", message=frappe.get_traceback())
 	finally:
@@ -0,0 +1,28 @@
+import click
+from frappe.commands import get_site, pass_context
+
+
+@click.command("mail-inbound-listener")
+@click.option("--refresh-interval", default=60, help="Seconds between refreshes of the watched accounts.")
+@pass_context
+def inbound_listener(context, refresh_interval: int = 60) -> None:
+	"""Hold IMAP IDLE sessions for the enabled accounts and fetch new mail as soon as it arrives."""
+
+	import frappe
+
+	from mail.mail.doctype.incoming_mail.incoming_mail import run_inbound_listener
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+
+	try:
+		frappe.set_user("Administrator")
+		run_inbound_listener(refresh_interval=refresh_interval)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		frappe.destroy()
+
+
+commands = [inbound_listener]
@@ -209,10 +209,11 @@ scheduler_events = {
 	# ],
 	"daily": [
 		"mail.tasks.enqueue_delete_newsletters",
+		"mail.tasks.enqueue_delete_old_open_events",
+	],
+	"hourly": [
+		"mail.tasks.enqueue_set_sent_counts",
 	],
-	# "hourly": [
-	#     "mail.tasks.hourly"
-	# ],
 	# "weekly": [
 	#     "mail.tasks.weekly"
 	# ],
@@ -223,6 +224,7 @@ scheduler_events = {
 		"*/2 * * * *": [
 			"mail.tasks.enqueue_transfer_mails_to_mail_agent",
 			"mail.tasks.enqueue_fetch_emails_from_mail_agents",
+			"mail.tasks.enqueue_flush_opens",
 		]
 	},
 }
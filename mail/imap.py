@@ -1,12 +1,22 @@
+import re
+import selectors
+import ssl
 import time
-from collections.abc import Generator
-from contextlib import contextmanager
+from collections.abc import Callable, Generator
+from contextlib import contextmanager, suppress
 from imaplib import IMAP4, IMAP4_SSL
 from queue import Queue
 from threading import Lock, Thread
 
 from mail.utils.cache import get_imap_limits
 
+IMAP_FETCH_BATCH_SIZE = 200
+# Servers may drop IDLE sessions after 30 minutes of inactivity (RFC 2177), so they are renewed well before.
+IMAP_IDLE_RENEW_INTERVAL = 10 * 60
+# Each IDLE session holds a connection (and a file descriptor) open, so the inbound listener watches at most
+# this many mailboxes unless `imap_idle_max_mailboxes` is set.
+IMAP_IDLE_MAX_MAILBOXES = 500
+
 
 class IMAPConnectionLimitError(Exception):
 	pass
@@ -240,3 +250,322 @@ def imap_server(
 	finally:
 		if _connection:
 			_pool.return_connection(_connection)
+
+
+def uid_search(session: IMAP4 | IMAP4_SSL, criteria: str = "ALL") -> list[int]:
+	"""Returns the UIDs of the messages in the selected mailbox matching the criteria."""
+
+	status, data = session.uid("SEARCH", None, criteria)
+	if status != "OK" or not data or not data[0]:
+		return []
+
+	return [int(uid) for uid in data[0].split()]
+
+
+def uid_fetch_messages(
+	session: IMAP4 | IMAP4_SSL, uids: list[int], batch_size: int = IMAP_FETCH_BATCH_SIZE
+) -> Generator[tuple[int, bytes], None, None]:
+	"""Yields the UID and raw content of the messages, fetched with one `UID FETCH <ranges> (BODY.PEEK[])` per batch.
+
+	`BODY.PEEK[]` leaves the `\\Seen` flag untouched, the messages are marked deleted by `uid_delete_messages`.
+	"""
+
+	for idx in range(0, len(uids), batch_size):
+		batch = uids[idx : idx + batch_size]
+		status, data = session.uid("FETCH", get_uid_sequence_set(batch), "(UID BODY.PEEK[])")
+		if status != "OK":
+			continue
+
+		# Each message is a tuple of (b'<seq> (UID <uid> BODY[] {<size>}', <content>), followed by b')'.
+		for item in data:
+			if isinstance(item, tuple) and (match := re.search(rb"UID (\d+)", item[0])):
+				yield int(match.group(1)), item[1]
+
+
+def uid_delete_messages(session: IMAP4 | IMAP4_SSL, uids: list[int], batch_size: int = 1000) -> None:
+	"""Marks the messages as deleted with `UID STORE` and expunges them.
+
+	Uses `UID EXPUNGE` when the server supports UIDPLUS, so only the given messages are expunged.
+	"""
+
+	if not uids:
+		return
+
+	for idx in range(0, len(uids), batch_size):
+		sequence_set = get_uid_sequence_set(uids[idx : idx + batch_size])
+		session.uid("STORE", sequence_set, "+FLAGS.SILENT", r"(\Deleted)")
+
+		if "UIDPLUS" in session.capabilities:
+			session.uid("EXPUNGE", sequence_set)
+
+	if "UIDPLUS" not in session.capabilities:
+		session.expunge()
+
+
+def get_uid_sequence_set(uids: list[int]) -> str:
+	"""Returns the IMAP sequence set of the UIDs with consecutive UIDs collapsed into ranges.
+
+	Example:
+	    get_uid_sequence_set([1, 2, 3, 7, 9, 10]) -> "1:3,7,9:10"
+	"""
+
+	ranges = []
+	for uid in sorted(set(uids)):
+		if ranges and uid == ranges[-1][1] + 1:
+			ranges[-1][1] = uid
+		else:
+			ranges.append([uid, uid])
+
+	return ",".join(str(start) if start == end else f"{start}:{end}" for start, end in ranges)
+
+
+class IMAPIdleListener:
+	"""Holds IDLE sessions for multiple mailboxes in a single thread and calls `on_new_messages` with the
+	key of the mailbox as soon as the server reports new messages (untagged `EXISTS`).
+
+	Connections are taken from the `IMAPConnectionPool` and returned to it when a mailbox is unwatched.
+
+	Example:
+	    listener = IMAPIdleListener(on_new_messages=print)
+	    listener.watch("user@example.com", "imap.example.com", 993, "user@example.com", "secret", use_ssl=True)
+	    while True:
+	        listener.poll(timeout=30)
+	"""
+
+	def __init__(
+		self, on_new_messages: Callable[[str], None], renew_interval: int = IMAP_IDLE_RENEW_INTERVAL
+	) -> None:
+		self._pool = IMAPConnectionPool()
+		self._selector = selectors.DefaultSelector()
+		self._sessions: dict[str, dict] = {}
+		self.on_new_messages = on_new_messages
+		self.renew_interval = renew_interval
+
+	@property
+	def keys(self) -> list[str]:
+		return list(self._sessions)
+
+	def watch(
+		self,
+		key: str,
+		host: str,
+		port: int,
+		username: str,
+		password: str,
+		use_ssl: bool = False,
+		folder: str = "Inbox",
+	) -> None:
+		"""Selects the folder of the mailbox and starts an IDLE session for it."""
+
+		if key in self._sessions:
+			return
+
+		connection = self._pool.get_connection(host, port, username, password, use_ssl)
+
+		try:
+			status, _ = connection.session.select(f'"{folder}"')
+			if status != "OK":
+				raise connection.session.error(f"Failed to select folder {folder}")
+
+			tag = start_idle(connection.session)
+		except Exception:
+			connection.close()
+			raise
+
+		self._sessions[key] = {
+			"connection": connection,
+			"tag": tag,
+			"started_at": time.monotonic(),
+			"data": b"",
+		}
+		self._selector.register(connection.session.sock, selectors.EVENT_READ, key)
+
+		try:
+			# Responses read ahead along with the continuation of IDLE would not wake up the selector.
+			has_new_messages = self._read_responses(key)
+		except Exception:
+			self._drop(key)
+			raise
+
+		if has_new_messages:
+			self.on_new_messages(key)
+
+	def unwatch(self, key: str) -> None:
+		"""Ends the IDLE session of the mailbox and returns its connection to the pool."""
+
+		if not (session := self._sessions.pop(key, None)):
+			return
+
+		connection: IMAPConnection = session["connection"]
+		self._selector.unregister(connection.session.sock)
+
+		try:
+			stop_idle(connection.session, session["tag"])
+		except Exception:
+			connection.close()
+		else:
+			self._pool.return_connection(connection)
+
+	def poll(self, timeout: float | None = None) -> None:
+		"""Waits up to `timeout` seconds for server responses, notifies mailboxes with new messages and renews
+		IDLE sessions that are due. Mailboxes whose connection fails are dropped, so that they can be watched again.
+		"""
+
+		events = self._selector.select(timeout)
+
+		for key in dict.fromkeys(event.data for event, _ in events):
+			try:
+				if self._read_responses(key):
+					self.on_new_messages(key)
+			except Exception:
+				self._drop(key)
+
+		for key, session in list(self._sessions.items()):
+			if time.monotonic() - session["started_at"] >= self.renew_interval:
+				try:
+					self._renew(key)
+				except Exception:
+					self._drop(key)
+
+	def close(self) -> None:
+		"""Ends all IDLE sessions."""
+
+		for key in self.keys:
+			self.unwatch(key)
+
+		self._selector.close()
+
+	def _read_responses(self, key: str) -> bool:
+		"""Reads the available responses of the IDLE session and returns True if new messages were reported."""
+
+		session = self._sessions[key]
+		if (data := read_available(session["connection"].session)) is None:
+			raise ConnectionError(f"IMAP connection closed by the server for {key}")
+
+		*lines, session["data"] = (session["data"] + data).split(b"\r\n")
+
+		if any(line.startswith(b"* BYE") for line in lines):
+			raise ConnectionError(f"IMAP connection closed by the server for {key}")
+
+		return any(is_exists_response(line) for line in lines)
+
+	def _renew(self, key: str) -> None:
+		"""Ends and restarts the IDLE session, notifying new messages reported while ending it."""
+
+		session = self._sessions[key]
+		imap = session["connection"].session
+		responses = stop_idle(imap, session["tag"])
+		if session["data"] and responses:
+			# The start of the first response was already read by `_read_responses`.
+			responses[0] = session["data"] + responses[0]
+
+		session["tag"] = start_idle(imap)
+		session["started_at"] = time.monotonic()
+		session["data"] = b""
+		session["connection"].last_used = time.time()
+
+		# Responses read ahead along with the continuation of IDLE would not wake up the selector.
+		has_new_messages = self._read_responses(key)
+
+		if has_new_messages or any(is_exists_response(line) for line in responses):
+			self.on_new_messages(key)
+
+	def _drop(self, key: str) -> None:
+		if session := self._sessions.pop(key, None):
+			self._selector.unregister(session["connection"].session.sock)
+			session["connection"].close()
+
+
+class IMAPSessionAdapter:
+	"""Wraps the internals of an `imaplib` session that running IDLE depends on, as `imaplib` has no public
+	API for it: the tag counter, the registry of tagged commands and the buffered reader of the socket.
+	"""
+
+	def __init__(self, session: IMAP4 | IMAP4_SSL) -> None:
+		self.session = session
+
+	def new_tag(self) -> bytes:
+		"""Returns the tag of a new command, registered with the session."""
+
+		return self.session._new_tag()
+
+	def discard_tag(self, tag: bytes) -> None:
+		"""Removes the command with the tag from the session once its response has been read."""
+
+		self.session.tagged_commands.pop(tag, None)
+
+	def read_buffered(self) -> bytes:
+		"""Returns the bytes read ahead by `readline` into the buffered reader of the session. The socket must
+		be non-blocking, as the reader reads from it once its buffer is empty."""
+
+		data = b""
+		with suppress(BlockingIOError, ssl.SSLWantReadError):
+			while chunk := self.session.file.read1(65536):
+				data += chunk
+
+		return data
+
+
+def start_idle(session: IMAP4 | IMAP4_SSL) -> bytes:
+	"""Sends the IDLE command and returns its tag once the server accepts it."""
+
+	adapter = IMAPSessionAdapter(session)
+	tag = adapter.new_tag()
+	session.send(tag + b" IDLE\r\n")
+
+	while True:
+		line = session.readline()
+		if line.startswith(b"+"):
+			return tag
+
+		if line.startswith(tag):
+			adapter.discard_tag(tag)
+			raise session.error(f"IDLE failed: {line.decode(errors='replace').strip()}")
+
+
+def stop_idle(session: IMAP4 | IMAP4_SSL, tag: bytes) -> list[bytes]:
+	"""Ends the IDLE command with the given tag and returns the untagged responses received meanwhile."""
+
+	session.send(b"DONE\r\n")
+
+	responses = []
+	while not (line := session.readline()).startswith(tag):
+		responses.append(line.rstrip(b"\r\n"))
+
+	IMAPSessionAdapter(session).discard_tag(tag)
+
+	if not line[len(tag) :].strip().startswith(b"OK"):
+		raise session.error(f"IDLE failed: {line.decode(errors='replace').strip()}")
+
+	return responses
+
+
+def is_exists_response(line: bytes) -> bool:
+	"""Returns True if the line is an untagged `EXISTS` response, e.g. `* 23 EXISTS`."""
+
+	return bool(re.match(rb"\* \d+ EXISTS", line))
+
+
+def read_available(session: IMAP4 | IMAP4_SSL) -> bytes | None:
+	"""Returns the bytes received on the session without blocking, or None if the server closed the connection.
+
+	`readline` reads ahead into the buffered reader of imaplib, so the bytes buffered there are returned first.
+	The socket is then read until it would block, which also drains the bytes buffered by the SSL layer, so that
+	nothing is left where the selector cannot see it.
+	"""
+
+	data = b""
+	timeout = session.sock.gettimeout()
+	session.sock.settimeout(0)
+
+	try:
+		data += IMAPSessionAdapter(session).read_buffered()
+
+		while chunk := session.sock.recv(65536):
+			data += chunk
+	except (BlockingIOError, ssl.SSLWantReadError):
+		return data
+	finally:
+		session.sock.settimeout(timeout)
+
+	return data or None
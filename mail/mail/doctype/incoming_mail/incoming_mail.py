@@ -9,39 +9,62 @@ from typing import TYPE_CHECKING, Literal
 import frappe
 from frappe import _
 from frappe.model.document import Document
-from frappe.utils import now, time_diff_in_seconds
+from frappe.utils import cint, create_batch, now, time_diff_in_seconds
+from frappe.utils.password import get_decrypted_password
 from uuid_utils import uuid7
 
-from mail.imap import IMAPContext
+from mail.imap import (
+	IMAP_FETCH_BATCH_SIZE,
+	IMAP_IDLE_MAX_MAILBOXES,
+	IMAP_IDLE_RENEW_INTERVAL,
+	IMAPContext,
+	IMAPIdleListener,
+	uid_delete_messages,
+	uid_fetch_messages,
+	uid_search,
+)
 from mail.mail.doctype.bounce_history.bounce_history import create_or_update_bounce_history
 from mail.mail.doctype.dmarc_report.dmarc_report import create_dmarc_report
-from mail.mail.doctype.mail_contact.mail_contact import create_mail_contact
-from mail.mail.doctype.mime_message.mime_message import (
-	create_mime_message,
-	get_mime_message,
-	update_mime_message,
+from mail.mail.doctype.mail_contact.mail_contact import create_mail_contact, create_mail_contacts
+from mail.mail.doctype.mail_search_index.mail_search_index import index_mails, remove_mail_from_index
+from mail.mail.doctype.mime_message.mime_message import MIMEMessageField, create_mime_messages
+from mail.utils import (
+	bulk_insert_docs,
+	get_dmarc_address,
+	get_in_reply_to_mail,
+	get_in_reply_to_mails,
+	get_latest_content,
+	get_snippet,
+	get_thread_ids,
+	load_compressed_file,
+)
+from mail.utils.cache import get_account_for_user, get_imap_limits
+from mail.utils.email_parser import (
+	EmailParser,
+	extract_ip_and_host,
+	extract_spam_status,
+	remove_unreferenced_files,
 )
-from mail.utils import get_dmarc_address, get_in_reply_to_mail, load_compressed_file
-from mail.utils.cache import get_account_for_user
-from mail.utils.email_parser import EmailParser, extract_ip_and_host, extract_spam_status
+from mail.utils.metrics import record_metrics
 from mail.utils.user import is_account_owner, is_system_manager
 
 if TYPE_CHECKING:
 	from mail.mail.doctype.outgoing_mail.outgoing_mail import OutgoingMail
 
 
+FETCH_LOCK_TIMEOUT = 10 * 60
+# Deletes the lock only if it still holds the token, atomically.
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+	return redis.call("del", KEYS[1])
+end
+return 0
+"""
+INBOUND_LISTENER_RETRY_INTERVAL = 5 * 60
+
+
 class IncomingMail(Document):
-	@property
-	def message(self) -> str | None:
-		if self._message:
-			return get_mime_message(self._message)
-
-	@message.setter
-	def message(self, value: str | bytes) -> None:
-		if self._message:
-			update_mime_message(self._message, value)
-		else:
-			self._message = create_mime_message(value)
+	message = MIMEMessageField("_message", as_bytes=True)
 
 	def autoname(self) -> None:
 		self.name = str(uuid7())
@@ -54,15 +77,19 @@ class IncomingMail(Document):
 
 	def on_submit(self) -> None:
 		self.create_mail_contact()
+		index_mails([self])
 		self.sync_with_frontend()
 
 	def on_cancel(self) -> None:
 		self.status = "Cancelled"
+		remove_mail_from_index(self.name)
 
 	def on_trash(self) -> None:
 		if frappe.session.user != "Administrator":
 			frappe.throw(_("Only Administrator can delete Incoming Mail."))
 
+		remove_mail_from_index(self.name)
+
 	def validate_fetched_at(self) -> None:
 		"""Set `fetched_at` to current datetime if not set."""
 
@@ -95,10 +122,16 @@ class IncomingMail(Document):
 		self.from_ip, self.from_host = extract_ip_and_host(parser.get_header("Received"))
 		self.is_spam, self.spam_score = extract_spam_status(parser.get_header("X-Spam-Status"))
 		self.in_reply_to = parser.get_in_reply_to()
-		self.in_reply_to_mail_type, self.in_reply_to_mail_name = get_in_reply_to_mail(self.in_reply_to)
+		self.flags.references = parser.get_references()
+
+		# Resolved for the whole batch by `create_incoming_mails`.
+		if not self.flags.in_bulk_insert:
+			self.in_reply_to_mail_type, self.in_reply_to_mail_name = get_in_reply_to_mail(self.in_reply_to)
+			self.set_thread_id()
 
 		parser.save_attachments(self.doctype, self.name, is_private=True)
 		self.body_html, self.body_plain = parser.get_body()
+		self.set_snippet()
 
 		for recipient in parser.get_recipients():
 			self.append("recipients", recipient)
@@ -109,11 +142,8 @@ class IncomingMail(Document):
 		if self.receiver == get_dmarc_address():
 			self.create_dmarc_report()
 
-		if (
-			parser.message.get_content_type() == "multipart/report"
-			and parser.message.get_param("report-type") == "delivery-status"
-		):
-			self.process_dsn_report(parser.message)
+		if parser.is_dsn_report():
+			self.process_dsn_report(parser)
 
 		if self.created_at:
 			self.fetched_after = time_diff_in_seconds(self.fetched_at, self.created_at)
@@ -121,6 +151,27 @@ class IncomingMail(Document):
 		self.processed_at = now()
 		self.processed_after = time_diff_in_seconds(self.processed_at, self.fetched_at)
 
+	def set_snippet(self) -> None:
+		"""Sets the latest content and snippet shown in the mail list and thread."""
+
+		self.latest_content = get_latest_content(self.body_html, self.body_plain)
+		self.snippet = get_snippet(self.latest_content)
+
+	def set_thread_id(self) -> None:
+		"""Sets the thread id from the Message ID, In-Reply-To and References."""
+
+		self.thread_id = get_thread_ids([self.get_thread_args()])[0]
+
+	def get_thread_args(self) -> dict:
+		"""Returns the arguments of the mail for `get_thread_ids`."""
+
+		return {
+			"name": self.name,
+			"message_id": self.message_id,
+			"in_reply_to": self.in_reply_to,
+			"references": self.flags.references,
+		}
+
 	def create_dmarc_report(self) -> None:
 		"""Creates a DMARC Report from the Incoming Mail."""
 
@@ -132,7 +183,8 @@ class IncomingMail(Document):
 			)
 			for attachment in attachments:
 				file = frappe.get_doc("File", attachment)
-				xml_content = load_compressed_file(file_data=file.get_content())
+				# Read from disk by path, the compressed report is not loaded into memory as a whole.
+				xml_content = load_compressed_file(file_path=file.get_full_path())
 				create_dmarc_report(xml_content, incoming_mail=self.name)
 
 			self.type = "DMARC Report"
@@ -142,38 +194,16 @@ class IncomingMail(Document):
 				message=frappe.get_traceback(with_context=True),
 			)
 
-	def process_dsn_report(self, message) -> None:
+	def process_dsn_report(self, parser: EmailParser) -> None:
 		"""Processes the DSN Report."""
 
 		try:
-			original_envelope_id = None
-			for part in message.walk():
-				if part.get("Original-Envelope-Id"):
-					original_envelope_id = part.get("Original-Envelope-Id")
-					break
+			original_envelope_id = parser.parts.original_envelope_id
 
 			if not original_envelope_id:
 				frappe.throw(_("Original Envelope Id not found in DSN Report."))
 
-			dsn_data = []
-			required_headers = [
-				"Final-Recipient",
-				"Action",
-				"Status",
-				"Diagnostic-Code",
-				"Remote-MTA",
-			]
-			_rcpt_data = {}
-			for part in message.walk():
-				for header in required_headers:
-					if part.get(header):
-						_rcpt_data[header] = part.get(header)
-
-				if len(_rcpt_data) == len(required_headers):
-					dsn_data.append(_rcpt_data)
-					_rcpt_data = {}
-
-			for rcpt_data in dsn_data:
+			for rcpt_data in parser.parts.dsn_recipients:
 				final_recipient = rcpt_data["Final-Recipient"].split("rfc822;")[1].strip()
 				diagnostic_code = rcpt_data["Diagnostic-Code"].split("smtp;")[1].strip()
 				remote_mta = rcpt_data["Remote-MTA"].split("dns;")[1].strip()
@@ -289,7 +319,7 @@ def create_incoming_mail(
 	receiver: str,
 	folder: Literal["Inbox", "Spam"],
 	agent_group: str,
-	message: str,
+	message: str | bytes,
 	do_not_save: bool = False,
 	do_not_submit: bool = False,
 ) -> "IncomingMail":
@@ -314,15 +344,109 @@ def create_incoming_mail(
 	return doc
 
 
-def fetch_emails_from_mail_agent(agent_group: str, accounts: list[str]) -> None:
+def create_incoming_mails(
+	receiver: str,
+	folder: Literal["Inbox", "Spam"],
+	agent_group: str,
+	messages: list[str | bytes],
+) -> list[str]:
+	"""Creates and submits Incoming Mails for the messages of an account and returns their names.
+
+	The mails, their recipients and MIME messages are written with multi-row inserts, and the contacts and the
+	realtime update are handled once for the batch. Falls back to `create_incoming_mail` per message if the
+	bulk insert fails.
+	"""
+
+	if not messages:
+		return []
+
+	frappe.db.savepoint("create_incoming_mails")
+
+	try:
+		docs = []
+		fetched_at = now()
+
+		for mime_message, message in zip(create_mime_messages(messages), messages, strict=True):
+			doc = frappe.new_doc("Incoming Mail")
+			doc.autoname()
+			doc.receiver = receiver
+			doc.folder = folder
+			doc.agent_group = agent_group
+			doc.fetched_at = fetched_at
+			doc._message = mime_message
+			IncomingMail.message.cache(doc, message)
+			doc.flags.in_bulk_insert = True
+
+			try:
+				doc.validate_mandatory_fields()
+				doc.process()
+				doc.docstatus = 1
+			except Exception:
+				# Kept as a draft, as `create_incoming_mail` does when the submit fails.
+				doc.status = "Draft"
+				frappe.log_error(title=_("Submit Incoming Mail"), message=frappe.get_traceback())
+
+			for recipient in doc.recipients:
+				recipient.autoname()
+
+			docs.append(doc)
+
+		in_reply_to_mails = get_in_reply_to_mails([doc.in_reply_to for doc in docs])
+		thread_ids = get_thread_ids([doc.get_thread_args() for doc in docs])
+		for doc, thread_id in zip(docs, thread_ids, strict=True):
+			doc.thread_id = thread_id
+			if doc.type != "DSN Report" and doc.in_reply_to in in_reply_to_mails:
+				doc.in_reply_to_mail_type, doc.in_reply_to_mail_name = in_reply_to_mails[doc.in_reply_to]
+
+		bulk_insert_docs(docs)
+	except Exception:
+		# The attachments are already written to disk and would be written again by the fallback.
+		attachments = frappe.db.get_all(
+			"File",
+			{"attached_to_doctype": "Incoming Mail", "attached_to_name": ["in", [doc.name for doc in docs]]},
+			["file_url", "is_private"],
+		)
+		frappe.db.rollback(save_point="create_incoming_mails")
+		remove_unreferenced_files(attachments)
+		frappe.log_error(title=_("Bulk Create Incoming Mails"), message=frappe.get_traceback())
+		return [create_incoming_mail(receiver, folder, agent_group, message).name for message in messages]
+
+	submitted = [doc for doc in docs if doc.docstatus == 1]
+	index_mails(submitted)
+
+	if submitted and frappe.get_cached_value("Mail Account", receiver, "create_mail_contact"):
+		user = frappe.get_cached_value("Mail Account", receiver, "user")
+		create_mail_contacts(user, {doc.sender: doc.display_name for doc in submitted if doc.sender})
+
+	if submitted:
+		frappe.publish_realtime(
+			"incoming_mail_received",
+			{"receiver": receiver, "folder": folder, "mails": [doc.name for doc in submitted]},
+			user=receiver,
+			after_commit=True,
+		)
+
+	return [doc.name for doc in docs]
+
+
+def fetch_emails_from_mail_agent(agent_group: str, accounts: list[str], shard: int | str = 0) -> None:
 	"""Called by scheduler to fetch emails from mail agent."""
 
+	started_at = time.monotonic()
 	folders = ["Inbox", "Junk Mail"]
+	summary = {"accounts_scanned": 0, "accounts_failed": 0, "accounts_skipped": 0, "messages_pulled": 0}
 
 	for account in accounts:
 		max_failures = 3
 		total_failures = 0
 
+		# The mailbox may already be fetched by a scheduled shard or a fetch enqueued by the inbound listener.
+		if not (lock_token := acquire_fetch_lock(agent_group, account)):
+			summary["accounts_skipped"] += 1
+			continue
+
+		lock_account = account
+
 		try:
 			account = frappe.get_cached_doc("Mail Account", account)
 			username = account.email
@@ -336,26 +460,48 @@ def fetch_emails_from_mail_agent(agent_group: str, accounts: list[str]) -> None:
 						if status != "OK":
 							break
 
-						status, message_numbers = server.search(None, "ALL")
-						if status != "OK" or not message_numbers[0]:
+						if not (uids := uid_search(server)):
 							break
 
-						for num in message_numbers[0].split():
-							status, data = server.fetch(num, "(RFC822)")
+						# Fetch each batch with a single `UID FETCH` of UID ranges and delete the pulled
+						# messages with a single `UID STORE` and `UID EXPUNGE`.
+						messages_pulled = summary["messages_pulled"]
+						for batch in create_batch(uids, IMAP_FETCH_BATCH_SIZE):
+							pulled_uids, messages = [], []
+							for uid, message in uid_fetch_messages(server, batch, IMAP_FETCH_BATCH_SIZE):
+								pulled_uids.append(uid)
+								messages.append(message)
+
+							create_incoming_mails(account.name, _folder, agent_group, messages)
 
-							if status == "OK" and data:
-								message = data[0][1].decode("utf-8")
-								create_incoming_mail(account.name, _folder, agent_group, message)
-								server.store(num, "+FLAGS", r"(\Deleted)")
+							# Commit before deleting the messages from the agent, so that a failed job
+							# does not lose the mails pulled so far.
+							frappe.db.commit()
+							uid_delete_messages(server, pulled_uids)
+							summary["messages_pulled"] += len(pulled_uids)
+
+						if summary["messages_pulled"] == messages_pulled:
+							break
 
-						server.expunge()
+			summary["accounts_scanned"] += 1
 		except Exception:
+			summary["accounts_failed"] += 1
 			total_failures += 1
 			error_log = frappe.get_traceback(with_context=False)
 			frappe.log_error(title=_(f"Fetch Emails {agent_group} : {account.email}"), message=error_log)
 
 			if total_failures < max_failures:
 				time.sleep(2**total_failures)
+		finally:
+			release_fetch_lock(agent_group, lock_account, lock_token)
+
+	record_metrics(
+		f"fetch_emails_from_mail_agent|{agent_group}|{shard}",
+		agent_group=agent_group,
+		shard=shard,
+		**summary,
+		duration=round(time.monotonic() - started_at, 3),
+	)
 
 
 def fetch_emails_from_mail_agents(
@@ -370,19 +516,154 @@ def fetch_emails_from_mail_agents(
 	if not agent_groups:
 		return
 
-	accounts = accounts or frappe.db.get_all("Mail Account", {"enabled": 1}, pluck="name")
+	accounts = accounts or frappe.db.get_all("Mail Account", {"enabled": 1}, pluck="name", order_by="name")
 	if not accounts:
 		return
 
+	# Shard the accounts across jobs, one IMAP connection per job, so that at most `imap_max_connections`
+	# sessions are open per agent group. Accounts are assigned round-robin in a stable order, so a shard
+	# still running from the previous run is deduplicated instead of being enqueued again.
+	shard_count = max(min(cint(get_imap_limits()["max_connections"]), len(accounts)), 1)
+	shards = [accounts[idx::shard_count] for idx in range(shard_count)]
+
 	if frappe.flags.do_not_enqueue:
 		for group in agent_groups:
-			fetch_emails_from_mail_agent(group, accounts)
+			for idx, shard in enumerate(shards):
+				fetch_emails_from_mail_agent(group, shard, idx)
 	else:
 		for group in agent_groups:
-			frappe.enqueue(
-				fetch_emails_from_mail_agent,
-				queue="long",
-				job_name=f"Fetch Emails from {group}",
-				agent_group=group,
-				accounts=accounts,
-			)
+			for idx, shard in enumerate(shards):
+				frappe.enqueue(
+					fetch_emails_from_mail_agent,
+					queue="long",
+					job_name=f"Fetch Emails from {group} ({idx + 1}/{shard_count})",
+					job_id=f"fetch_emails_from_mail_agent|{group}|{idx}",
+					deduplicate=True,
+					agent_group=group,
+					accounts=shard,
+					shard=idx,
+				)
+
+	record_metrics(
+		"fetch_emails_from_mail_agents",
+		agent_groups=len(agent_groups),
+		accounts=len(accounts),
+		shards_per_group=shard_count,
+	)
+
+
+def acquire_fetch_lock(agent_group: str, account: str) -> str | None:
+	"""Returns the token of the fetch lock of the mailbox if it was acquired. The lock expires on its own, so
+	that a crashed job does not block the mailbox."""
+
+	token = uuid7().hex
+	key = frappe.cache.make_key(get_fetch_lock_key(agent_group, account))
+	return token if frappe.cache.set(key, token, nx=True, ex=FETCH_LOCK_TIMEOUT) else None
+
+
+def release_fetch_lock(agent_group: str, account: str, token: str) -> None:
+	"""Releases the fetch lock of the mailbox if it is still held with the token, so that a job whose lock
+	expired does not release the lock of the next fetch."""
+
+	key = frappe.cache.make_key(get_fetch_lock_key(agent_group, account))
+	frappe.cache.eval(RELEASE_LOCK_SCRIPT, 1, key, token)
+
+
+def get_fetch_lock_key(agent_group: str, account: str) -> str:
+	"""Returns the cache key of the fetch lock of the mailbox."""
+
+	return f"fetch-emails-lock|{agent_group}|{account}"
+
+
+def run_inbound_listener(refresh_interval: int = 60, poll_timeout: int = 5) -> None:
+	"""Holds IMAP IDLE sessions for the enabled accounts of the inbound agent groups and enqueues a fetch of
+	the account as soon as new mail arrives. Runs until interrupted, the scheduled fetch remains the fallback."""
+
+	idle_timeout = cint(get_imap_limits()["idle_timeout"])
+	renew_interval = (
+		min(IMAP_IDLE_RENEW_INTERVAL, idle_timeout // 2) if idle_timeout else IMAP_IDLE_RENEW_INTERVAL
+	)
+	listener = IMAPIdleListener(
+		on_new_messages=enqueue_fetch_emails_for_mailbox, renew_interval=renew_interval
+	)
+	retry_after = {}
+	refreshed_at = None
+
+	try:
+		while True:
+			if refreshed_at is None or time.monotonic() - refreshed_at >= refresh_interval:
+				refresh_inbound_listener(listener, retry_after)
+				refreshed_at = time.monotonic()
+
+			listener.poll(timeout=poll_timeout)
+	finally:
+		listener.close()
+
+
+def refresh_inbound_listener(listener: IMAPIdleListener, retry_after: dict[str, float]) -> None:
+	"""Watches the mailboxes of newly enabled accounts and unwatches the ones of disabled accounts."""
+
+	# End the transaction, so that accounts enabled or disabled since the last refresh are seen.
+	frappe.db.rollback()
+
+	agent_groups = frappe.db.get_all("Mail Agent Group", {"enabled": 1, "inbound": 1}, pluck="name")
+	accounts = frappe.db.get_all("Mail Account", {"enabled": 1}, ["name", "email"], order_by="name")
+	mailboxes = {
+		get_mailbox_key(agent_group, account.name): (agent_group, account)
+		for agent_group in agent_groups
+		for account in accounts
+	}
+
+	# Each watched mailbox holds an IMAP connection open, the others are fetched by the scheduled job only.
+	max_mailboxes = cint(get_imap_limits().get("idle_max_mailboxes")) or IMAP_IDLE_MAX_MAILBOXES
+	mailboxes = dict(list(mailboxes.items())[:max_mailboxes])
+
+	watched = set(listener.keys)
+	for key in watched - set(mailboxes):
+		listener.unwatch(key)
+
+	for key, (agent_group, account) in mailboxes.items():
+		if key in watched or retry_after.get(key, 0) > time.monotonic():
+			continue
+
+		try:
+			password = get_decrypted_password("Mail Account", account.name, "password")
+			listener.watch(key, agent_group, 993, account.email, password, use_ssl=True)
+			retry_after.pop(key, None)
+		except Exception:
+			retry_after[key] = time.monotonic() + INBOUND_LISTENER_RETRY_INTERVAL
+			frappe.log_error(title=_("Inbound Listener {0}").format(key), message=frappe.get_traceback())
+
+	frappe.db.commit()
+	record_metrics(
+		"inbound_listener",
+		mailboxes=len(mailboxes),
+		watched=len(listener.keys),
+		retrying=len(retry_after),
+	)
+
+
+def enqueue_fetch_emails_for_mailbox(key: str) -> None:
+	"""Enqueues a fetch of the mailbox with the given key, called by the inbound listener on new mail."""
+
+	agent_group, account = key.split("|", 1)
+	frappe.enqueue(
+		fetch_emails_from_mail_agent,
+		queue="short",
+		job_id=f"fetch_emails_from_mail_agent|{key}",
+		deduplicate=True,
+		agent_group=agent_group,
+		accounts=[account],
+		shard="idle",
+	)
+
+
+def get_mailbox_key(agent_group: str, account: str) -> str:
+	"""Returns the key of the mailbox of the account on the agent group."""
+
+	return f"{agent_group}|{account}"
+
+
+def on_doctype_update() -> None:
+	# Serves the inbox listing, which is sought by (created_at, name); InnoDB appends the primary key.
+	frappe.db.add_index("Incoming Mail", ["receiver", "docstatus", "created_at"])
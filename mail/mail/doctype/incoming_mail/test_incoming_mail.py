@@ -1,9 +1,91 @@
 # Copyright (c) 2024, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
+import select
+import socket
+from contextlib import suppress
+from imaplib import IMAP4
+from threading import Thread
+
+from frappe.tests import UnitTestCase
 from frappe.tests.utils import FrappeTestCase
 
+from mail.imap import IMAPSessionAdapter, read_available, start_idle, stop_idle
+
+
+class FakeIMAPServer:
+	"""An IMAP stand-in that answers CAPABILITY and IDLE, reporting a new message along with the continuation
+	of IDLE and another one before ending it."""
+
+	def __init__(self) -> None:
+		self.server = socket.create_server(("127.0.0.1", 0))
+		self.port = self.server.getsockname()[1]
+		self.conn = None
+		Thread(target=self._serve, daemon=True).start()
+
+	def _serve(self) -> None:
+		self.conn, _ = self.server.accept()
+		file = self.conn.makefile("rb")
+		self.conn.sendall(b"* OK [CAPABILITY IMAP4rev1 IDLE] Ready\r\n")
+		idle_tag = None
+
+		while line := file.readline():
+			tag, _, command = line.strip().partition(b" ")
+			if tag == b"DONE":
+				self.conn.sendall(b"* 4 EXISTS\r\n" + idle_tag + b" OK IDLE terminated\r\n")
+			elif command == b"CAPABILITY":
+				self.conn.sendall(b"* CAPABILITY IMAP4rev1 IDLE\r\n" + tag + b" OK Completed\r\n")
+			elif command == b"IDLE":
+				idle_tag = tag
+				self.conn.sendall(b"+ idling\r\n* 3 EXISTS\r\n")
+
+	def close(self) -> None:
+		if self.conn:
+			with suppress(OSError):
+				self.conn.shutdown(socket.SHUT_RDWR)
+			self.conn.close()
+
+		self.server.close()
+
+
+class UnitTestIMAPSessionAdapter(UnitTestCase):
+	def setUp(self) -> None:
+		self.server = FakeIMAPServer()
+		self.session = IMAP4("127.0.0.1", self.server.port, timeout=5)
+
+	def tearDown(self) -> None:
+		self.session.shutdown()
+		self.server.close()
+
+	def test_tags(self) -> None:
+		adapter = IMAPSessionAdapter(self.session)
+		tags = [adapter.new_tag(), adapter.new_tag()]
+
+		self.assertNotEqual(tags[0], tags[1])
+		self.assertTrue(all(tag in self.session.tagged_commands for tag in tags))
+
+		adapter.discard_tag(tags[0])
+		self.assertNotIn(tags[0], self.session.tagged_commands)
+
+	def test_idle(self) -> None:
+		tag = start_idle(self.session)
+
+		# The response read ahead along with the continuation is returned from the buffer of the session.
+		self.assertEqual(read_available(self.session), b"* 3 EXISTS\r\n")
+		self.assertEqual(read_available(self.session), b"")
+		self.assertEqual(self.session.sock.gettimeout(), 5)
+
+		self.assertEqual(stop_idle(self.session, tag), [b"* 4 EXISTS"])
+		self.assertNotIn(tag, self.session.tagged_commands)
+
+	def test_read_available_closed(self) -> None:
+		start_idle(self.session)
+		read_available(self.session)
+		self.server.close()
+		select.select([self.session.sock], [], [], 5)
+
+		self.assertIsNone(read_available(self.session))
+
 
 class TestIncomingMail(FrappeTestCase):
 	pass
@@ -5,6 +5,7 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 
+from mail.utils import bulk_insert_docs
 from mail.utils.user import is_system_manager
 
 
@@ -45,6 +46,39 @@ def create_mail_contact(user: str, email: str, display_name: str | None = None)
 		doc.insert(ignore_permissions=True)
 
 
+def create_mail_contacts(user: str, contacts: dict[str, str | None]) -> None:
+	"""Creates the mail contacts of the user from a mapping of email to display name, looking up the existing
+	contacts with a single query and inserting the new ones with a multi-row insert."""
+
+	if not contacts:
+		return
+
+	# Emails are compared case-insensitively, as by the `IN` lookup and the unique index of the table.
+	existing = {
+		contact.email.lower(): contact
+		for contact in frappe.db.get_all(
+			"Mail Contact",
+			{"user": user, "email": ["in", list(contacts)]},
+			["name", "email", "display_name"],
+		)
+	}
+
+	new_contacts = {}
+	for email, display_name in contacts.items():
+		if contact := existing.get(email.lower()):
+			if display_name != contact.display_name:
+				frappe.db.set_value("Mail Contact", contact.name, "display_name", display_name)
+		elif email.lower() not in new_contacts:
+			doc = frappe.new_doc("Mail Contact")
+			doc.name = frappe.generate_hash(length=10)
+			doc.user = user
+			doc.email = email
+			doc.display_name = display_name
+			new_contacts[email.lower()] = doc
+
+	bulk_insert_docs(list(new_contacts.values()))
+
+
 def has_permission(doc: "Document", ptype: str, user: str | None = None) -> bool:
 	if doc.doctype != "Mail Contact":
 		return False
@@ -0,0 +1,55 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_days, now, today
+from uuid_utils import uuid7
+
+OPEN_EVENT_RETENTION_DAYS = 90
+
+
+class MailOpenEvent(Document):
+	pass
+
+
+def create_mail_open_events(events: list[dict]) -> None:
+	"""Appends the open events to the log with a multi-row insert.
+
+	Each event carries the `outgoing_mail`, its `domain_name` and `sender`, `opened_at` and `ip_address`.
+	"""
+
+	if not events:
+		return
+
+	timestamp = now()
+	fields = ["name", "creation", "modified", "owner", "modified_by"]
+	fields += ["outgoing_mail", "domain_name", "sender", "opened_at", "ip_address"]
+
+	frappe.db.bulk_insert(
+		"Mail Open Event",
+		fields,
+		[
+			(
+				str(uuid7()),
+				timestamp,
+				timestamp,
+				frappe.session.user,
+				frappe.session.user,
+				event["outgoing_mail"],
+				event["domain_name"],
+				event["sender"],
+				event["opened_at"],
+				event["ip_address"],
+			)
+			for event in events
+		],
+	)
+
+
+def delete_old_open_events(retention_days: int = OPEN_EVENT_RETENTION_DAYS) -> None:
+	"""Called by the scheduler to delete the open events older than the retention. Their counts are kept in
+	the Mail Open Rollups."""
+
+	MOE = frappe.qb.DocType("Mail Open Event")
+	frappe.qb.from_(MOE).where(MOE.opened_at < add_days(today(), -retention_days)).delete().run()
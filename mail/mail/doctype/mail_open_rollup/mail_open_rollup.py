@@ -0,0 +1,94 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.query_builder.functions import Count
+from frappe.utils import add_days, create_batch, now, today
+from pypika.terms import Values
+from uuid_utils import uuid7
+
+
+class MailOpenRollup(Document):
+	pass
+
+
+def add_to_open_rollups(rollups: dict[tuple[str, str, str], dict[str, int]]) -> None:
+	"""Adds the counts to the rollups by (date, domain name, sender), creating the missing rollups.
+
+	Example:
+	    add_to_open_rollups({("2026-01-01", "example.com", "user@example.com"): {"opened": 1, "opens": 3}})
+	"""
+
+	upsert_open_rollups(rollups, increment=True)
+
+
+def set_sent_counts(dates: list[str] | None = None) -> None:
+	"""Called by the scheduler to set the number of tracked mails submitted on the dates (today and yesterday
+	by default) in the rollups."""
+
+	OM = frappe.qb.DocType("Outgoing Mail")
+
+	for date in dates or [add_days(today(), -1), today()]:
+		mails = (
+			frappe.qb.from_(OM)
+			.select(OM.domain_name, OM.sender, Count("*").as_("sent"))
+			.where(
+				(OM.docstatus == 1)
+				& (OM.tracking_id.isnotnull())
+				& (OM.submitted_at >= date)
+				& (OM.submitted_at < add_days(date, 1))
+			)
+			.groupby(OM.domain_name, OM.sender)
+		).run(as_dict=True)
+
+		upsert_open_rollups(
+			{(str(date), mail.domain_name, mail.sender): {"sent": mail.sent} for mail in mails},
+			increment=False,
+		)
+
+
+def upsert_open_rollups(
+	rollups: dict[tuple[str, str, str], dict[str, int]], increment: bool, chunk_size: int = 500
+) -> None:
+	"""Inserts the rollups by (date, domain name, sender), or adds the counts to (or replaces the counts of) the
+	existing ones, with one `INSERT ... ON DUPLICATE KEY UPDATE` statement per chunk. All rollups must carry
+	the same counts."""
+
+	if not rollups:
+		return
+
+	MOR = frappe.qb.DocType("Mail Open Rollup")
+	timestamp = now()
+	fields = list(next(iter(rollups.values())))
+
+	for chunk in create_batch(list(rollups.items()), chunk_size):
+		query = frappe.qb.into(MOR).columns(
+			"name", "creation", "modified", "owner", "modified_by", "date", "domain_name", "sender", *fields
+		)
+
+		for (date, domain_name, sender), counts in chunk:
+			query = query.insert(
+				str(uuid7()),
+				timestamp,
+				timestamp,
+				frappe.session.user,
+				frappe.session.user,
+				date,
+				domain_name,
+				sender,
+				*[counts[field] for field in fields],
+			)
+
+		for field in fields:
+			query = query.on_duplicate_key_update(
+				MOR[field], MOR[field] + Values(MOR[field]) if increment else Values(MOR[field])
+			)
+
+		query.on_duplicate_key_update(MOR.modified, Values(MOR.modified)).run()
+
+
+def on_doctype_update() -> None:
+	frappe.db.add_unique(
+		"Mail Open Rollup", ["date", "domain_name", "sender"], constraint_name="unique_date_domain_sender"
+	)
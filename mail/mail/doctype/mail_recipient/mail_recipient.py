@@ -5,7 +5,39 @@ import frappe
 from frappe.model.document import Document
 from uuid_utils import uuid7
 
+from mail.utils import bulk_update
+
 
 class MailRecipient(Document):
 	def autoname(self) -> None:
 		self.name = str(uuid7())
+
+
+class RecipientStatusWriter:
+	"""Collects status changes of Mail Recipients and writes them with a single statement."""
+
+	def __init__(self) -> None:
+		self._updates = {}
+		self.rows_affected = 0
+
+	def __len__(self) -> int:
+		return len(self._updates)
+
+	def add(self, recipient: "MailRecipient | dict", status: str, error_message: str | None = None) -> None:
+		"""Queues the status change of the recipient and updates it in memory."""
+
+		recipient.status = status
+		recipient.error_message = error_message
+		self._updates[recipient.name] = {"status": status, "error_message": error_message}
+
+	def flush(self) -> int:
+		"""Writes the queued status changes and returns the number of rows affected."""
+
+		if not self._updates:
+			return 0
+
+		rows_affected = bulk_update("Mail Recipient", self._updates)
+		self.rows_affected += rows_affected
+		self._updates = {}
+
+		return rows_affected
@@ -0,0 +1,134 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import re
+from typing import TYPE_CHECKING
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import now
+from pypika.terms import Criterion, Term, ValueWrapper
+
+from mail.utils import convert_html_to_text
+
+if TYPE_CHECKING:
+	from frappe.query_builder import Table
+
+FULLTEXT_INDEX = "mail_search"
+FULLTEXT_FIELDS = ["subject", "sender", "recipients", "body"]
+# Words that the InnoDB FULLTEXT index doesn't store (`innodb_ft_min_token_size` and the default stopword
+# list), so that a required term made of one of them never matches.
+FULLTEXT_MIN_TOKEN_SIZE = 3
+FULLTEXT_STOPWORDS = frozenset(
+	"a about an are as at be by com de en for from how i in is it la of on or that the this to was what when "
+	"where who will with und www".split()
+)
+
+
+class MailSearchIndex(Document):
+	pass
+
+
+class Match(Criterion):
+	"""MariaDB `MATCH (...) AGAINST (... IN BOOLEAN MODE)` criterion for the query builder."""
+
+	def __init__(self, columns: list[Term], against: str) -> None:
+		super().__init__()
+		self.columns = columns
+		self.against = ValueWrapper(against)
+
+	def nodes_(self):
+		yield self
+		for column in self.columns:
+			yield from column.nodes_()
+		yield from self.against.nodes_()
+
+	def get_sql(self, **kwargs) -> str:
+		columns = ", ".join(column.get_sql(**kwargs) for column in self.columns)
+		return f"MATCH ({columns}) AGAINST ({self.against.get_sql(**kwargs)} IN BOOLEAN MODE)"
+
+
+def index_mails(mails: list[dict | Document]) -> None:
+	"""Adds the submitted incoming and outgoing mails to the search index with a multi-row insert.
+
+	The mails may be documents or dicts carrying the same fields, with `doctype` and `recipients` set.
+	Newsletters are not indexed.
+	"""
+
+	timestamp = now()
+	rows = []
+
+	for mail in mails:
+		if mail.get("is_newsletter"):
+			continue
+
+		account = mail.get("receiver") if mail.get("doctype") == "Incoming Mail" else mail.get("sender")
+		recipients = [(r.get("display_name"), r.get("email")) for r in mail.get("recipients") or []]
+		rows.append(
+			(
+				mail.get("name"),
+				timestamp,
+				timestamp,
+				frappe.session.user,
+				frappe.session.user,
+				mail.get("doctype"),
+				account,
+				mail.get("created_at"),
+				mail.get("subject"),
+				join_text(mail.get("display_name"), mail.get("sender")),
+				join_text(*[value for recipient in recipients for value in recipient]),
+				mail.get("body_plain") or convert_html_to_text(mail.get("body_html")),
+			)
+		)
+
+	if rows:
+		fields = ["name", "creation", "modified", "owner", "modified_by", "mail_type", "account"]
+		fields += ["created_at", *FULLTEXT_FIELDS]
+		frappe.db.bulk_insert("Mail Search Index", fields, rows, ignore_duplicates=True)
+
+
+def remove_mail_from_index(name: str) -> None:
+	"""Removes the mail from the search index."""
+
+	frappe.db.delete("Mail Search Index", name)
+
+
+def get_search_criterion(table: "Table", txt: str) -> Criterion | None:
+	"""Returns the criterion matching the mails that contain all the words of the text, as prefixes, or None
+	if the text has no words.
+
+	Stopwords and words shorter than the minimum token size aren't indexed, so they are left out of the
+	full-text criterion. If only such words remain, the fields are matched with `LIKE` instead.
+	"""
+
+	if not (words := re.findall(r"\w+", txt or "")):
+		return None
+
+	if terms := [
+		word
+		for word in words
+		if len(word) >= FULLTEXT_MIN_TOKEN_SIZE and word.lower() not in FULLTEXT_STOPWORDS
+	]:
+		return Match([table[field] for field in FULLTEXT_FIELDS], " ".join(f"+{term}*" for term in terms))
+
+	# `_` is the only `LIKE` wildcard that a word can contain.
+	patterns = ["%{}%".format(word.replace("_", "\\_")) for word in words]
+	return Criterion.all(
+		[Criterion.any([table[field].like(pattern) for field in FULLTEXT_FIELDS]) for pattern in patterns]
+	)
+
+
+def join_text(*values: str | None) -> str:
+	"""Returns the non-empty values joined by spaces."""
+
+	return " ".join(value for value in values if value)
+
+
+def on_doctype_update() -> None:
+	frappe.db.add_index("Mail Search Index", ["account", "created_at"])
+
+	if not frappe.db.has_index("tabMail Search Index", FULLTEXT_INDEX):
+		columns = ", ".join(f"`{field}`" for field in FULLTEXT_FIELDS)
+		frappe.db.sql_ddl(
+			f"ALTER TABLE `tabMail Search Index` ADD FULLTEXT INDEX `{FULLTEXT_INDEX}` ({columns})"
+		)
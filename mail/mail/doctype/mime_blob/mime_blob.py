@@ -0,0 +1,214 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import base64
+import hashlib
+import os
+import zlib
+from collections.abc import Generator
+from contextlib import suppress
+from io import BytesIO
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+from typing import BinaryIO
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import cint, flt, now
+
+BLOB_DIRECTORY = "mime"
+CHUNK_SIZE = 1024 * 1024
+SPOOL_SIZE = 5 * 1024 * 1024
+GZIP_WBITS = 31  # zlib window bits for a gzip container
+BLOB_FIELDS = ["storage", "compression", "file_path", "data"]
+
+
+class MIMEBlob(Document):
+	def on_trash(self) -> None:
+		if self.storage == "File" and self.file_path:
+			with suppress(FileNotFoundError):
+				os.remove(get_blob_path(self.file_path))
+
+
+def store_mime_blob(file: BinaryIO, chunk_size: int = CHUNK_SIZE) -> str:
+	"""Stores the content of the file compressed and deduplicated by its SHA-256 hash and returns the name of the MIME Blob."""
+
+	size = 0
+	sha256 = hashlib.sha256()
+	compressor = zlib.compressobj(wbits=GZIP_WBITS)
+
+	with SpooledTemporaryFile(max_size=SPOOL_SIZE) as compressed:
+		while chunk := file.read(chunk_size):
+			size += len(chunk)
+			sha256.update(chunk)
+			compressed.write(compressor.compress(chunk))
+
+		compressed.write(compressor.flush())
+		content_hash = sha256.hexdigest()
+
+		if frappe.db.exists("MIME Blob", content_hash):
+			return content_hash
+
+		compressed_size = compressed.tell()
+		compressed.seek(0)
+
+		doc = frappe.new_doc("MIME Blob")
+		doc.compression = "gzip"
+		doc.size = size
+		doc.compressed_size = compressed_size
+
+		if compressed_size > get_file_storage_threshold():
+			doc.storage = "File"
+			doc.file_path = write_blob_file(content_hash, compressed, chunk_size)
+		else:
+			doc.storage = "Database"
+			doc.data = base64.b64encode(compressed.read()).decode("ascii")
+
+		try:
+			doc.insert(ignore_permissions=True, set_name=content_hash)
+		except frappe.DuplicateEntryError:
+			# Stored concurrently by another worker with the same content.
+			pass
+
+	return content_hash
+
+
+def store_mime_blobs(contents: list[bytes]) -> list[str]:
+	"""Stores the contents like `store_mime_blob`, looking up existing blobs with a single query and inserting
+	the new ones with a multi-row insert, and returns the names of the MIME Blobs in order."""
+
+	hashes = [hashlib.sha256(content).hexdigest() for content in contents]
+	if not hashes:
+		return hashes
+
+	existing = set(frappe.db.get_all("MIME Blob", {"name": ["in", list(set(hashes))]}, pluck="name"))
+	threshold = get_file_storage_threshold()
+	timestamp = now()
+	rows = {}
+
+	for content_hash, content in zip(hashes, contents, strict=True):
+		if content_hash in existing or content_hash in rows:
+			continue
+
+		compressor = zlib.compressobj(wbits=GZIP_WBITS)
+		compressed = compressor.compress(content) + compressor.flush()
+
+		storage, file_path, data = "Database", None, None
+		if len(compressed) > threshold:
+			storage = "File"
+			file_path = write_blob_file(content_hash, BytesIO(compressed))
+		else:
+			data = base64.b64encode(compressed).decode("ascii")
+
+		rows[content_hash] = (
+			content_hash,
+			timestamp,
+			timestamp,
+			frappe.session.user,
+			frappe.session.user,
+			"gzip",
+			storage,
+			file_path,
+			len(content),
+			len(compressed),
+			data,
+		)
+
+	if rows:
+		fields = ["name", "creation", "modified", "owner", "modified_by", "compression", "storage"]
+		fields += ["file_path", "size", "compressed_size", "data"]
+		# Blobs stored concurrently by another worker with the same content are skipped.
+		frappe.db.bulk_insert("MIME Blob", fields, list(rows.values()), ignore_duplicates=True)
+
+	return hashes
+
+
+def iter_mime_blob(name: str, chunk_size: int = CHUNK_SIZE) -> Generator[bytes, None, None]:
+	"""Returns an iterator over the decompressed content of the MIME Blob in chunks of at most `chunk_size`
+	bytes. The blob is looked up and opened before returning, so that a missing blob raises here."""
+
+	blob = frappe.db.get_value("MIME Blob", name, BLOB_FIELDS, as_dict=True)
+
+	if not blob:
+		frappe.throw(_("MIME Blob {0} not found.").format(frappe.bold(name)))
+
+	return _iter_blob(blob, chunk_size)
+
+
+def read_mime_blob(name: str) -> bytes:
+	"""Returns the decompressed content of the MIME Blob."""
+
+	return b"".join(iter_mime_blob(name))
+
+
+def read_mime_blobs(names: list[str]) -> dict[str, bytes]:
+	"""Returns the decompressed content of the MIME Blobs by name, loading their rows with a single query."""
+
+	if not names:
+		return {}
+
+	MB = frappe.qb.DocType("MIME Blob")
+	blobs = (
+		frappe.qb.from_(MB)
+		.select(MB.name, *[MB[field] for field in BLOB_FIELDS])
+		.where(MB.name.isin(list(set(names))))
+	).run(as_dict=True)
+
+	return {blob.name: b"".join(_iter_blob(blob)) for blob in blobs}
+
+
+def _iter_blob(blob: dict, chunk_size: int = CHUNK_SIZE) -> Generator[bytes, None, None]:
+	if blob.storage == "File":
+		source = open(get_blob_path(blob.file_path), "rb")
+	else:
+		source = BytesIO(base64.b64decode(blob.data or ""))
+
+	return _read_blob(source, blob.compression, chunk_size)
+
+
+def _read_blob(source: BinaryIO, compression: str | None, chunk_size: int) -> Generator[bytes, None, None]:
+	decompressor = zlib.decompressobj(wbits=GZIP_WBITS) if compression == "gzip" else None
+
+	with source:
+		while chunk := source.read(chunk_size):
+			if not decompressor:
+				yield chunk
+				continue
+
+			while chunk:
+				if data := decompressor.decompress(chunk, chunk_size):
+					yield data
+				chunk = decompressor.unconsumed_tail
+
+		if decompressor and (data := decompressor.flush()):
+			yield data
+
+
+def write_blob_file(content_hash: str, file: BinaryIO, chunk_size: int = CHUNK_SIZE) -> str:
+	"""Writes the compressed content to the blob directory and returns its path relative to the directory."""
+
+	file_path = os.path.join(content_hash[:2], f"{content_hash}.gz")
+	full_path = get_blob_path(file_path)
+	os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+	# Write to a temporary file first, so that a partially written blob is never visible.
+	with NamedTemporaryFile(dir=os.path.dirname(full_path), delete=False) as temp_file:
+		while chunk := file.read(chunk_size):
+			temp_file.write(chunk)
+
+	os.replace(temp_file.name, full_path)
+
+	return file_path
+
+
+def get_blob_path(file_path: str) -> str:
+	"""Returns the absolute path of the file in the blob directory."""
+
+	return frappe.get_site_path("private", BLOB_DIRECTORY, file_path)
+
+
+def get_file_storage_threshold() -> float:
+	"""Returns the compressed size (in bytes) above which blobs are stored as files, or infinity if disabled."""
+
+	threshold_mb = flt(frappe.get_cached_doc("Mail Settings").mime_store_file_threshold_mb)
+	return cint(threshold_mb * 1024 * 1024) if threshold_mb > 0 else float("inf")
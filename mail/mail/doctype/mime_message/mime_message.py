@@ -1,31 +1,137 @@
 # Copyright (c) 2025, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
+import codecs
+from collections.abc import Generator, Iterable
+from io import BytesIO
+from typing import BinaryIO
+
 import frappe
 from frappe import _
 from frappe.model.document import Document
+from frappe.query_builder.functions import Substring
+from frappe.utils import now
 from uuid_utils import uuid7
 
+from mail.mail.doctype.mime_blob.mime_blob import (
+	CHUNK_SIZE,
+	iter_mime_blob,
+	read_mime_blobs,
+	store_mime_blob,
+	store_mime_blobs,
+)
+
 
 class MIMEMessage(Document):
 	def autoname(self) -> None:
 		self.name = str(uuid7())
 
 
+class MIMEMessageField:
+	"""Exposes the message of the MIME Message linked by `link_field` as a document attribute.
+
+	The message is loaded once per document and link, and the cached value is replaced on set
+	and dropped on delete. With `as_bytes`, the message is returned as the raw bytes stored.
+
+	Example:
+	    class IncomingMail(Document):
+	        message = MIMEMessageField("_message", as_bytes=True)
+	"""
+
+	def __init__(self, link_field: str, as_bytes: bool = False) -> None:
+		self.link_field = link_field
+		self.as_bytes = as_bytes
+
+	def __set_name__(self, owner: type, name: str) -> None:
+		self.cache_key = f"__{name}_cache"
+
+	def __get__(self, doc: Document | None, owner: type) -> "str | bytes | None | MIMEMessageField":
+		if doc is None:
+			return self
+
+		if not (name := doc.get(self.link_field)):
+			return None
+
+		if self.is_cached(doc):
+			return doc.__dict__[self.cache_key][1]
+
+		message = get_mime_message(name, as_bytes=self.as_bytes)
+		doc.__dict__[self.cache_key] = (name, message)
+
+		return message
+
+	def __set__(self, doc: Document, value: str | bytes) -> None:
+		if name := doc.get(self.link_field):
+			update_mime_message(name, value)
+		else:
+			name = create_mime_message(value)
+			doc.set(self.link_field, name)
+
+		doc.__dict__[self.cache_key] = (name, self._convert(value) or None)
+
+	def __delete__(self, doc: Document) -> None:
+		doc.__dict__.pop(self.cache_key, None)
+
+	def is_cached(self, doc: Document) -> bool:
+		"""Returns True if the message of the currently linked MIME Message is cached on the document."""
+
+		cached = doc.__dict__.get(self.cache_key)
+		return bool(cached) and cached[0] == doc.get(self.link_field)
+
+	def cache(self, doc: Document, message: str | bytes | None) -> None:
+		"""Caches the message of the currently linked MIME Message on the document without storing it."""
+
+		doc.__dict__[self.cache_key] = (doc.get(self.link_field), self._convert(message) or None)
+
+	def prefetch(self, docs: list[Document]) -> None:
+		"""Loads the messages of the documents that are not cached yet with a single query per table."""
+
+		docs = [doc for doc in docs if doc.get(self.link_field) and not self.is_cached(doc)]
+		messages = get_mime_messages([doc.get(self.link_field) for doc in docs], as_bytes=self.as_bytes)
+
+		for doc in docs:
+			if (name := doc.get(self.link_field)) in messages:
+				doc.__dict__[self.cache_key] = (name, messages[name])
+
+	def _convert(self, message: str | bytes | None) -> str | bytes | None:
+		if self.as_bytes and isinstance(message, str):
+			return message.encode("utf-8")
+
+		if not self.as_bytes and isinstance(message, bytes):
+			return message.decode("utf-8", "replace")
+
+		return message
+
+
 def create_mime_message(message: str | bytes | None = None) -> str | None:
 	"""Creates a MIME Message document from the given message"""
 
 	if not message:
 		return
 
-	if isinstance(message, bytes):
-		message = message.decode("utf-8")
+	if isinstance(message, str):
+		message = message.encode("utf-8")
+
+	return write_mime_message(BytesIO(message))
+
+
+def create_mime_messages(messages: list[str | bytes]) -> list[str]:
+	"""Creates MIME Message documents for the messages with multi-row inserts and returns their names in order."""
 
-	doc = frappe.new_doc("MIME Message")
-	doc.message = message
-	doc.insert(ignore_permissions=True)
+	blobs = store_mime_blobs([m.encode("utf-8") if isinstance(m, str) else m for m in messages])
+	names = [str(uuid7()) for _ in blobs]
+	timestamp = now()
 
-	return doc.name
+	frappe.db.bulk_insert(
+		"MIME Message",
+		["name", "creation", "modified", "owner", "modified_by", "blob"],
+		[
+			(name, timestamp, timestamp, frappe.session.user, frappe.session.user, blob)
+			for name, blob in zip(names, blobs, strict=True)
+		],
+	)
+
+	return names
 
 
 def update_mime_message(name: str | None = None, message: str | bytes | None = None) -> None:
@@ -34,20 +140,125 @@ def update_mime_message(name: str | None = None, message: str | bytes | None = N
 	if not name or not message:
 		return
 
-	if isinstance(message, bytes):
-		message = message.decode("utf-8")
+	if isinstance(message, str):
+		message = message.encode("utf-8")
+
+	write_mime_message(BytesIO(message), name)
 
-	doc = frappe.get_doc("MIME Message", name)
-	doc.message = message
-	doc.save(ignore_permissions=True)
 
+def get_mime_message(name: str, raise_exception: bool = True, as_bytes: bool = False) -> str | bytes | None:
+	"""Returns the message of the MIME Message document, as the raw bytes stored if `as_bytes` is set"""
 
-def get_mime_message(name: str, raise_exception: bool = True) -> str | None:
-	"""Returns the message of the MIME Message document"""
+	count_mime_store_reads()
 
-	message = frappe.db.get_value("MIME Message", name, "message")
+	message = None
+	if mime_message := frappe.db.get_value("MIME Message", name, ["blob", "message"], as_dict=True):
+		if mime_message.blob:
+			message = b"".join(iter_mime_blob(mime_message.blob))
+			if not as_bytes:
+				message = message.decode("utf-8", "replace")
+		elif mime_message.message:
+			message = mime_message.message.encode("utf-8") if as_bytes else mime_message.message
 
 	if not message and raise_exception:
 		frappe.throw(_("MIME Message {0} not found.").format(frappe.bold(name)))
 
 	return message
+
+
+def get_mime_messages(names: list[str], as_bytes: bool = False) -> dict[str, str | bytes]:
+	"""Returns the messages of the MIME Message documents by name, loading them with one query per table."""
+
+	if not names:
+		return {}
+
+	count_mime_store_reads(len(set(names)))
+
+	MM = frappe.qb.DocType("MIME Message")
+	mime_messages = (
+		frappe.qb.from_(MM).select(MM.name, MM.blob, MM.message).where(MM.name.isin(list(set(names))))
+	).run(as_dict=True)
+
+	blobs = read_mime_blobs([m.blob for m in mime_messages if m.blob])
+
+	messages = {}
+	for m in mime_messages:
+		if m.blob in blobs:
+			messages[m.name] = blobs[m.blob] if as_bytes else blobs[m.blob].decode("utf-8", "replace")
+		elif m.message:
+			messages[m.name] = m.message.encode("utf-8") if as_bytes else m.message
+
+	return messages
+
+
+def write_mime_message(file: BinaryIO, name: str | None = None, chunk_size: int = CHUNK_SIZE) -> str | None:
+	"""Stores the message from the file in the blob store, links it to the given or a new MIME Message document and returns its name."""
+
+	blob = store_mime_blob(file, chunk_size)
+
+	if name:
+		frappe.db.set_value("MIME Message", name, {"blob": blob, "message": None})
+	else:
+		doc = frappe.new_doc("MIME Message")
+		doc.blob = blob
+		doc.insert(ignore_permissions=True)
+		name = doc.name
+
+	return name
+
+
+def iter_mime_message(name: str, chunk_size: int = CHUNK_SIZE) -> Generator[str, None, None]:
+	"""Returns an iterator over the message of the MIME Message document in chunks. The message is looked up
+	and its blob opened before returning, so that a missing message raises here and not midway through."""
+
+	count_mime_store_reads()
+
+	if not (mime_message := frappe.db.get_value("MIME Message", name, ["name", "blob"], as_dict=True)):
+		frappe.throw(_("MIME Message {0} not found.").format(frappe.bold(name)))
+
+	if mime_message.blob:
+		return _decode_chunks(iter_mime_blob(mime_message.blob, chunk_size))
+
+	# Messages stored before the blob store was introduced.
+	return _iter_legacy_message(name, chunk_size)
+
+
+def _decode_chunks(chunks: Iterable[bytes]) -> Generator[str, None, None]:
+	decoder = codecs.getincrementaldecoder("utf-8")("replace")
+	for chunk in chunks:
+		if text := decoder.decode(chunk):
+			yield text
+
+	if text := decoder.decode(b"", final=True):
+		yield text
+
+
+def _iter_legacy_message(name: str, chunk_size: int) -> Generator[str, None, None]:
+	MM = frappe.qb.DocType("MIME Message")
+	start = 1
+
+	while True:
+		result = (
+			frappe.qb.from_(MM).select(Substring(MM.message, start, chunk_size)).where(MM.name == name)
+		).run()
+
+		if not result:
+			frappe.throw(_("MIME Message {0} not found.").format(frappe.bold(name)))
+
+		if not (chunk := result[0][0]):
+			break
+
+		yield chunk
+		start += chunk_size
+
+
+def count_mime_store_reads(count: int = 1) -> None:
+	"""Adds to the number of messages read from the MIME store in the current request or job."""
+
+	frappe.local.mime_store_reads = get_mime_store_reads() + count
+
+
+def get_mime_store_reads() -> int:
+	"""Returns the number of messages read from the MIME store in the current request or job."""
+
+	return getattr(frappe.local, "mime_store_reads", 0)
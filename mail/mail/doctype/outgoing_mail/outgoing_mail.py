@@ -1,85 +1,104 @@
 # Copyright (c) 2024, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
+import json
 import random
+import time
+from collections import defaultdict
+from collections.abc import Iterator
 from email import policy
-from email.encoders import encode_base64
 from email.message import Message
-from email.mime.audio import MIMEAudio
-from email.mime.base import MIMEBase
-from email.mime.image import MIMEImage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formataddr, formatdate, make_msgid, parseaddr
+from functools import partial
+from io import BytesIO
+from math import ceil
 from mimetypes import guess_type
 from re import finditer
+from tempfile import SpooledTemporaryFile
+from typing import BinaryIO, Literal
 from urllib.parse import parse_qs, urlparse
 
 import frappe
 from frappe import _
 from frappe.model.document import Document
-from frappe.query_builder import Interval, Order
-from frappe.query_builder.functions import Now
+from frappe.query_builder import Case, Interval, Order
+from frappe.query_builder.functions import Count, IfNull, Max, Now
 from frappe.utils import (
 	add_to_date,
 	cint,
 	create_batch,
 	flt,
 	get_datetime_str,
+	getdate,
 	now,
 	time_diff_in_seconds,
 	validate_email_address,
 )
+from frappe.utils.background_jobs import get_workers
 from frappe.utils.file_manager import save_file
 from uuid_utils import uuid7
 
 from mail.mail.doctype.bounce_history.bounce_history import is_recipient_blocked
 from mail.mail.doctype.mail_contact.mail_contact import create_mail_contact
+from mail.mail.doctype.mail_open_event.mail_open_event import create_mail_open_events
+from mail.mail.doctype.mail_open_rollup.mail_open_rollup import add_to_open_rollups
+from mail.mail.doctype.mail_recipient.mail_recipient import RecipientStatusWriter
+from mail.mail.doctype.mail_search_index.mail_search_index import index_mails, remove_mail_from_index
 from mail.mail.doctype.mime_message.mime_message import (
-	create_mime_message,
-	get_mime_message,
-	update_mime_message,
+	MIMEMessageField,
+	get_mime_messages,
+	get_mime_store_reads,
+	iter_mime_message,
+	write_mime_message,
+)
+from mail.mail.doctype.spam_check_log.spam_check_log import create_spam_check_log, scan_messages
+from mail.smtp import (
+	SMTPContext,
+	SMTPEnvelope,
+	SMTPSessionSpec,
+	deliver_envelopes,
+	get_smtp_connection,
+	sendmail_chunks,
 )
-from mail.mail.doctype.spam_check_log.spam_check_log import create_spam_check_log
-from mail.smtp import SMTPContext, get_smtp_connection
 from mail.utils import (
+	bulk_update,
 	convert_html_to_text,
 	get_in_reply_to,
 	get_in_reply_to_mail,
+	get_latest_content,
+	get_snippet,
+	get_thread_ids,
+	notify_updates,
 )
 from mail.utils.cache import get_account_for_email, get_account_for_user, get_default_outgoing_email_for_user
 from mail.utils.dns import get_host_by_ip
 from mail.utils.dt import parsedate_to_datetime
 from mail.utils.email_parser import EmailParser
+from mail.utils.metrics import record_metrics
+from mail.utils.mime import create_streamed_part, write_message
 from mail.utils.user import get_user_email_addresses, is_account_owner, is_system_manager
 
 MAX_FAILED_COUNT = 5
+MESSAGE_SPOOL_SIZE = 5 * 1024 * 1024
+LEASE_DURATION_MINUTES = 10
+OPEN_EVENTS_KEY = "mail-open-events"
+OPEN_EVENTS_PROCESSING_KEY = "mail-open-events-processing"
+# Moves a batch of events from the queue to the processing list, atomically, and returns it.
+MOVE_OPEN_EVENTS_SCRIPT = """
+local events = redis.call("lrange", KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #events > 0 then
+	redis.call("ltrim", KEYS[1], #events, -1)
+	redis.call("rpush", KEYS[2], unpack(events))
+end
+return events
+"""
 
 
 class OutgoingMail(Document):
-	@property
-	def raw_message(self) -> str | None:
-		if self._raw_message:
-			return get_mime_message(self._raw_message)
-
-	@raw_message.setter
-	def raw_message(self, value: str | bytes) -> None:
-		if self._raw_message:
-			update_mime_message(self._raw_message, value)
-		else:
-			self._raw_message = create_mime_message(value)
-
-	@property
-	def message(self) -> str | None:
-		if self._message:
-			return get_mime_message(self._message)
-
-	@message.setter
-	def message(self, value: str | bytes) -> None:
-		if self._message:
-			update_mime_message(self._message, value)
-		else:
-			self._message = create_mime_message(value)
+	raw_message = MIMEMessageField("_raw_message")
+	message = MIMEMessageField("_message")
 
 	def autoname(self) -> None:
 		self.name = str(uuid7())
@@ -116,9 +135,13 @@ class OutgoingMail(Document):
 
 			self.generate_message()
 			self.validate_max_message_size()
+			self.set_thread_id()
+
+		self.set_snippet()
 
 	def on_submit(self) -> None:
 		self.create_mail_contacts()
+		index_mails([self])
 		self._db_set(status="Pending", notify_update=True)
 
 		if not self.is_newsletter:
@@ -130,10 +153,15 @@ class OutgoingMail(Document):
 	def on_update_after_submit(self) -> None:
 		self.set_folder(db_set=True)
 
+	def on_cancel(self) -> None:
+		remove_mail_from_index(self.name)
+
 	def on_trash(self) -> None:
 		if self.docstatus != 0 and frappe.session.user != "Administrator":
 			frappe.throw(_("Only Administrator can delete Outgoing Mail."))
 
+		remove_mail_from_index(self.name)
+
 	def validate_amended_doc(self) -> None:
 		"""Validates the amended document."""
 
@@ -405,6 +433,26 @@ class OutgoingMail(Document):
 
 		self.ip_address = frappe.local.request_ip
 
+	def set_snippet(self) -> None:
+		"""Sets the latest content and snippet shown in the mail list and thread."""
+
+		self.latest_content = get_latest_content(self.body_html, self.body_plain)
+		self.snippet = get_snippet(self.latest_content)
+
+	def set_thread_id(self) -> None:
+		"""Sets the thread id from the Message ID, In-Reply-To and References."""
+
+		self.thread_id = get_thread_ids(
+			[
+				{
+					"name": self.name,
+					"message_id": self.message_id,
+					"in_reply_to": self.in_reply_to,
+					"references": self.flags.references,
+				}
+			]
+		)[0]
+
 	def set_message_id(self) -> None:
 		"""Sets the Message ID."""
 
@@ -450,6 +498,7 @@ class OutgoingMail(Document):
 				self.reply_to = parser.get_reply_to()
 				self.message_id = parser.get_message_id() or self.message_id
 				self.in_reply_to = parser.get_in_reply_to()
+				self.flags.references = parser.get_references()
 				self.in_reply_to_mail_type, self.in_reply_to_mail_name = get_in_reply_to_mail(
 					self.in_reply_to
 				)
@@ -506,9 +555,10 @@ class OutgoingMail(Document):
 				del message["X-Newsletter"]
 				message["X-Newsletter"] = "1"
 
-		def _add_attachments(message: MIMEMultipart | Message) -> None:
-			"""Adds the attachments to the message."""
+		def _add_attachments(message: MIMEMultipart | Message) -> dict:
+			"""Adds the attachments to the message and returns the streams of their payloads by placeholder."""
 
+			streams = {}
 			for attachment in self.attachments:
 				file = frappe.get_doc("File", attachment.get("name"))
 				content_type = guess_type(file.file_name)[0]
@@ -516,36 +566,31 @@ class OutgoingMail(Document):
 				if content_type is None:
 					content_type = "application/octet-stream"
 
-				content = file.get_content()
+				# The payload is base64 encoded from the file while the message is written,
+				# so the attachment is never held in memory as a whole.
 				maintype, subtype = content_type.split("/", 1)
-
-				if maintype == "text":
-					if isinstance(content, str):
-						content = content.encode("utf-8")
-					part = MIMEText(content, _subtype=subtype, _charset="utf-8", policy=policy.SMTP)
-
-				elif maintype == "image":
-					part = MIMEImage(content, _subtype=subtype, policy=policy.SMTP)
-
-				elif maintype == "audio":
-					part = MIMEAudio(content, _subtype=subtype, policy=policy.SMTP)
-
-				else:
-					part = MIMEBase(maintype, subtype, policy=policy.SMTP)
-					part.set_payload(content)
-					encode_base64(part)
+				part, placeholder = create_streamed_part(maintype, subtype)
+				streams[placeholder] = partial(_open_file, file)
 
 				part.add_header("Content-Disposition", f'{attachment.type}; filename="{file.file_name}"')
 				part.add_header("Content-ID", f"<{attachment.name}>")
 
 				message.attach(part)
 
+			return streams
+
 		message = _get_message()
 		_add_headers(message)
-		_add_attachments(message)
+		streams = _add_attachments(message)
+
+		with SpooledTemporaryFile(max_size=MESSAGE_SPOOL_SIZE) as file:
+			self.message_size = write_message(message, file, streams)
+			file.seek(0)
+			self._message = write_mime_message(file, self._message)
+
+		# The message was written to the store directly, drop the cached one.
+		del self.message
 
-		self.message = message.as_string()
-		self.message_size = len(self.message)
 		self.created_at = get_datetime_str(parsedate_to_datetime(message["Date"]))
 		self.submitted_at = now()
 		self.submitted_after = time_diff_in_seconds(self.submitted_at, self.created_at)
@@ -724,17 +769,7 @@ class OutgoingMail(Document):
 		"""Updates the status of the email based on the status of the recipients."""
 
 		if not status:
-			recipient_statuses = [r.status for r in self.recipients]
-			total_statuses = len(recipient_statuses)
-			status_counts = {k: recipient_statuses.count(k) for k in ["", "Blocked", "Sent"]}
-
-			if status_counts[""] == total_statuses:  # All recipients are in pending state (no status)
-				return
-
-			if status_counts["Blocked"] == total_statuses:  # All recipients are blocked
-				status = "Blocked"
-			elif status_counts["Sent"] == total_statuses:  # All recipients are sent
-				status = "Sent"
+			status = get_status_from_recipient_statuses([r.status for r in self.recipients])
 
 		if status:
 			self.status = status
@@ -762,13 +797,11 @@ class OutgoingMail(Document):
 	def process_for_delivery(self) -> None:
 		"""Process the email for delivery."""
 
-		# Reload the doc to ensure it reflects the latest status.
-		# This handles cases where the email's status might have been manually updated (e.g., Accepted) after the job was created.
-		self.reload()
-		if self.status not in ["Pending", "Queued"]:
+		recipient_writer = RecipientStatusWriter()
+		if (kwargs := self.prepare_for_delivery(recipient_writer)) is None:
 			return
 
-		kwargs = self._prepare_delivery_args()
+		recipient_writer.flush()
 		self._db_set(notify_update=True, **kwargs)
 
 		if self.status == "Blocked":
@@ -777,18 +810,41 @@ class OutgoingMail(Document):
 			frappe.flags.force_transfer = True
 			self.transfer_to_mail_agent()
 
-	def _prepare_delivery_args(self) -> dict:
+	def prepare_for_delivery(
+		self, recipient_writer: RecipientStatusWriter, spam_scan: dict | None = None
+	) -> dict | None:
+		"""Returns the updates that process the email for delivery, or `None` if it's no longer pending. The
+		updates are applied to the document but not written, and the recipient statuses are queued in the
+		writer. A `spam_scan` of the message made beforehand along with its batch is used instead of scanning
+		the message again."""
+
+		# Reload the doc to ensure it reflects the latest status.
+		# This handles cases where the email's status might have been manually updated (e.g., Accepted) after the job was created.
+		self.reload()
+		if self.status not in ["Pending", "Queued"]:
+			return None
+
+		kwargs = self._prepare_delivery_args(recipient_writer, spam_scan)
+		self.update(kwargs)
+
+		return kwargs
+
+	def _prepare_delivery_args(
+		self, recipient_writer: RecipientStatusWriter, spam_scan: dict | None = None
+	) -> dict:
 		"""Prepare arguments for delivery processing."""
 
 		kwargs = {"status": "Accepted"}
 
 		for rcpt in self.recipients:
 			if is_recipient_blocked(sender=self.from_, recipient=rcpt.email):
-				rcpt.status = "Blocked"
-				rcpt.error_message = _(
-					"Delivery to this recipient was blocked because their email address is on our blocklist. This action was taken after repeated delivery failures to this address. To protect your sender reputation and prevent further issues, this email was not sent to the blocked recipient."
+				recipient_writer.add(
+					rcpt,
+					"Blocked",
+					_(
+						"Delivery to this recipient was blocked because their email address is on our blocklist. This action was taken after repeated delivery failures to this address. To protect your sender reputation and prevent further issues, this email was not sent to the blocked recipient."
+					),
 				)
-				rcpt.db_update()
 
 		self.update_status()
 		if self.status == "Blocked":
@@ -802,17 +858,17 @@ class OutgoingMail(Document):
 			)
 
 		if kwargs["status"] == "Accepted" and is_spam_detection_enabled_for_outbound():
-			kwargs.update(self._check_for_spam())
+			kwargs.update(self._check_for_spam(recipient_writer, spam_scan))
 
 		kwargs["processed_at"] = now()
 		kwargs["processed_after"] = time_diff_in_seconds(kwargs["processed_at"], self.submitted_at)
 
 		return kwargs
 
-	def _check_for_spam(self) -> dict:
+	def _check_for_spam(self, recipient_writer: RecipientStatusWriter, spam_scan: dict | None = None) -> dict:
 		"""Check the message for spam and update the status if necessary."""
 
-		log = create_spam_check_log(self.message)
+		log = create_spam_check_log(self.message, spam_scan, fingerprint_exclude=[self.tracking_id])
 		mail_settings = frappe.get_cached_doc("Mail Settings")
 		is_spam = log.spam_score > mail_settings.spamd_outbound_threshold
 		short_error_message = None
@@ -835,9 +891,7 @@ class OutgoingMail(Document):
 
 		if kwargs.get("status") == "Blocked":
 			for rcpt in self.recipients:
-				rcpt.status = "Blocked"
-				rcpt.error_message = short_error_message
-				rcpt.db_update()
+				recipient_writer.add(rcpt, "Blocked", short_error_message)
 
 		return kwargs
 
@@ -861,12 +915,12 @@ class OutgoingMail(Document):
 		frappe.only_for("System Manager")
 
 		if self.status in ["Pending", "Blocked"]:
+			recipient_writer = RecipientStatusWriter()
 			for rcpt in self.recipients:
 				if rcpt.status == "Blocked":
-					rcpt.status = ""
-					rcpt.error_message = None
-					rcpt.db_update()
+					recipient_writer.add(rcpt, "")
 
+			recipient_writer.flush()
 			self._accept()
 			self.add_comment(
 				"Comment", _("Mail accepted by System Manager {0}.").format(frappe.bold(frappe.session.user))
@@ -911,6 +965,7 @@ class OutgoingMail(Document):
 			status="Transferring",
 			transfer_started_at=transfer_started_at,
 			transfer_started_after=time_diff_in_seconds(transfer_started_at, self.processed_at),
+			lease_expires_at=get_lease_expires_at(),
 			notify_update=False,
 			commit=True,
 		)
@@ -936,6 +991,7 @@ class OutgoingMail(Document):
 			password = mail_account.get_password("password")
 
 			mail_options = [f"ENVID={self.name}", f"MT-PRIORITY={self.priority}"]
+			chunks = _open_mime_message(self._message)
 			if frappe.request and hasattr(frappe.request, "after_response"):
 				# Web worker:
 				# Retrieves an `SMTP` or `SMTP_SSL` session from the `SMTPConnectionPool`.
@@ -944,7 +1000,13 @@ class OutgoingMail(Document):
 				# Connections are gracefully closed by the cleanup thread.
 
 				with SMTPContext(agent_or_group, 465, username, password, use_ssl=True) as session:
-					session.sendmail(self.from_, recipients, self.message, mail_options=mail_options)
+					sendmail_chunks(
+						session,
+						self.from_,
+						recipients,
+						chunks,
+						mail_options=mail_options,
+					)
 			else:
 				# Background worker:
 				# Retrieves an `SMTPConnection` from a local cache.
@@ -952,17 +1014,24 @@ class OutgoingMail(Document):
 				# Connection is gracefully closed when the job completes.
 
 				connection = get_smtp_connection(agent_or_group, 465, username, password, use_ssl=True)
-				connection.session.sendmail(self.from_, recipients, self.message, mail_options=mail_options)
+				sendmail_chunks(
+					connection.session,
+					self.from_,
+					recipients,
+					chunks,
+					mail_options=mail_options,
+				)
 				connection.increment_email_count()
 
 			transfer_completed_at = now()
 			transfer_completed_after = time_diff_in_seconds(transfer_completed_at, transfer_started_at)
 
+			recipient_writer = RecipientStatusWriter()
 			for rcpt in self.recipients:
 				if rcpt.email in recipients:
-					rcpt.status = "Sent"
-					rcpt.db_update()
+					recipient_writer.add(rcpt, "Sent")
 
+			recipient_writer.flush()
 			self.update_status()
 			self.set_folder()
 			self._db_set(
@@ -970,6 +1039,8 @@ class OutgoingMail(Document):
 				status=self.status,
 				transfer_completed_at=transfer_completed_at,
 				transfer_completed_after=transfer_completed_after,
+				lease_token=None,
+				lease_expires_at=None,
 				notify_update=True,
 				commit=True,
 			)
@@ -981,11 +1052,23 @@ class OutgoingMail(Document):
 				error_log=error_log,
 				failed_count=failed_count,
 				retry_after=get_retry_after(failed_count),
+				lease_token=None,
+				lease_expires_at=None,
 				notify_update=True,
 				commit=True,
 			)
 
 
+def _open_file(file: "Document") -> BinaryIO:
+	"""Returns a binary stream of the content of the file."""
+
+	if file.file_url and file.file_url.startswith(("http://", "https://")):
+		content = file.get_content()
+		return BytesIO(content.encode("utf-8") if isinstance(content, str) else content)
+
+	return open(file.get_full_path(), "rb")
+
+
 @frappe.whitelist()
 def get_from_() -> str | None:
 	"""Returns the default outgoing email address of the user."""
@@ -1042,6 +1125,30 @@ def is_spam_detection_enabled_for_outbound() -> bool:
 	return mail_settings.enable_spamd and mail_settings.enable_spamd_for_outbound
 
 
+def is_async_transfer_enabled() -> bool:
+	"""Returns True if outgoing emails are transferred by the asyncio delivery worker else False."""
+
+	return bool(frappe.get_cached_doc("Mail Settings").smtp_async_transfer)
+
+
+def get_status_from_recipient_statuses(recipient_statuses: list[str | None]) -> str | None:
+	"""Returns the status of the email based on the statuses of its recipients."""
+
+	recipient_statuses = [status or "" for status in recipient_statuses]
+	total_statuses = len(recipient_statuses)
+	status_counts = {k: recipient_statuses.count(k) for k in ["", "Blocked", "Sent"]}
+
+	if status_counts[""] == total_statuses:  # All recipients are in pending state (no status)
+		return None
+
+	if status_counts["Blocked"] == total_statuses:  # All recipients are blocked
+		return "Blocked"
+	elif status_counts["Sent"] == total_statuses:  # All recipients are sent
+		return "Sent"
+
+	return None
+
+
 def get_retry_after(failed_count: int) -> str:
 	"""Returns the retry after datetime."""
 
@@ -1049,6 +1156,12 @@ def get_retry_after(failed_count: int) -> str:
 	return add_to_date(now(), minutes=retry_after_minutes)
 
 
+def get_lease_expires_at() -> str:
+	"""Returns the datetime at which a lease taken now expires."""
+
+	return add_to_date(now(), minutes=LEASE_DURATION_MINUTES)
+
+
 def get_random_agent_or_agent_group(
 	include_agent_groups: str | list[str] | None = None,
 	exclude_agent_groups: str | list[str] | None = None,
@@ -1163,80 +1276,766 @@ def create_outgoing_mail(
 	return doc
 
 
-def process_email_transfer_batch(mails: list[str]) -> None:
-	"""Processes a batch of emails and transfer them to the agent."""
+def process_email_transfer_batch(mails: list[str], lease_token: str | None = None) -> None:
+	"""Processes a batch of emails and transfer them to the agent.
 
+	When a `lease_token` is given, only the emails still held by that lease are processed,
+	so emails whose lease expired and were claimed again by another worker are skipped.
+	"""
+
+	PREFETCH_SIZE = 50
+
+	started_at = time.monotonic()
 	failed_mails = []
+	transferable_mails = []
+	processed_mails = {}
+	recipient_writer = RecipientStatusWriter()
+
+	def on_failure(mail: str) -> None:
+		failed_mails.append(mail)
+		failed_count = len(failed_mails)
+		total_count = len(mails)
+		failure_ratio = failed_count / total_count
+		if (failure_ratio > 0.33) and (failed_count > 50):
+			frappe.throw(
+				_(
+					"Too many email transfer failures: {failed_count}/{total_count} ({failure_rate:.2%}). Process halted."
+				).format(failed_count=failed_count, total_count=total_count, failure_rate=failure_ratio)
+			)
+
+	OM = frappe.qb.DocType("Outgoing Mail")
+	query = frappe.qb.from_(OM).select(OM.name, OM.status).where((OM.docstatus == 1) & (OM.name.isin(mails)))
+	if lease_token:
+		query = query.where(OM.lease_token == lease_token)
+
+	mail_statuses = dict(query.run())
+	prefetch_messages = is_spam_detection_enabled_for_outbound()
+
+	for batch in create_batch(mails, PREFETCH_SIZE):
+		outgoing_mails: dict[str, OutgoingMail] = {}
+		for mail in batch:
+			try:
+				match mail_statuses.get(mail):
+					case "Pending" | "Queued":
+						outgoing_mails[mail] = frappe.get_doc("Outgoing Mail", mail)
+					case "Failed" | "Transferring":
+						transferable_mails.append(mail)
+			except Exception:
+				on_failure(mail)
+
+		spam_scans = {}
+		if prefetch_messages and outgoing_mails:
+			# The spam check reads the message of every email, so load them for the whole batch at once
+			# and scan them concurrently.
+			OutgoingMail.message.prefetch(list(outgoing_mails.values()))
+			try:
+				messages = [outgoing_mail.message for outgoing_mail in outgoing_mails.values()]
+				# Copies of the same content (e.g. newsletters) differ only by the tracking id in their body.
+				fingerprint_excludes = [
+					[outgoing_mail.tracking_id] for outgoing_mail in outgoing_mails.values()
+				]
+				spam_scans = dict(
+					zip(outgoing_mails, scan_messages(messages, fingerprint_excludes), strict=True)
+				)
+			except Exception:
+				# Each email is then scanned on its own while being processed.
+				frappe.log_error(title=_("Spam Scan Failed"), message=frappe.get_traceback())
+
+		for mail, outgoing_mail in outgoing_mails.items():
+			try:
+				if kwargs := outgoing_mail.prepare_for_delivery(recipient_writer, spam_scans.get(mail)):
+					processed_mails[mail] = kwargs
+					if outgoing_mail.status == "Accepted":
+						transferable_mails.append(mail)
+			except Exception:
+				on_failure(mail)
+
+	recipient_writer.flush()
+	bulk_update("Outgoing Mail", processed_mails)
+	notify_updates("Outgoing Mail", list(processed_mails))
+	frappe.db.commit()
+
+	summary = transfer_mails_in_batch(transferable_mails, recipient_writer, lease_token)
+	record_metrics(
+		"process_email_transfer_batch",
+		total=len(mails),
+		processed=len(mails) - len(failed_mails),
+		transferred=summary["transferred"],
+		failed=len(failed_mails) + summary["failed"],
+		recipients_updated=recipient_writer.rows_affected,
+		mime_store_reads=get_mime_store_reads(),
+		duration=round(time.monotonic() - started_at, 3),
+	)
+
+
+def transfer_mails_in_batch(
+	mails: list[str], recipient_writer: RecipientStatusWriter | None = None, lease_token: str | None = None
+) -> dict[str, int]:
+	"""Transfers the emails to the agents, streaming each (agent or agent group, sender) group over a single SMTP session."""
+
+	FLUSH_SIZE = 100
+	# The messages of an async flush are loaded into memory at once.
+	ASYNC_FLUSH_SIZE = 50
+
+	summary = {"transferred": 0, "failed": 0}
+	recipient_writer = recipient_writer or RecipientStatusWriter()
+
+	if not mails:
+		return summary
+
+	OM = frappe.qb.DocType("Outgoing Mail")
+	MR = frappe.qb.DocType("Mail Recipient")
+
+	query = (
+		frappe.qb.from_(OM)
+		.select(
+			OM.name,
+			OM.status,
+			OM.sender,
+			OM.from_,
+			OM.folder,
+			OM.priority,
+			OM._message,
+			OM.failed_count,
+			OM.processed_at,
+			OM.include_agent_groups,
+			OM.exclude_agent_groups,
+			OM.include_agents,
+			OM.exclude_agents,
+		)
+		.where(
+			(OM.docstatus == 1)
+			& (OM.name.isin(mails))
+			& (
+				OM.status.isin(["Accepted", "Transferring"])
+				| ((OM.status == "Failed") & (OM.failed_count < MAX_FAILED_COUNT))
+			)
+		)
+		.orderby(OM.priority, order=Order.desc)
+		.orderby(OM.submitted_at, order=Order.asc)
+	)
+	if lease_token:
+		query = query.where(OM.lease_token == lease_token)
+
+	outgoing_mails = query.run(as_dict=True)
+
+	if not outgoing_mails:
+		return summary
+
+	recipients_map = {}
+	for rcpt in (
+		frappe.qb.from_(MR)
+		.select(MR.name, MR.parent, MR.email, MR.status)
+		.where((MR.parenttype == "Outgoing Mail") & (MR.parent.isin([m.name for m in outgoing_mails])))
+		.orderby(MR.idx)
+	).run(as_dict=True):
+		recipients_map.setdefault(rcpt.parent, []).append(rcpt)
+
+	groups = {}
+	failures = {}
+	agent_or_group_map = {}
+	for mail in outgoing_mails:
+		criteria = (
+			mail.include_agent_groups,
+			mail.exclude_agent_groups,
+			mail.include_agents,
+			mail.exclude_agents,
+		)
+		try:
+			if criteria not in agent_or_group_map:
+				agent_or_group_map[criteria] = get_random_agent_or_agent_group(*criteria)
+		except Exception:
+			failures[mail.name] = frappe.get_traceback(with_context=False)
+			continue
+
+		groups.setdefault((agent_or_group_map[criteria], mail.sender), []).append(mail)
+
+	if failures:
+		_mark_mails_as_failed(
+			{mail.name: mail.failed_count for mail in outgoing_mails if mail.name in failures}, failures
+		)
+		summary["failed"] += len(failures)
+
+	if is_async_transfer_enabled():
+		agent_or_group_mails = [
+			(agent_or_group, mail)
+			for (agent_or_group, sender), group_mails in groups.items()
+			for mail in group_mails
+		]
+		for batch in create_batch(agent_or_group_mails, ASYNC_FLUSH_SIZE):
+			transferred = _transfer_mails_async(batch, recipients_map, recipient_writer)
+			summary["transferred"] += transferred
+			summary["failed"] += len(batch) - transferred
+	else:
+		for (agent_or_group, sender), group_mails in groups.items():
+			for batch in create_batch(group_mails, FLUSH_SIZE):
+				transferred = _transfer_mails_to_agent_or_group(
+					agent_or_group, sender, batch, recipients_map, recipient_writer
+				)
+				summary["transferred"] += transferred
+				summary["failed"] += len(batch) - transferred
+
+	return summary
+
+
+def _transfer_mails_to_agent_or_group(
+	agent_or_group: str,
+	sender: str,
+	mails: list[dict],
+	recipients_map: dict[str, list[dict]],
+	recipient_writer: RecipientStatusWriter,
+) -> int:
+	"""Transfers the emails of a sender to the agent or agent group over a single SMTP session and returns the number of emails transferred."""
+
+	transfer_started_at = _mark_mails_as_transferring(mails)
+
+	updates = {}
+	failures = {}
+
+	try:
+		mail_account = frappe.get_cached_doc("Mail Account", sender)
+		username = mail_account.email
+		password = mail_account.get_password("password")
+	except Exception:
+		error_log = frappe.get_traceback(with_context=False)
+		_mark_mails_as_failed(
+			{mail.name: mail.failed_count for mail in mails},
+			dict.fromkeys([mail.name for mail in mails], error_log),
+		)
+		return 0
 
 	for mail in mails:
 		try:
-			outgoing_mail: OutgoingMail = frappe.get_doc("Outgoing Mail", mail)
-			match outgoing_mail.status:
-				case "Pending" | "Queued":
-					outgoing_mail.process_for_delivery()
-				case "Failed":
-					outgoing_mail.retry_failed()
-				case "Transferring":
-					outgoing_mail.force_transfer_to_mail_agent()
+			recipients = _get_pending_recipients(mail, recipients_map)
+			chunks = _open_mime_message(mail._message)
+			connection = get_smtp_connection(agent_or_group, 465, username, password, use_ssl=True)
+			sendmail_chunks(
+				connection.session,
+				mail.from_,
+				recipients,
+				chunks,
+				mail_options=_get_mail_options(mail),
+			)
+			connection.increment_email_count()
+
+			updates[mail.name] = _get_transferred_mail_updates(
+				mail, recipients, recipients_map, recipient_writer, transfer_started_at, now()
+			)
 		except Exception:
-			failed_mails.append(mail)
-			failed_count = len(failed_mails)
-			total_count = len(mails)
-			failure_ratio = failed_count / total_count
-			if (failure_ratio > 0.33) and (failed_count > 50):
-				frappe.throw(
-					_(
-						"Too many email transfer failures: {failed_count}/{total_count} ({failure_rate:.2%}). Process halted."
-					).format(failed_count=failed_count, total_count=total_count, failure_rate=failure_ratio)
+			failures[mail.name] = frappe.get_traceback(with_context=False)
+
+	return _save_transfer_results(mails, updates, failures, recipient_writer)
+
+
+def _transfer_mails_async(
+	batch: list[tuple[str, dict]],
+	recipients_map: dict[str, list[dict]],
+	recipient_writer: RecipientStatusWriter,
+) -> int:
+	"""Transfers the emails concurrently using the asyncio delivery worker and returns the number of emails transferred."""
+
+	mails = [mail for agent_or_group, mail in batch]
+	transfer_started_at = _mark_mails_as_transferring(mails)
+
+	messages = get_mime_messages([mail._message for mail in mails if mail._message])
+
+	sessions = {}
+	failures = {}
+	credentials = {}
+	pending_recipients = {}
+	for agent_or_group, mail in batch:
+		try:
+			if mail.sender not in credentials:
+				mail_account = frappe.get_cached_doc("Mail Account", mail.sender)
+				credentials[mail.sender] = (mail_account.email, mail_account.get_password("password"))
+
+			pending_recipients[mail.name] = _get_pending_recipients(mail, recipients_map)
+
+			key = (agent_or_group, mail.sender)
+			if key not in sessions:
+				username, password = credentials[mail.sender]
+				sessions[key] = SMTPSessionSpec(
+					agent_or_group, 465, username, password, envelopes=[], use_ssl=True
+				)
+
+			if not (message := messages.get(mail._message)):
+				frappe.throw(_("The MIME message of the email is missing."))
+
+			sessions[key].envelopes.append(
+				SMTPEnvelope(
+					mail.name,
+					mail.from_,
+					pending_recipients[mail.name],
+					message,
+					_get_mail_options(mail),
 				)
+			)
+		except Exception:
+			failures[mail.name] = frappe.get_traceback(with_context=False)
+
+	results = deliver_envelopes(list(sessions.values())) if sessions else {}
+
+	updates = {}
+	for mail in mails:
+		if not (result := results.get(mail.name)):
+			continue
+
+		if result.error:
+			failures[mail.name] = result.error
+		else:
+			updates[mail.name] = _get_transferred_mail_updates(
+				mail,
+				pending_recipients[mail.name],
+				recipients_map,
+				recipient_writer,
+				transfer_started_at,
+				result.completed_at,
+			)
+
+	return _save_transfer_results(mails, updates, failures, recipient_writer)
+
+
+def _mark_mails_as_transferring(mails: list[dict]) -> str:
+	"""Marks the emails as transferring, renews their lease and returns the transfer start time."""
+
+	transfer_started_at = now()
+	lease_expires_at = get_lease_expires_at()
+	bulk_update(
+		"Outgoing Mail",
+		{
+			mail.name: {
+				"status": "Transferring",
+				"transfer_started_at": transfer_started_at,
+				"transfer_started_after": time_diff_in_seconds(transfer_started_at, mail.processed_at),
+				"lease_expires_at": lease_expires_at,
+			}
+			for mail in mails
+		},
+	)
+	notify_updates("Outgoing Mail", [mail.name for mail in mails])
+	frappe.db.commit()
+
+	return transfer_started_at
+
+
+def _get_pending_recipients(mail: dict, recipients_map: dict[str, list[dict]]) -> list[str]:
+	"""Returns the recipients of the email that are neither blocked nor sent."""
+
+	# Remove duplicate recipients while preserving the order by using `dict.fromkeys()`.
+	recipients = list(
+		dict.fromkeys(
+			[
+				rcpt.email
+				for rcpt in recipients_map.get(mail.name, [])
+				if rcpt.status not in ["Blocked", "Sent"]
+			]
+		)
+	)
+
+	if not recipients:
+		frappe.throw(_("All recipients are blocked or sent."))
+
+	return recipients
+
+
+def _open_mime_message(message: str | None) -> Iterator[str]:
+	"""Returns the chunks of the MIME message of an email, looked up before an SMTP session is used so that a
+	missing message fails the email without leaving the session midway through the DATA phase."""
+
+	if not message:
+		frappe.throw(_("The MIME message of the email is missing."))
+
+	return iter_mime_message(message)
+
+
+def _get_mail_options(mail: dict) -> list[str]:
+	"""Returns the SMTP `MAIL FROM` options of the email."""
+
+	return [f"ENVID={mail.name}", f"MT-PRIORITY={mail.priority}"]
+
+
+def _get_transferred_mail_updates(
+	mail: dict,
+	recipients: list[str],
+	recipients_map: dict[str, list[dict]],
+	recipient_writer: RecipientStatusWriter,
+	transfer_started_at: str,
+	transfer_completed_at: str,
+) -> dict:
+	"""Queues the sent recipients of the transferred email and returns the updates of the email."""
+
+	recipient_statuses = []
+	for rcpt in recipients_map.get(mail.name, []):
+		if rcpt.email in recipients:
+			recipient_writer.add(rcpt, "Sent")
+		recipient_statuses.append(rcpt.status)
+
+	status = get_status_from_recipient_statuses(recipient_statuses) or "Transferring"
+	folder = mail.folder if mail.folder == "Trash" else ("Sent" if status == "Sent" else "Outbox")
+	return {
+		"status": status,
+		"folder": folder,
+		"transfer_completed_at": transfer_completed_at,
+		"transfer_completed_after": time_diff_in_seconds(transfer_completed_at, transfer_started_at),
+		"lease_token": None,
+		"lease_expires_at": None,
+	}
+
+
+def _save_transfer_results(
+	mails: list[dict],
+	updates: dict[str, dict],
+	failures: dict[str, str],
+	recipient_writer: RecipientStatusWriter,
+) -> int:
+	"""Writes the results of a transfer and returns the number of emails transferred."""
+
+	recipient_writer.flush()
+	bulk_update("Outgoing Mail", updates)
+	notify_updates("Outgoing Mail", list(updates))
+
+	if failures:
+		_mark_mails_as_failed(
+			{mail.name: mail.failed_count for mail in mails if mail.name in failures}, failures
+		)
+
+	frappe.db.commit()
+
+	return len(updates)
+
+
+def _mark_mails_as_failed(failed_counts: dict[str, int], error_logs: dict[str, str]) -> None:
+	"""Marks the emails as failed and schedules them for retry."""
+
+	updates = {}
+	for mail, failed_count in failed_counts.items():
+		failed_count += 1
+		updates[mail] = {
+			"status": "Failed",
+			"error_log": error_logs.get(mail),
+			"failed_count": failed_count,
+			"retry_after": get_retry_after(failed_count),
+			"lease_token": None,
+			"lease_expires_at": None,
+		}
+
+	bulk_update("Outgoing Mail", updates)
+	notify_updates("Outgoing Mail", list(updates))
+	frappe.db.commit()
 
 
 def transfer_mails_to_mail_agent() -> None:
-	"""Select emails and queues them for transfer to the agent."""
+	"""Claims emails in leased batches sized by the transfer plan and queues them for transfer to the agent."""
+
+	plan = get_transfer_plan()
+	claimed = {"fast": 0, "bulk": 0}
+
+	for lane, queue in [("fast", "short"), ("bulk", "long")]:
+		batch_size = plan[f"{lane}_batch_size"]
+		for _batch_idx in range(plan[f"{lane}_batches"]):
+			try:
+				lease_token, mails = claim_mails_for_transfer(batch_size, lane)
+				if not mails:
+					break
+
+				claimed[lane] += len(mails)
+				frappe.enqueue(
+					process_email_transfer_batch,
+					queue=queue,
+					job_name=f"process_email_transfer_batch_{lane}_{lease_token}_{len(mails)}",
+					enqueue_after_commit=False,
+					at_front=(lane == "fast"),
+					mails=mails,
+					lease_token=lease_token,
+				)
+
+				if len(mails) < batch_size:
+					break
+			except Exception:
+				frappe.db.rollback()
+				frappe.log_error("Error occurred while queuing emails for transfer.")
+				break
+
+	record_metrics(
+		"transfer_mails_to_mail_agent",
+		**plan,
+		fast_lane_claimed=claimed["fast"],
+		bulk_lane_claimed=claimed["bulk"],
+	)
+
+
+def get_transfer_plan() -> dict:
+	"""Returns the batch size and number of batches of each lane based on the observed per-message transfer latency, queue depth and worker count.
+
+	The fast lane carries priority-1 and non-newsletter emails on the `short` queue, so a newsletter
+	blast on the `long` queue cannot hold them up.
+	"""
+
+	MIN_BATCH_SIZE = 10
+	MAX_BATCH_SIZE = 1_000
+	DEFAULT_LATENCY = 0.5  # Seconds per message, used until transfers have been observed.
+	TARGET_BATCH_DURATION = {"fast": 30, "bulk": 300}  # Seconds per batch.
+	MAX_BATCHES_PER_WORKER = 2
 
-	MAX_BATCH_SIZE = 5_000
-	BATCH_PROCESS_SIZE = 1_000
+	latency = get_transfer_latency()
+	queue_depth = get_transfer_queue_depth()
+	workers = {"fast": get_worker_count("short"), "bulk": get_worker_count("long")}
+
+	plan = {
+		"latency": latency,
+		"fast_queue_depth": queue_depth["fast"],
+		"bulk_queue_depth": queue_depth["bulk"],
+	}
+	for lane in ["fast", "bulk"]:
+		depth = queue_depth[lane]
+		batch_size = int(TARGET_BATCH_DURATION[lane] / (latency or DEFAULT_LATENCY))
+
+		# Spread a small backlog across all workers instead of handing it to a single job.
+		batch_size = min(batch_size, ceil(depth / workers[lane])) if depth else batch_size
+		batch_size = max(MIN_BATCH_SIZE, min(batch_size, MAX_BATCH_SIZE))
+
+		plan[f"{lane}_workers"] = workers[lane]
+		plan[f"{lane}_batch_size"] = batch_size
+		plan[f"{lane}_batches"] = min(ceil(depth / batch_size), workers[lane] * MAX_BATCHES_PER_WORKER)
+
+	return plan
+
+
+def get_transfer_latency(minutes: int = 15) -> float | None:
+	"""Returns the average per-message transfer latency (in seconds) observed in the last `minutes`."""
 
 	OM = frappe.qb.DocType("Outgoing Mail")
-	mails = (
+	batches = (
 		frappe.qb.from_(OM)
-		.select(OM.name)
+		.select(Max(OM.transfer_completed_after), Count("*"))
 		.where(
 			(OM.docstatus == 1)
-			& (
-				(OM.status == "Pending")
-				| ((OM.status == "Failed") & (Now() >= OM.retry_after))
-				| ((OM.status == "Transferring") & (OM.transfer_started_at <= (Now() - Interval(minutes=10))))
-			)
+			& OM.transfer_started_at.isnotnull()
+			& (OM.transfer_completed_at >= (Now() - Interval(minutes=minutes)))
 		)
-		.orderby(OM.priority, order=Order.desc)
-		.orderby(OM.failed_count, OM.submitted_at, order=Order.asc)
-		.limit(MAX_BATCH_SIZE)
-	).run(pluck="name")
+		# Emails transferred in the same batch share `transfer_started_at`, and the slowest one
+		# measures the whole batch.
+		.groupby(OM.transfer_started_at)
+	).run()
 
-	if not mails:
-		return
+	total_duration = sum(flt(duration) for duration, count in batches)
+	total_count = sum(count for duration, count in batches)
 
-	try:
-		(
-			frappe.qb.update(OM).set(OM.status, "Queued").where((OM.docstatus == 1) & (OM.name.isin(mails)))
-		).run()
+	return flt(total_duration / total_count, 3) if total_count else None
+
+
+def get_transfer_queue_depth() -> dict[str, int]:
+	"""Returns the number of emails due for transfer in each lane."""
+
+	OM = frappe.qb.DocType("Outgoing Mail")
+	return {
+		lane: sum(
+			(
+				frappe.qb.from_(OM)
+				.select(Count("*"))
+				.where((OM.docstatus == 1) & condition & _get_lane_condition(OM, lane))
+			).run()[0][0]
+			for condition in _get_claimable_conditions(OM)
+		)
+		for lane in ["fast", "bulk"]
+	}
 
-		for idx, batch in enumerate(create_batch(mails, BATCH_PROCESS_SIZE)):
-			frappe.enqueue(
-				process_email_transfer_batch,
-				queue="long",
-				job_name=f"process_email_transfer_batch_{idx+1}_{len(batch)}",
-				enqueue_after_commit=False,
-				mails=batch,
-			)
 
-		# Recursively process next batch if the limit was reached.
-		if len(mails) == MAX_BATCH_SIZE:
-			transfer_mails_to_mail_agent()
+def get_worker_count(queue: str) -> int:
+	"""Returns the number of background workers listening to the queue."""
 
+	try:
+		return max(len(get_workers(queue)), 1)
 	except Exception:
-		frappe.log_error("Error occurred while queuing emails for transfer.")
+		return 1
+
+
+def claim_mails_for_transfer(
+	limit: int, lane: Literal["fast", "bulk"] | None = None
+) -> tuple[str | None, list[str]]:
+	"""Claims up to `limit` emails that are due for transfer under a new lease and returns the lease token and the claimed emails.
+
+	Rows are locked with `SELECT ... FOR UPDATE SKIP LOCKED`, so concurrent claims never return the same email.
+	Emails held by an unexpired lease are skipped; emails whose lease expired are claimed again.
+
+	Each status is claimed with its own query driven by the `(docstatus, status, lease_expires_at)` index, so that
+	InnoDB only locks the rows of that status that are due instead of scanning the table.
+	"""
+
+	OM = frappe.qb.DocType("Outgoing Mail")
+	mails = []
+
+	for condition in _get_claimable_conditions(OM):
+		if len(mails) >= limit:
+			break
+
+		query = (
+			frappe.qb.from_(OM)
+			.select(OM.name)
+			.where((OM.docstatus == 1) & condition)
+			.orderby(OM.priority, order=Order.desc)
+			.orderby(OM.failed_count, OM.submitted_at, order=Order.asc)
+			.limit(limit - len(mails))
+			.for_update(skip_locked=True)
+		)
+		if lane:
+			query = query.where(_get_lane_condition(OM, lane))
+
+		mails += query.run(pluck="name")
+
+	if not mails:
+		frappe.db.commit()
+		return None, []
+
+	lease_token = str(uuid7())
+	(
+		frappe.qb.update(OM)
+		.set(OM.lease_token, lease_token)
+		.set(OM.lease_expires_at, get_lease_expires_at())
+		.where(OM.name.isin(mails))
+	).run()
+	frappe.db.commit()
+
+	return lease_token, mails
+
+
+def _get_claimable_conditions(OM) -> list:
+	"""Returns the conditions matching the emails that are due for transfer and not held by an active lease, one
+	per status so that each can be served by the `(docstatus, status, lease_expires_at)` index. Emails whose
+	lease expired while they were processed come first."""
+
+	lease_expired = OM.lease_expires_at <= Now()
+	no_active_lease = OM.lease_expires_at.isnull() | lease_expired
+	return [
+		OM.status.isin(["Accepted", "Transferring"]) & lease_expired,
+		OM.status.isin(["Pending", "Queued"]) & no_active_lease,
+		(OM.status == "Failed")
+		& (OM.failed_count < MAX_FAILED_COUNT)
+		& no_active_lease
+		& (Now() >= OM.retry_after),
+		# Transferring emails from before leases were introduced.
+		(OM.status == "Transferring")
+		& OM.lease_expires_at.isnull()
+		& (OM.transfer_started_at <= (Now() - Interval(minutes=LEASE_DURATION_MINUTES))),
+	]
+
+
+def _get_lane_condition(OM, lane: Literal["fast", "bulk"]):
+	"""Returns the condition matching the emails of the lane."""
+
+	if lane == "fast":
+		return (OM.priority == 1) | (OM.is_newsletter == 0)
+
+	return (OM.priority != 1) & (OM.is_newsletter == 1)
+
+
+def record_open(tracking_id: str, ip: str | None = None) -> None:
+	"""Queues the open of the tracked mail in Redis, to be written to the database by `flush_opens`."""
+
+	event = {"tracking_id": tracking_id, "opened_at": now(), "ip_address": ip}
+	frappe.cache.rpush(OPEN_EVENTS_KEY, json.dumps(event))
+
+
+def flush_opens(batch_size: int = 1000) -> None:
+	"""Called by the scheduler to write the opens queued in Redis to the database, with a few multi-row
+	statements per batch.
+
+	Each batch is moved to a processing list and only deleted once it is committed, so a batch that fails to
+	write (e.g. on a lock timeout) is retried by the next flush instead of being lost.
+	"""
+
+	key = frappe.cache.make_key(OPEN_EVENTS_KEY)
+	processing_key = frappe.cache.make_key(OPEN_EVENTS_PROCESSING_KEY)
+
+	while True:
+		# A batch left over by a failed flush is retried first.
+		pipeline = frappe.cache.pipeline()
+		pipeline.lrange(processing_key, 0, -1)
+		if not (events := pipeline.execute()[0]):
+			# Opens queued meanwhile are left for the next batch.
+			events = frappe.cache.eval(MOVE_OPEN_EVENTS_SCRIPT, 2, key, processing_key, batch_size)
+
+		if not events:
+			break
+
+		try:
+			write_opens([json.loads(event) for event in events])
+			frappe.db.commit()
+		except Exception:
+			frappe.db.rollback()
+			frappe.log_error(title=_("Flush Opens"), message=frappe.get_traceback())
+			break
+
+		pipeline = frappe.cache.pipeline()
+		pipeline.delete(processing_key)
+		pipeline.execute()
+
+
+def write_opens(events: list[dict]) -> None:
+	"""Appends the open events to the Mail Open Event log, and adds them to the counters of the Outgoing Mails
+	and to the Mail Open Rollups. Events of unknown tracking ids are dropped."""
+
+	tracking_ids = list({event["tracking_id"] for event in events})
+	mails = {
+		mail.tracking_id: mail
+		for mail in frappe.db.get_all(
+			"Outgoing Mail",
+			{"docstatus": 1, "tracking_id": ["in", tracking_ids]},
+			["name", "tracking_id", "domain_name", "sender", "submitted_at", "first_opened_at"],
+		)
+	}
+
+	events = sorted(
+		(event for event in events if event["tracking_id"] in mails), key=lambda event: event["opened_at"]
+	)
+
+	opens = {}
+	for event in events:
+		mail = mails[event["tracking_id"]]
+		event.update(outgoing_mail=mail.name, domain_name=mail.domain_name, sender=mail.sender)
+
+		counter = opens.setdefault(mail.tracking_id, {"first_opened_at": event["opened_at"], "open_count": 0})
+		counter["open_count"] += 1
+		counter["last_opened_at"] = event["opened_at"]
+		counter["last_opened_from_ip"] = event["ip_address"]
+
+	# Rolled up by the day the mail was submitted, so that opens count towards the open rate of their mails.
+	rollups = defaultdict(lambda: {"opened": 0, "opens": 0})
+	for tracking_id, counter in opens.items():
+		mail = mails[tracking_id]
+		rollup = rollups[(str(getdate(mail.submitted_at)), mail.domain_name, mail.sender)]
+		rollup["opened"] += 0 if mail.first_opened_at else 1
+		rollup["opens"] += counter["open_count"]
+
+	create_mail_open_events(events)
+	update_opens(opens)
+	add_to_open_rollups(dict(rollups))
+
+
+def update_opens(opens: dict[str, dict]) -> None:
+	"""Adds the opens to the Outgoing Mails by tracking id with a single `UPDATE ... CASE` statement."""
+
+	if not opens:
+		return
+
+	OM = frappe.qb.DocType("Outgoing Mail")
+	first_opened_at, last_opened_at, open_count, last_opened_from_ip = Case(), Case(), Case(), Case()
+
+	for tracking_id, counter in opens.items():
+		condition = OM.tracking_id == tracking_id
+		first_opened_at = first_opened_at.when(condition, counter["first_opened_at"])
+		last_opened_at = last_opened_at.when(condition, counter["last_opened_at"])
+		open_count = open_count.when(condition, cint(counter["open_count"]))
+		last_opened_from_ip = last_opened_from_ip.when(condition, counter["last_opened_from_ip"] or None)
+
+	(
+		frappe.qb.update(OM)
+		.set(OM.first_opened_at, IfNull(OM.first_opened_at, first_opened_at))
+		.set(OM.last_opened_at, last_opened_at)
+		.set(OM.open_count, OM.open_count + open_count)
+		.set(OM.last_opened_from_ip, last_opened_from_ip)
+		.where((OM.docstatus == 1) & OM.tracking_id.isin(list(opens)))
+	).run()
 
 
 def delete_newsletters() -> None:
@@ -1293,3 +2092,10 @@ def get_permission_query_condition(user: str | None = None) -> str:
 		return f"(`tabOutgoing Mail`.`sender` = {frappe.db.escape(account)}) AND (`tabOutgoing Mail`.`docstatus` != 2)"
 	else:
 		return "1=0"
+
+
+def on_doctype_update() -> None:
+	# Serves the sent listing, which is sought by (created_at, name); InnoDB appends the primary key.
+	frappe.db.add_index("Outgoing Mail", ["sender", "docstatus", "status", "created_at"])
+	# Drives the claims of `claim_mails_for_transfer`, one status at a time.
+	frappe.db.add_index("Outgoing Mail", ["docstatus", "status", "lease_expires_at"])
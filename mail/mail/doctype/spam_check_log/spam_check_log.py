@@ -1,10 +1,12 @@
 # Copyright (c) 2024, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
+import hashlib
+import json
+import random
 import re
-import socket
+import time
 from email import message_from_string
-from email.mime.multipart import MIMEMultipart
 from typing import Literal
 
 import frappe
@@ -12,16 +14,37 @@ from frappe import _
 from frappe.model.document import Document
 from frappe.query_builder import Interval
 from frappe.query_builder.functions import Now
-from frappe.utils import now, time_diff_in_seconds
+from frappe.utils import cint, flt, now
 from uuid_utils import uuid7
 
-from mail.mail.doctype.mime_message.mime_message import (
-	create_mime_message,
-	get_mime_message,
-	update_mime_message,
+from mail.mail.doctype.mime_message.mime_message import MIMEMessageField
+from mail.spamd import (
+	SPAMD_MAX_CONNECTIONS,
+	SPAMD_TIMEOUT,
+	SpamdClient,
+	SpamdConnectionError,
+	SpamdError,
+	SpamdResult,
+	SpamdTimeoutError,
 )
 from mail.utils.dns import get_host_by_ip
 
+SPAM_VERDICT_KEY = "spam-verdict"
+SPAM_VERDICTS_KEY = "spam-verdicts"
+# Headers that differ per recipient or per copy of the same content.
+FINGERPRINT_EXCLUDED_HEADERS = {
+	"bcc",
+	"cc",
+	"content-type",
+	"date",
+	"dkim-signature",
+	"in-reply-to",
+	"message-id",
+	"received",
+	"references",
+	"to",
+}
+
 
 class SpamCheckLog(Document):
 	@staticmethod
@@ -29,17 +52,7 @@ class SpamCheckLog(Document):
 		log = frappe.qb.DocType("Spam Check Log")
 		frappe.db.delete(log, filters=(log.creation < (Now() - Interval(days=days))))
 
-	@property
-	def message(self) -> str:
-		if self._message:
-			return get_mime_message(self._message)
-
-	@message.setter
-	def message(self, value: str | bytes) -> None:
-		if self._message:
-			update_mime_message(self._message, value)
-		else:
-			self._message = create_mime_message(value)
+	message = MIMEMessageField("_message")
 
 	def autoname(self) -> None:
 		self.name = str(uuid7())
@@ -49,6 +62,7 @@ class SpamCheckLog(Document):
 			self.set_source_ip_address()
 			self.set_source_host()
 			self.scan_message()
+			self.store_message()
 
 	def set_source_ip_address(self) -> None:
 		"""Sets the source IP address"""
@@ -60,126 +74,366 @@ class SpamCheckLog(Document):
 
 		self.source_host = get_host_by_ip(self.source_ip_address)
 
+	def after_insert(self) -> None:
+		if self.flags.spam_scan:
+			# Lets the copies of the message in the same batch refer to this log.
+			self.flags.spam_scan["log"] = self.name
+
+		if self.fingerprint and not self.is_cached:
+			cache_spam_verdict(self)
+
 	def scan_message(self) -> None:
-		"""Scans the message for spam"""
+		"""Scans the message for spam, unless it was already scanned along with its batch."""
 
-		mail_settings = frappe.get_cached_doc("Mail Settings")
+		message = self.flags.message or self.message
+		scan = self.flags.spam_scan or scan_messages([message])[0]
+
+		if error := scan.get("error"):
+			throw_spamd_error(error)
 
-		if not mail_settings.enable_spamd:
-			frappe.throw(_("Spam Detection is disabled"))
+		self.spamd_response = scan["spamd_response"]
+		self.scanning_mode = scan["scanning_mode"]
+		self.hybrid_scanning_threshold = scan["hybrid_scanning_threshold"]
+		self.spam_score = extract_spam_score(self.spamd_response)
+		self.symbols = get_spam_symbols(self.spamd_response)
+		self.fingerprint = scan.get("fingerprint")
+		self.message_hash = hashlib.sha256(message.encode("utf-8")).hexdigest()
+		self.flags.scanned_message = scan.get("message") or message
+		self.started_at = scan["started_at"]
+		self.completed_at = scan["completed_at"]
+		self.duration = scan["duration"]
 
-		spamd_host = mail_settings.spamd_host
-		spamd_port = mail_settings.spamd_port
-		scanning_mode = mail_settings.spamd_scanning_mode
-		hybrid_scanning_threshold = mail_settings.spamd_hybrid_scanning_threshold
+		if scan.get("is_cached"):
+			self.is_cached = 1
+			self.cached_from = scan.get("cached_from") or scan.get("source", {}).get("log")
 
-		response = None
-		self.started_at = now()
+	def store_message(self) -> None:
+		"""Stores the scanned message once, unless its verdict was cached or the log is lightweight and the message
+		is neither spam nor sampled."""
 
-		if scanning_mode == "Hybrid Approach":
-			message_without_attachments = get_message_without_attachments(self.message)
-			initial_response = scan_message(spamd_host, spamd_port, message_without_attachments)
-			initial_spam_score = extract_spam_score(initial_response)
+		if self._message or self.is_cached:
+			return
+
+		mail_settings = frappe.get_cached_doc("Mail Settings")
+		if mail_settings.spamd_log_mode == "Lightweight":
+			is_spam = self.spam_score > flt(mail_settings.spamd_outbound_threshold)
+			if not is_spam and random.random() * 100 >= flt(mail_settings.spamd_log_sample_rate):
+				return
 
-			if initial_spam_score < hybrid_scanning_threshold:
-				response = initial_response
+		self.message = self.flags.scanned_message
 
-		elif scanning_mode == "Exclude Attachments":
-			self.message = get_message_without_attachments(self.message)
 
-		response = response or scan_message(spamd_host, spamd_port, self.message)
-		self.spamd_response = response
-		self.scanning_mode = scanning_mode
-		self.hybrid_scanning_threshold = hybrid_scanning_threshold
-		self.spam_score = extract_spam_score(response)
-		self.completed_at = now()
-		self.duration = time_diff_in_seconds(self.completed_at, self.started_at)
+def create_spam_check_log(
+	message: str, scan: dict | None = None, fingerprint_exclude: list[str | None] | None = None
+) -> SpamCheckLog:
+	"""Creates a Spam Check Log document. The `scan` of the message is used if it was scanned beforehand with
+	`scan_messages`, otherwise the message is scanned with the given `fingerprint_exclude`.
 
+	The message is stored once, after the scan, as per the log mode. It isn't stored when its verdict was reused
+	from a message with the same content.
+	"""
 
-def create_spam_check_log(message: str) -> SpamCheckLog:
-	"""Creates a Spam Check Log document"""
+	if not scan:
+		scan = scan_messages([message], [fingerprint_exclude] if fingerprint_exclude is not None else None)[0]
 
 	doc = frappe.new_doc("Spam Check Log")
-	doc.message = message
+	doc.flags.spam_scan = scan
+	doc.flags.message = message
+
+	if scan.get("is_cached"):
+		# The log it was cached from may have been cleared already.
+		doc.flags.ignore_links = True
+
 	doc.insert(ignore_permissions=True)
 
 	return doc
 
 
+def scan_messages(
+	messages: list[str], fingerprint_excludes: list[list[str | None]] | None = None
+) -> list[dict]:
+	"""Scans the messages for spam concurrently as per the scanning mode and returns the scan of each message, in
+	order. A message that could not be scanned has the `error` it failed with instead of a `spamd_response`.
+
+	In "Hybrid Approach", the messages with attachments are first scanned without them, and scanned again in full
+	only if they score at or above the threshold. Messages without attachments are scanned once.
+
+	When `fingerprint_excludes` is given, with the values of each message that differ per recipient (e.g. the
+	tracking id), messages with the same content as a message scanned earlier or in the same batch reuse its
+	verdict, if the verdict cache is enabled.
+	"""
+
+	mail_settings = frappe.get_cached_doc("Mail Settings")
+
+	if not mail_settings.enable_spamd:
+		frappe.throw(_("Spam Detection is disabled"))
+
+	client = get_spamd_client()
+	messages = list(messages)
+	scanning_mode = mail_settings.spamd_scanning_mode
+	hybrid_scanning_threshold = mail_settings.spamd_hybrid_scanning_threshold
+	started_at = now()
+	scans = [
+		{
+			"scanning_mode": scanning_mode,
+			"hybrid_scanning_threshold": hybrid_scanning_threshold,
+			"started_at": started_at,
+			"duration": 0,
+		}
+		for message in messages
+	]
+	pending = list(range(len(messages)))
+	sources = {}
+
+	if fingerprint_excludes is not None and cint(mail_settings.spamd_verdict_cache_ttl):
+		for scan, message, exclude in zip(scans, messages, fingerprint_excludes, strict=True):
+			scan["fingerprint"] = get_message_fingerprint(message, exclude)
+
+		verdicts = get_spam_verdicts([scan["fingerprint"] for scan in scans])
+		pending = []
+
+		for i, scan in enumerate(scans):
+			if verdict := verdicts.get(scan["fingerprint"]):
+				scan.update(
+					is_cached=True, cached_from=verdict["name"], spamd_response=verdict["spamd_response"]
+				)
+			elif source := sources.get(scan["fingerprint"]):
+				scan.update(is_cached=True, source=source)
+			else:
+				sources[scan["fingerprint"]] = scan
+				pending.append(i)
+
+	if scanning_mode == "Hybrid Approach":
+		messages_without_attachments = {i: get_message_without_attachments(messages[i]) for i in pending}
+		partial = [i for i in pending if messages_without_attachments[i] != messages[i]]
+		results = client.scan_many([messages_without_attachments[i] for i in partial])
+		pending = [i for i in pending if messages_without_attachments[i] == messages[i]]
+
+		for i, result in zip(partial, results, strict=True):
+			add_spamd_result(scans[i], result)
+			if isinstance(result, SpamdError):
+				continue
+
+			spam_score = get_spam_score(result.response)
+			if spam_score is None or spam_score >= hybrid_scanning_threshold:
+				pending.append(i)
+
+	elif scanning_mode == "Exclude Attachments":
+		for i in pending:
+			messages[i] = scans[i]["message"] = get_message_without_attachments(messages[i])
+
+	results = client.scan_many([messages[i] for i in pending])
+	for i, result in zip(pending, results, strict=True):
+		add_spamd_result(scans[i], result)
+
+	completed_at = now()
+	for scan in scans:
+		if source := scan.get("source"):
+			# Copies of a message in the same batch share its verdict.
+			for field in ["spamd_response", "error"]:
+				if field in source:
+					scan[field] = source[field]
+
+		scan["completed_at"] = completed_at
+		scan["duration"] = round(scan["duration"], 3)
+
+	return scans
+
+
+def add_spamd_result(scan: dict, result: SpamdResult | SpamdError) -> None:
+	"""Sets the spamd response or error of the scan, adding up the durations of its scans."""
+
+	if isinstance(result, SpamdError):
+		scan.pop("spamd_response", None)
+		scan["error"] = result
+	else:
+		scan["spamd_response"] = result.response
+		scan["duration"] += result.duration
+
+
+def get_spamd_client() -> SpamdClient:
+	"""Returns the spamd client as per the Mail Settings."""
+
+	mail_settings = frappe.get_cached_doc("Mail Settings")
+	return SpamdClient(
+		mail_settings.spamd_host,
+		mail_settings.spamd_port,
+		max_connections=cint(mail_settings.spamd_max_connections) or SPAMD_MAX_CONNECTIONS,
+		timeout=cint(mail_settings.spamd_timeout) or SPAMD_TIMEOUT,
+	)
+
+
 def get_message_without_attachments(message: str) -> str:
-	"""Returns the message without attachments"""
+	"""Returns the message without attachments, or the message itself if it has none. The attachments are removed
+	from the parsed message in place, keeping its headers and structure."""
 
 	parsed_message = message_from_string(message)
-	message_without_attachments = MIMEMultipart()
-
-	for header, value in parsed_message.items():
-		message_without_attachments[header] = value
+	has_attachments = False
 
 	for part in parsed_message.walk():
-		if part.get_content_maintype() == "multipart":
+		if not part.is_multipart():
 			continue
-		if part.get("Content-Disposition") is None:
-			message_without_attachments.attach(part)
-
-	return message_without_attachments.as_string()
-
-
-def scan_message(host: str, port: int, message: str) -> str:
-	"""Scans the message for spam"""
-
-	try:
-		with socket.create_connection((host, port), timeout=60) as sock:
-			sock.settimeout(60 * 2)
-			command = "SYMBOLS SPAMC/1.5\r\n\r\n"
-			sock.sendall(command.encode("utf-8"))
-			sock.sendall(message.encode("utf-8"))
-			sock.shutdown(socket.SHUT_WR)
-
-			response = ""
-			while True:
-				try:
-					data = sock.recv(4096)
-					if not data:
-						break
-					response += data.decode("utf-8")
-				except TimeoutError:
-					frappe.throw(
-						_("Timed out waiting for response from SpamAssassin."),
-						title=_("Spam Detection Failed"),
-					)
-
-	except ConnectionRefusedError:
+
+		subparts = part.get_payload()
+		kept = [
+			subpart
+			for subpart in subparts
+			if subpart.is_multipart() or subpart.get("Content-Disposition") is None
+		]
+		if len(kept) < len(subparts):
+			part.set_payload(kept)
+			has_attachments = True
+
+	return parsed_message.as_string() if has_attachments else message
+
+
+def get_message_fingerprint(message: str, exclude: list[str | None] | None = None) -> str:
+	"""Returns the fingerprint of the content of the message, so that the copies sent to different recipients
+	share it.
+
+	It covers the headers, except those that differ per recipient or per copy, and the hashes of the body and
+	attachments, with the content ids and the `exclude` values (e.g. the tracking id) removed from the text parts.
+	"""
+
+	parsed_message = message_from_string(message)
+	parts = [part for part in parsed_message.walk() if part.get_content_maintype() != "multipart"]
+	content_ids = [part.get("Content-ID", "").strip("<>") for part in parts]
+	exclude = [value.encode() for value in [*(exclude or []), *content_ids] if value]
+	fingerprint = hashlib.sha256()
+
+	for header, value in parsed_message.items():
+		if header.lower() not in FINGERPRINT_EXCLUDED_HEADERS:
+			fingerprint.update(f"{header}: {value}\n".encode())
+
+	for part in parts:
+		payload = part.get_payload(decode=True) or b""
+		if part.get_content_maintype() == "text":
+			for value in exclude:
+				payload = payload.replace(value, b"")
+
+		fingerprint.update(f"{part.get_content_type()}; {part.get_filename()}\n".encode())
+		fingerprint.update(hashlib.sha256(payload).digest())
+
+	return fingerprint.hexdigest()
+
+
+def get_spam_verdicts(fingerprints: list[str]) -> dict[str, dict]:
+	"""Returns the cached verdicts of the messages with the given fingerprints, by fingerprint."""
+
+	if not fingerprints:
+		return {}
+
+	members = [get_spam_verdict_member(fingerprint) for fingerprint in fingerprints]
+	values = frappe.cache.mget([frappe.cache.make_key(f"{SPAM_VERDICT_KEY}|{member}") for member in members])
+	verdicts = {}
+	used = {}
+
+	for fingerprint, member, value in zip(fingerprints, members, values, strict=True):
+		if value:
+			verdicts[fingerprint] = json.loads(value)
+			used[member] = time.time()
+
+	if used:
+		# The verdicts are evicted in order of last use.
+		frappe.cache.zadd(frappe.cache.make_key(SPAM_VERDICTS_KEY), used)
+
+	return verdicts
+
+
+def cache_spam_verdict(log: SpamCheckLog) -> None:
+	"""Caches the verdict of the log for the messages with the same content, evicting the least recently used
+	verdicts beyond the cache size."""
+
+	mail_settings = frappe.get_cached_doc("Mail Settings")
+	if not (ttl := cint(mail_settings.spamd_verdict_cache_ttl)):
+		return
+
+	max_size = cint(mail_settings.spamd_verdict_cache_size)
+	member = get_spam_verdict_member(log.fingerprint)
+	verdict = {"name": log.name, "spamd_response": log.spamd_response}
+	key = frappe.cache.make_key(SPAM_VERDICTS_KEY)
+	timestamp = time.time()
+
+	pipeline = frappe.cache.pipeline()
+	pipeline.set(frappe.cache.make_key(f"{SPAM_VERDICT_KEY}|{member}"), json.dumps(verdict), ex=ttl)
+	pipeline.zadd(key, {member: timestamp})
+	# The verdicts not used within the TTL have expired already.
+	pipeline.zremrangebyscore(key, "-inf", timestamp - ttl)
+	pipeline.zcard(key)
+	size = pipeline.execute()[-1]
+
+	if size > max_size and (evicted := frappe.cache.zpopmin(key, size - max_size)):
+		frappe.cache.delete(
+			*[frappe.cache.make_key(f"{SPAM_VERDICT_KEY}|{member.decode()}") for member, __ in evicted]
+		)
+
+
+def get_spam_verdict_member(fingerprint: str) -> str:
+	"""Returns the cache member of the fingerprint. Verdicts are only reused within the same scanning mode and
+	threshold."""
+
+	mail_settings = frappe.get_cached_doc("Mail Settings")
+	return (
+		f"{mail_settings.spamd_scanning_mode}|{mail_settings.spamd_hybrid_scanning_threshold}|{fingerprint}"
+	)
+
+
+def throw_spamd_error(error: SpamdError) -> None:
+	"""Throws the error a scan failed with"""
+
+	mail_settings = frappe.get_cached_doc("Mail Settings")
+	host, port = mail_settings.spamd_host, mail_settings.spamd_port
+
+	if isinstance(error, SpamdTimeoutError):
 		frappe.throw(
-			_("Could not connect to SpamAssassin (spamd). Please ensure it's running on {0}:{1}").format(
-				host, port
-			),
+			_("Timed out waiting for response from SpamAssassin."),
 			title=_("Spam Detection Failed"),
 		)
 
-	if not response:
-		error_steps = [
-			_("1. Ensure the correct IP address is allowed to connect to SpamAssassin."),
-			_(
-				"2. Verify that the SpamAssassin service is running and accepting connections on port {0}."
-			).format(port),
-			_("3. Review SpamAssassin logs for any unauthorized connection attempts or permission errors."),
-		]
-		formatted_error_steps = "".join(f"<hr/>{step}" for step in error_steps)
+	if isinstance(error, SpamdConnectionError):
 		frappe.throw(
-			_(
-				"SpamAssassin did not return the expected response. This may indicate a permission issue or an unauthorized connection. Please check the following: {0}"
-			).format(formatted_error_steps),
+			_("Could not connect to SpamAssassin (spamd). Please ensure it's running on {0}:{1}").format(
+				host, port
+			),
 			title=_("Spam Detection Failed"),
-			wide=True,
 		)
 
-	return response
+	error_steps = [
+		_("1. Ensure the correct IP address is allowed to connect to SpamAssassin."),
+		_("2. Verify that the SpamAssassin service is running and accepting connections on port {0}.").format(
+			port
+		),
+		_("3. Review SpamAssassin logs for any unauthorized connection attempts or permission errors."),
+	]
+	formatted_error_steps = "".join(f"<hr/>{step}" for step in error_steps)
+	frappe.throw(
+		_(
+			"SpamAssassin did not return the expected response. This may indicate a permission issue or an unauthorized connection. Please check the following: {0}"
+		).format(formatted_error_steps),
+		title=_("Spam Detection Failed"),
+		wide=True,
+	)
 
 
 def extract_spam_score(spamd_response: str) -> float:
 	"""Extracts the spam score from the spamd response"""
 
+	if (spam_score := get_spam_score(spamd_response)) is not None:
+		return spam_score
+
+	frappe.throw(_("Spam score not found in output."), title=_("Spam Detection Failed"))
+
+
+def get_spam_score(spamd_response: str) -> float | None:
+	"""Returns the spam score of the spamd response, or None if it has none"""
+
 	if match := re.search(r"Spam:.*?;\s*(-?\d+\.\d+)\s*/", spamd_response):
 		return float(match.group(1))
 
-	frappe.throw(_("Spam score not found in output."), title=_("Spam Detection Failed"))
+	return None
+
+
+def get_spam_symbols(spamd_response: str) -> str:
+	"""Returns the comma separated rules that matched, from the body of the spamd response"""
+
+	return spamd_response.partition("\r\n\r\n")[2].strip()
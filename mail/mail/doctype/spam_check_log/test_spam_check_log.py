@@ -1,9 +1,111 @@
 # Copyright (c) 2024, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
+import socket
+import time
+from collections.abc import Callable
+from contextlib import suppress
+from threading import Thread
+
+from frappe.tests import UnitTestCase
 from frappe.tests.utils import FrappeTestCase
 
+from mail.spamd import SpamdClient, SpamdConnectionError, SpamdError, SpamdTimeoutError
+
+SYMBOLS_RESPONSE = b"SPAMD/1.1 0 EX_OK\r\nSpam: False ; 1.5 / 5.0\r\n\r\nMISSING_DATE,NO_RELAYS"
+
+
+class FakeSpamd:
+	"""A spamd stand-in that records the request of each connection and answers it with the response returned
+	by `respond` for the request body, after `delay` seconds."""
+
+	def __init__(self, respond: Callable[[bytes], bytes] | None = None, delay: float = 0) -> None:
+		self.respond = respond or (lambda body: SYMBOLS_RESPONSE)
+		self.delay = delay
+		self.requests = []
+		self.server = socket.create_server(("127.0.0.1", 0), backlog=32)
+		self.port = self.server.getsockname()[1]
+		Thread(target=self._serve, daemon=True).start()
+
+	def _serve(self) -> None:
+		while True:
+			try:
+				conn, _ = self.server.accept()
+			except OSError:
+				return
+
+			Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+	def _handle(self, conn: socket.socket) -> None:
+		with conn, suppress(OSError):
+			request = b""
+			while chunk := conn.recv(65536):
+				request += chunk
+
+			self.requests.append(request)
+			time.sleep(self.delay)
+			conn.sendall(self.respond(request.partition(b"\r\n\r\n")[2]))
+
+	def close(self) -> None:
+		self.server.close()
+
+
+class UnitTestSpamdClient(UnitTestCase):
+	def setUp(self) -> None:
+		self.spamd = FakeSpamd()
+
+	def tearDown(self) -> None:
+		self.spamd.close()
+
+	def test_scan(self) -> None:
+		message = "Subject: Test\r\n\r\nHello, World!\r\n"
+		result = SpamdClient("127.0.0.1", self.spamd.port).scan(message)
+
+		self.assertEqual(
+			self.spamd.requests,
+			[f"SYMBOLS SPAMC/1.5\r\nContent-length: {len(message)}\r\n\r\n{message}".encode()],
+		)
+		self.assertEqual(result.response, SYMBOLS_RESPONSE.decode())
+		self.assertGreaterEqual(result.duration, 0)
+
+	def test_scan_timeout(self) -> None:
+		self.spamd.delay = 2
+		started_at = time.monotonic()
+
+		with self.assertRaises(SpamdTimeoutError):
+			SpamdClient("127.0.0.1", self.spamd.port, timeout=0.5).scan("Subject: Test\r\n\r\n")
+
+		self.assertLess(time.monotonic() - started_at, 1.5)
+
+	def test_scan_connection_error(self) -> None:
+		# A port that is bound but not listening refuses connections.
+		with socket.socket() as sock:
+			sock.bind(("127.0.0.1", 0))
+			port = sock.getsockname()[1]
+
+			with self.assertRaises(SpamdConnectionError):
+				SpamdClient("127.0.0.1", port, connect_timeout=1).scan("Subject: Test\r\n\r\n")
+
+	def test_scan_empty_response(self) -> None:
+		self.spamd.respond = lambda body: b""
+
+		with self.assertRaises(SpamdError):
+			SpamdClient("127.0.0.1", self.spamd.port).scan("Subject: Test\r\n\r\n")
+
+	def test_scan_many(self) -> None:
+		# Each response carries the message it answers, and spamd fails on every fifth message.
+		self.spamd.respond = lambda body: b"" if body.endswith(b"FAIL") else SYMBOLS_RESPONSE + b"," + body
+		messages = [f"Subject: {i}\r\n\r\n" + ("FAIL" if i % 5 == 0 else f"MSG_{i}") for i in range(20)]
+
+		results = SpamdClient("127.0.0.1", self.spamd.port, max_connections=4).scan_many(messages)
+
+		self.assertEqual(len(results), len(messages))
+		for message, result in zip(messages, results, strict=True):
+			if message.endswith("FAIL"):
+				self.assertIsInstance(result, SpamdError)
+			else:
+				self.assertEqual(result.response, SYMBOLS_RESPONSE.decode() + "," + message)
+
 
 class TestSpamCheckLog(FrappeTestCase):
 	pass
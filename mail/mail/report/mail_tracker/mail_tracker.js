@@ -17,25 +17,6 @@ frappe.query_reports['Mail Tracker'] = {
 			default: frappe.datetime.get_today(),
 			reqd: 1,
 		},
-		{
-			fieldname: 'name',
-			label: __('Outgoing Mail'),
-			fieldtype: 'Link',
-			options: 'Outgoing Mail',
-			get_query: () => {
-				return {
-					query: 'mail.utils.query.get_outgoing_mails',
-				}
-			},
-		},
-		{
-			fieldname: 'status',
-			label: __('Status'),
-			fieldtype: 'MultiSelectList',
-			get_data: () => {
-				return ['', 'Pending', 'Queued', 'Failed', 'Blocked', 'Sent']
-			},
-		},
 		{
 			fieldname: 'domain_name',
 			label: __('Domain Name'),
@@ -52,20 +33,5 @@ frappe.query_reports['Mail Tracker'] = {
 				return frappe.db.get_link_options('Mail Account', txt)
 			},
 		},
-		{
-			fieldname: 'from_',
-			label: __('From'),
-			fieldtype: 'Data',
-		},
-		{
-			fieldname: 'message_id',
-			label: __('Message ID'),
-			fieldtype: 'Data',
-		},
-		{
-			fieldname: 'tracking_id',
-			label: __('Tracking ID'),
-			fieldtype: 'Data',
-		},
 	],
 }
@@ -4,7 +4,7 @@
 import frappe
 from frappe import _
 from frappe.query_builder import Criterion, Order
-from frappe.query_builder.functions import Date
+from frappe.utils import flt
 
 from mail.utils.cache import get_account_for_user, get_domains_owned_by_tenant, get_tenant_for_user
 from mail.utils.user import has_role, is_system_manager
@@ -21,29 +21,10 @@ def execute(filters: dict | None = None) -> tuple:
 def get_columns() -> list[dict]:
 	return [
 		{
-			"label": _("Name"),
-			"fieldname": "name",
-			"fieldtype": "Link",
-			"options": "Outgoing Mail",
-			"width": 100,
-		},
-		{
-			"label": _("Submitted At"),
-			"fieldname": "submitted_at",
-			"fieldtype": "Datetime",
-			"width": 180,
-		},
-		{
-			"label": _("Status"),
-			"fieldname": "status",
-			"fieldtype": "Data",
-			"width": 100,
-		},
-		{
-			"label": _("Open Count"),
-			"fieldname": "open_count",
-			"fieldtype": "Int",
-			"width": 130,
+			"label": _("Date"),
+			"fieldname": "date",
+			"fieldtype": "Date",
+			"width": 120,
 		},
 		{
 			"label": _("Domain Name"),
@@ -60,39 +41,27 @@ def get_columns() -> list[dict]:
 			"width": 200,
 		},
 		{
-			"label": _("From"),
-			"fieldname": "from_",
-			"fieldtype": "Data",
-			"width": 200,
-		},
-		{
-			"label": _("Message ID"),
-			"fieldname": "message_id",
-			"fieldtype": "Data",
-			"width": 200,
-		},
-		{
-			"label": _("Tracking ID"),
-			"fieldname": "tracking_id",
-			"fieldtype": "Data",
-			"width": 200,
+			"label": _("Sent"),
+			"fieldname": "sent",
+			"fieldtype": "Int",
+			"width": 100,
 		},
 		{
-			"label": _("First Opened At"),
-			"fieldname": "first_opened_at",
-			"fieldtype": "Datetime",
-			"width": 180,
+			"label": _("Opened"),
+			"fieldname": "opened",
+			"fieldtype": "Int",
+			"width": 100,
 		},
 		{
-			"label": _("Last Opened At"),
-			"fieldname": "last_opened_at",
-			"fieldtype": "Datetime",
-			"width": 180,
+			"label": _("Opens"),
+			"fieldname": "opens",
+			"fieldtype": "Int",
+			"width": 100,
 		},
 		{
-			"label": _("Last Opened From IP"),
-			"fieldname": "last_opened_from_ip",
-			"fieldtype": "Data",
+			"label": _("Open Rate"),
+			"fieldname": "open_rate",
+			"fieldtype": "Percent",
 			"width": 120,
 		},
 	]
@@ -101,49 +70,22 @@ def get_columns() -> list[dict]:
 def get_data(filters: dict | None = None) -> list[dict]:
 	filters = filters or {}
 
-	OM = frappe.qb.DocType("Outgoing Mail")
+	MOR = frappe.qb.DocType("Mail Open Rollup")
 	query = (
-		frappe.qb.from_(OM)
-		.select(
-			OM.name,
-			OM.submitted_at,
-			OM.status,
-			OM.open_count,
-			OM.domain_name,
-			OM.sender,
-			OM.from_,
-			OM.message_id,
-			OM.tracking_id,
-			OM.first_opened_at,
-			OM.last_opened_at,
-			OM.last_opened_from_ip,
-		)
-		.where((OM.docstatus == 1) & (OM.tracking_id.isnotnull()))
-		.orderby(OM.submitted_at, order=Order.desc)
+		frappe.qb.from_(MOR)
+		.select(MOR.date, MOR.domain_name, MOR.sender, MOR.sent, MOR.opened, MOR.opens)
+		.where((MOR.date >= filters.get("from_date")) & (MOR.date <= filters.get("to_date")))
+		.orderby(MOR.date, order=Order.desc)
+		.orderby(MOR.domain_name)
+		.orderby(MOR.sender)
 	)
 
-	if not filters.get("name") and not filters.get("message_id") and not filters.get("tracking_id"):
-		query = query.where(
-			(Date(OM.submitted_at) >= Date(filters.get("from_date")))
-			& (Date(OM.submitted_at) <= Date(filters.get("to_date")))
-		)
-
 	for field in [
-		"name",
-		"from_",
-		"message_id",
-		"tracking_id",
-	]:
-		if filters.get(field):
-			query = query.where(OM[field] == filters.get(field))
-
-	for field in [
-		"status",
 		"domain_name",
 		"sender",
 	]:
 		if filters.get(field):
-			query = query.where(OM[field].isin(filters.get(field)))
+			query = query.where(MOR[field].isin(filters.get(field)))
 
 	user = frappe.session.user
 	if not is_system_manager(user):
@@ -152,40 +94,52 @@ def get_data(filters: dict | None = None) -> list[dict]:
 		if has_role(user, "Mail Admin"):
 			if tenant := get_tenant_for_user(user):
 				if domains := get_domains_owned_by_tenant(tenant):
-					conditions.append(OM.domain_name.isin(domains))
+					conditions.append(MOR.domain_name.isin(domains))
 		elif has_role(user, "Mail User"):
 			if account := get_account_for_user(user):
-				conditions.append(OM.sender == account)
+				conditions.append(MOR.sender == account)
 
 		if not conditions:
 			return []
 
 		query = query.where(Criterion.any(conditions))
 
-	return query.run(as_dict=True)
+	data = query.run(as_dict=True)
+
+	for row in data:
+		row["open_rate"] = get_open_rate(row["opened"], row["sent"])
+
+	return data
 
 
 def get_summary(data: dict) -> list[dict]:
 	if not data:
 		return
 
-	total_open_count = 0
-
-	for row in data:
-		if row["open_count"] > 0:
-			total_open_count += 1
+	total_sent = sum(row["sent"] for row in data)
+	total_opened = sum(row["opened"] for row in data)
 
 	return [
 		{
 			"label": _("Total Sent"),
 			"datatype": "Int",
-			"value": len(data),
+			"value": total_sent,
 			"indicator": "green",
 		},
 		{
 			"label": _("Total Opened"),
 			"datatype": "Int",
-			"value": total_open_count,
+			"value": total_opened,
+			"indicator": "blue",
+		},
+		{
+			"label": _("Open Rate"),
+			"datatype": "Percent",
+			"value": get_open_rate(total_opened, total_sent),
 			"indicator": "blue",
 		},
 	]
+
+
+def get_open_rate(opened: int, sent: int) -> float:
+	return flt(opened / sent * 100, 2) if sent else 0
@@ -0,0 +1,49 @@
+import frappe
+from frappe.query_builder import Case
+from frappe.query_builder.functions import Count, Date, Sum
+
+from mail.mail.doctype.mail_open_rollup.mail_open_rollup import upsert_open_rollups
+from mail.utils import enqueue_job
+
+
+def execute() -> None:
+	"""Enqueues the creation of the Mail Open Rollups of the existing tracked mails."""
+
+	enqueue_job(
+		create_mail_open_rollups,
+		queue="long",
+		timeout=6 * 60 * 60,
+		deduplicate=True,
+		enqueue_after_commit=True,
+	)
+
+
+def create_mail_open_rollups() -> None:
+	"""Sets the counts of the Mail Open Rollups from the open counters of the tracked Outgoing Mails."""
+
+	OM = frappe.qb.DocType("Outgoing Mail")
+	rollups = (
+		frappe.qb.from_(OM)
+		.select(
+			Date(OM.submitted_at).as_("date"),
+			OM.domain_name,
+			OM.sender,
+			Count("*").as_("sent"),
+			Sum(Case().when(OM.first_opened_at.isnotnull(), 1).else_(0)).as_("opened"),
+			Sum(OM.open_count).as_("opens"),
+		)
+		.where((OM.docstatus == 1) & (OM.tracking_id.isnotnull()))
+		.groupby(Date(OM.submitted_at), OM.domain_name, OM.sender)
+	).run(as_dict=True)
+
+	upsert_open_rollups(
+		{
+			(str(rollup.date), rollup.domain_name, rollup.sender): {
+				"sent": rollup.sent,
+				"opened": int(rollup.opened or 0),
+				"opens": int(rollup.opens or 0),
+			}
+			for rollup in rollups
+		},
+		increment=False,
+	)
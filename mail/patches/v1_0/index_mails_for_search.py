@@ -0,0 +1,62 @@
+from collections import defaultdict
+
+import frappe
+
+from mail.mail.doctype.mail_search_index.mail_search_index import index_mails
+from mail.utils import enqueue_job
+
+
+def execute() -> None:
+	"""Enqueues the indexing of the existing submitted incoming and outgoing mails for search."""
+
+	enqueue_job(
+		index_existing_mails, queue="long", timeout=6 * 60 * 60, deduplicate=True, enqueue_after_commit=True
+	)
+
+
+def index_existing_mails(batch_size: int = 500) -> None:
+	"""Adds the submitted mails to the search index, in batches committed one by one. Mails that are already
+	indexed are skipped."""
+
+	fields = ["name", "subject", "sender", "display_name", "created_at", "body_html", "body_plain"]
+
+	for doctype in ["Incoming Mail", "Outgoing Mail"]:
+		MAIL = frappe.qb.DocType(doctype)
+		last_name = None
+
+		while True:
+			query = (
+				frappe.qb.from_(MAIL)
+				.select(*[MAIL[field] for field in fields])
+				.where(MAIL.docstatus == 1)
+				.orderby(MAIL.name)
+				.limit(batch_size)
+			)
+
+			if doctype == "Incoming Mail":
+				query = query.select(MAIL.receiver)
+			else:
+				query = query.where(MAIL.is_newsletter == 0)
+
+			if last_name:
+				query = query.where(MAIL.name > last_name)
+
+			if not (mails := query.run(as_dict=True)):
+				break
+
+			recipients = defaultdict(list)
+			for recipient in frappe.db.get_all(
+				"Mail Recipient",
+				{"parenttype": doctype, "parent": ["in", [mail.name for mail in mails]]},
+				["parent", "email", "display_name"],
+			):
+				recipients[recipient.parent].append(recipient)
+
+			for mail in mails:
+				mail.doctype = doctype
+				mail.recipients = recipients[mail.name]
+
+			index_mails(mails)
+			frappe.db.commit()
+
+			last_name = mails[-1].name
@@ -0,0 +1,53 @@
+import frappe
+
+from mail.mail.doctype.mime_blob.mime_blob import store_mime_blobs
+from mail.utils import bulk_update, enqueue_job
+
+
+def execute() -> None:
+	"""Enqueues the move of the messages stored in MIME Message rows to the compressed, content-addressed blob
+	store, which are read from the rows until then."""
+
+	enqueue_job(
+		move_mime_messages_to_blob_store,
+		queue="long",
+		timeout=6 * 60 * 60,
+		deduplicate=True,
+		enqueue_after_commit=True,
+	)
+
+
+def move_mime_messages_to_blob_store(batch_size: int = 500) -> None:
+	"""Moves the messages of the MIME Message rows without a blob to the blob store, in batches committed one
+	by one."""
+
+	MM = frappe.qb.DocType("MIME Message")
+	last_name = None
+
+	while True:
+		query = (
+			frappe.qb.from_(MM)
+			.select(MM.name, MM.message)
+			.where(MM.blob.isnull() & MM.message.isnotnull())
+			.orderby(MM.name)
+			.limit(batch_size)
+		)
+
+		if last_name:
+			query = query.where(MM.name > last_name)
+
+		if not (mime_messages := query.run(as_dict=True)):
+			break
+
+		blobs = store_mime_blobs([mime_message.message.encode("utf-8") for mime_message in mime_messages])
+		bulk_update(
+			"MIME Message",
+			{
+				mime_message.name: {"blob": blob, "message": None}
+				for mime_message, blob in zip(mime_messages, blobs, strict=True)
+			},
+			update_modified=False,
+		)
+		frappe.db.commit()
+
+		last_name = mime_messages[-1].name
@@ -0,0 +1,46 @@
+import frappe
+
+from mail.utils import bulk_update, enqueue_job, get_latest_content, get_snippet
+
+
+def execute() -> None:
+	"""Enqueues the backfill of the latest content and snippet of the existing incoming and outgoing mails,
+	which are shown from the bodies until then."""
+
+	enqueue_job(set_snippets, queue="long", timeout=6 * 60 * 60, deduplicate=True, enqueue_after_commit=True)
+
+
+def set_snippets(batch_size: int = 500) -> None:
+	"""Sets the latest content and snippet of the mails without one, in batches committed one by one."""
+
+	for doctype in ["Incoming Mail", "Outgoing Mail"]:
+		MAIL = frappe.qb.DocType(doctype)
+		last_name = None
+
+		while True:
+			query = (
+				frappe.qb.from_(MAIL)
+				.select(MAIL.name, MAIL.body_html, MAIL.body_plain)
+				.where(MAIL.snippet.isnull())
+				.orderby(MAIL.name)
+				.limit(batch_size)
+			)
+
+			if last_name:
+				query = query.where(MAIL.name > last_name)
+
+			if not (mails := query.run(as_dict=True)):
+				break
+
+			updates = {}
+			for mail in mails:
+				latest_content = get_latest_content(mail.body_html, mail.body_plain)
+				updates[mail.name] = {
+					"latest_content": latest_content,
+					"snippet": get_snippet(latest_content),
+				}
+
+			bulk_update(doctype, updates, update_modified=False)
+			frappe.db.commit()
+
+			last_name = mails[-1].name
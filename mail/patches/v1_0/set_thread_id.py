@@ -0,0 +1,68 @@
+import heapq
+from itertools import islice
+
+import frappe
+
+from mail.utils import bulk_update, enqueue_job, get_thread_ids
+
+
+def execute() -> None:
+	"""Enqueues the backfill of the thread id of the existing incoming and outgoing mails, which are grouped by
+	their message id or name until then."""
+
+	enqueue_job(
+		set_thread_ids, queue="long", timeout=6 * 60 * 60, deduplicate=True, enqueue_after_commit=True
+	)
+
+
+def set_thread_ids(batch_size: int = 1000) -> None:
+	"""Sets the thread id of the mails without one, oldest first so that replies join the thread of the mails
+	they reply to, in batches committed one by one."""
+
+	mails = heapq.merge(
+		iter_mails_without_thread_id("Incoming Mail", batch_size),
+		iter_mails_without_thread_id("Outgoing Mail", batch_size),
+		key=lambda mail: (mail.creation, mail.name),
+	)
+
+	while batch := list(islice(mails, batch_size)):
+		updates = {"Incoming Mail": {}, "Outgoing Mail": {}}
+		for mail, thread_id in zip(batch, get_thread_ids(batch), strict=True):
+			updates[mail.doctype][mail.name] = {"thread_id": thread_id}
+
+		for doctype, doctype_updates in updates.items():
+			bulk_update(doctype, doctype_updates, update_modified=False)
+
+		frappe.db.commit()
+
+
+def iter_mails_without_thread_id(doctype: str, batch_size: int):
+	"""Yields the mails of the doctype without a thread id, ordered by creation and name."""
+
+	MAIL = frappe.qb.DocType(doctype)
+	last_mail = None
+
+	while True:
+		query = (
+			frappe.qb.from_(MAIL)
+			.select(MAIL.name, MAIL.creation, MAIL.message_id, MAIL.in_reply_to)
+			.where(MAIL.thread_id.isnull() | (MAIL.thread_id == ""))
+			.orderby(MAIL.creation)
+			.orderby(MAIL.name)
+			.limit(batch_size)
+		)
+
+		if last_mail:
+			query = query.where(
+				(MAIL.creation > last_mail.creation)
+				| ((MAIL.creation == last_mail.creation) & (MAIL.name > last_mail.name))
+			)
+
+		if not (mails := query.run(as_dict=True)):
+			break
+
+		for mail in mails:
+			mail.doctype = doctype
+			yield mail
+
+		last_mail = mails[-1]
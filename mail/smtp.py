@@ -1,17 +1,31 @@
+import asyncio
 import atexit
 import time
-from collections.abc import Generator
+from collections.abc import Generator, Iterable
 from contextlib import contextmanager, suppress
+from dataclasses import dataclass, field
 from queue import Queue
-from smtplib import SMTP, SMTP_SSL, SMTPServerDisconnected
+from smtplib import (
+	SMTP,
+	SMTP_SSL,
+	SMTPDataError,
+	SMTPRecipientsRefused,
+	SMTPSenderRefused,
+	SMTPServerDisconnected,
+)
 from threading import Lock, Thread
 
+import aiosmtplib
 import frappe
+from frappe.utils import now
 
 from mail.utils.cache import get_smtp_limits
 
 _smtp_connections_cache = {}
 
+# Upper bound on the connections opened concurrently by `deliver_envelopes` across all keys.
+SMTP_MAX_TOTAL_CONNECTIONS = 20
+
 
 class SMTPConnectionLimitError(Exception):
 	pass
@@ -47,7 +61,7 @@ class SMTPConnection:
 		return self.__session
 
 	def _is_session_active(self) -> bool:
-		if not self.session:
+		if not self.session or not self.session.sock:
 			return False
 
 		if not hasattr(self, "_last_check") or (time.time() - self._last_check) > 10:
@@ -313,3 +327,217 @@ def get_smtp_connection(
 			atexit.register(connection.close)
 
 	return connection
+
+
+def sendmail_chunks(
+	session: SMTP | SMTP_SSL,
+	from_addr: str,
+	to_addrs: list[str],
+	chunks: Iterable[str | bytes],
+	mail_options: Iterable[str] = (),
+) -> dict:
+	"""Same as `SMTP.sendmail`, but streams the message into the DATA phase chunk by chunk.
+
+	Line endings are normalized to CRLF and leading dots are escaped across chunk boundaries.
+	"""
+
+	session.ehlo_or_helo_if_needed()
+
+	code, response = session.mail(from_addr, list(mail_options))
+	if code != 250:
+		if code == 421:
+			session.close()
+		else:
+			session.rset()
+		raise SMTPSenderRefused(code, response, from_addr)
+
+	refused = {}
+	for to_addr in to_addrs:
+		code, response = session.rcpt(to_addr)
+		if code not in [250, 251]:
+			refused[to_addr] = (code, response)
+		if code == 421:
+			session.close()
+			raise SMTPRecipientsRefused(refused)
+
+	if len(refused) == len(to_addrs):
+		session.rset()
+		raise SMTPRecipientsRefused(refused)
+
+	code, response = session.docmd("data")
+	if code != 354:
+		session.rset()
+		raise SMTPDataError(code, response)
+
+	try:
+		remainder = b""
+		for chunk in chunks:
+			if isinstance(chunk, str):
+				chunk = chunk.encode("utf-8")
+
+			lines = (remainder + chunk).split(b"\n")
+			remainder = lines.pop()
+			if lines:
+				session.send(b"".join(_escape_line(line) for line in lines))
+
+		if remainder:
+			session.send(_escape_line(remainder))
+
+		session.send(b".\r\n")
+	except Exception:
+		# The message can't be terminated without sending a truncated copy, so drop the session instead of
+		# leaving it in the DATA phase for the next message.
+		_discard_session(session)
+		raise
+
+	code, response = session.getreply()
+	if code != 250:
+		session.rset()
+		raise SMTPDataError(code, response)
+
+	return refused
+
+
+def _discard_session(session: SMTP | SMTP_SSL) -> None:
+	"""Closes the session and removes its connection from the connection cache."""
+
+	session.close()
+
+	for key, connection in list(_smtp_connections_cache.items()):
+		if connection.session is session:
+			del _smtp_connections_cache[key]
+
+
+def _escape_line(line: bytes) -> bytes:
+	"""Returns the line with a CRLF ending and its leading dot escaped."""
+
+	line = line.rstrip(b"\r")
+	if line.startswith(b"."):
+		line = b"." + line
+
+	return line + b"\r\n"
+
+
+@dataclass
+class SMTPEnvelope:
+	id: str
+	from_addr: str
+	to_addrs: list[str]
+	message: str | bytes
+	mail_options: list[str] = field(default_factory=list)
+
+
+@dataclass
+class SMTPSessionSpec:
+	host: str
+	port: int
+	username: str
+	password: str
+	envelopes: list[SMTPEnvelope]
+	use_ssl: bool = False
+	use_tls: bool = False
+
+
+@dataclass
+class SMTPDeliveryResult:
+	completed_at: str | None = None
+	error: str | None = None
+
+
+def deliver_envelopes(sessions: list[SMTPSessionSpec]) -> dict[str, SMTPDeliveryResult]:
+	"""Delivers the envelopes of all sessions concurrently and returns the result of each envelope by its id.
+
+	Each (host, port, username) key gets up to `smtp_max_connections` concurrent connections, with at most
+	`SMTP_MAX_TOTAL_CONNECTIONS` across all keys, and a connection is replaced after `smtp_max_messages`
+	messages.
+	"""
+
+	smtp_limits = get_smtp_limits()
+	return asyncio.run(
+		_deliver_envelopes(
+			sessions,
+			max_connections=max(smtp_limits["max_connections"], 1),
+			max_messages=max(smtp_limits["max_messages"], 1),
+			max_total_connections=SMTP_MAX_TOTAL_CONNECTIONS,
+		)
+	)
+
+
+async def _deliver_envelopes(
+	sessions: list[SMTPSessionSpec], max_connections: int, max_messages: int, max_total_connections: int
+) -> dict[str, SMTPDeliveryResult]:
+	results = {}
+	queues = {}
+	semaphore = asyncio.Semaphore(max_total_connections)
+
+	for session in sessions:
+		key = (session.host, session.port, session.username)
+		if key not in queues:
+			queues[key] = (session, asyncio.Queue())
+
+		for envelope in session.envelopes:
+			queues[key][1].put_nowait(envelope)
+
+	workers = [
+		_delivery_worker(session, queue, max_messages, results, semaphore)
+		for session, queue in queues.values()
+		for _ in range(min(max_connections, queue.qsize()))
+	]
+	await asyncio.gather(*workers)
+
+	return results
+
+
+async def _delivery_worker(
+	session: SMTPSessionSpec,
+	queue: asyncio.Queue,
+	max_messages: int,
+	results: dict[str, SMTPDeliveryResult],
+	semaphore: asyncio.Semaphore,
+) -> None:
+	client = None
+	email_count = 0
+
+	async with semaphore:
+		try:
+			while not queue.empty():
+				envelope: SMTPEnvelope = queue.get_nowait()
+
+				try:
+					if client is None or email_count >= max_messages or not client.is_connected:
+						await _close_async_client(client)
+						client = await _create_async_client(session)
+						email_count = 0
+
+					await client.sendmail(
+						envelope.from_addr,
+						envelope.to_addrs,
+						envelope.message,
+						mail_options=envelope.mail_options,
+					)
+					email_count += 1
+					results[envelope.id] = SMTPDeliveryResult(completed_at=now())
+				except Exception:
+					results[envelope.id] = SMTPDeliveryResult(error=frappe.get_traceback(with_context=False))
+					await _close_async_client(client)
+					client = None
+		finally:
+			await _close_async_client(client)
+
+
+async def _create_async_client(session: SMTPSessionSpec) -> aiosmtplib.SMTP:
+	client = aiosmtplib.SMTP(
+		hostname=session.host,
+		port=session.port,
+		use_tls=session.use_ssl,
+		start_tls=session.use_tls,
+	)
+	await client.connect()
+	await client.login(session.username, session.password)
+	return client
+
+
+async def _close_async_client(client: aiosmtplib.SMTP | None) -> None:
+	if client and client.is_connected:
+		with suppress(aiosmtplib.SMTPException, TimeoutError, OSError):
+			await client.quit()
@@ -0,0 +1,113 @@
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import Lock
+
+SPAMD_CONNECT_TIMEOUT = 10
+SPAMD_TIMEOUT = 120
+SPAMD_MAX_CONNECTIONS = 8
+SPAMD_RECV_SIZE = 64 * 1024
+
+
+class SpamdError(Exception):
+	pass
+
+
+class SpamdConnectionError(SpamdError):
+	pass
+
+
+class SpamdTimeoutError(SpamdError):
+	pass
+
+
+@dataclass
+class SpamdResult:
+	response: str
+	duration: float
+
+
+class SpamdClient:
+	"""Client for the spamd `SYMBOLS` command.
+
+	spamd answers a single request per connection, so every scan opens its own connection. Batches are scanned
+	concurrently by a pool of worker threads that is shared by the clients of the process, with at most
+	`max_connections` scans in flight. The scans don't use `frappe` and can run outside the request context.
+	"""
+
+	_executors: dict[int, ThreadPoolExecutor] = {}
+	_lock = Lock()
+
+	def __init__(
+		self,
+		host: str,
+		port: int,
+		max_connections: int = SPAMD_MAX_CONNECTIONS,
+		timeout: int = SPAMD_TIMEOUT,
+		connect_timeout: int = SPAMD_CONNECT_TIMEOUT,
+	) -> None:
+		self.host = host
+		self.port = port
+		self.max_connections = max(max_connections, 1)
+		self.timeout = timeout
+		self.connect_timeout = min(connect_timeout, timeout)
+
+	def scan(self, message: str | bytes) -> SpamdResult:
+		"""Scans the message and returns the spamd response. The whole request, from connecting to reading the
+		last byte of the response, must complete within `timeout` seconds."""
+
+		body = message.encode("utf-8") if isinstance(message, str) else message
+		started_at = time.monotonic()
+		deadline = started_at + self.timeout
+		response = bytearray()
+
+		try:
+			with socket.create_connection((self.host, self.port), timeout=self.connect_timeout) as sock:
+				sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+				sock.settimeout(max(deadline - time.monotonic(), 0.001))
+				sock.sendall(b"SYMBOLS SPAMC/1.5\r\nContent-length: %d\r\n\r\n" % len(body))
+				sock.sendall(body)
+				sock.shutdown(socket.SHUT_WR)
+
+				while True:
+					if (remaining := deadline - time.monotonic()) <= 0:
+						raise TimeoutError
+
+					sock.settimeout(remaining)
+					if not (chunk := sock.recv(SPAMD_RECV_SIZE)):
+						break
+
+					response += chunk
+		except TimeoutError as e:
+			raise SpamdTimeoutError(f"spamd at {self.host}:{self.port} timed out") from e
+		except OSError as e:
+			raise SpamdConnectionError(f"spamd at {self.host}:{self.port} is unreachable: {e}") from e
+
+		if not response:
+			raise SpamdError(f"spamd at {self.host}:{self.port} returned an empty response")
+
+		return SpamdResult(response.decode("utf-8", errors="replace"), time.monotonic() - started_at)
+
+	def scan_many(self, messages: list[str | bytes]) -> list[SpamdResult | SpamdError]:
+		"""Scans the messages concurrently and returns, in order, the result of each message or the error it
+		failed with, so that a failure doesn't abort the rest of the batch."""
+
+		if len(messages) <= 1:
+			return [self._scan_or_error(message) for message in messages]
+
+		return list(self._get_executor().map(self._scan_or_error, messages))
+
+	def _scan_or_error(self, message: str | bytes) -> SpamdResult | SpamdError:
+		try:
+			return self.scan(message)
+		except SpamdError as e:
+			return e
+
+	def _get_executor(self) -> ThreadPoolExecutor:
+		with self._lock:
+			if not (executor := self._executors.get(self.max_connections)):
+				executor = ThreadPoolExecutor(max_workers=self.max_connections, thread_name_prefix="spamd")
+				self._executors[self.max_connections] = executor
+
+			return executor
@@ -2,7 +2,13 @@ import frappe
 
 from mail.mail.doctype.dns_record.dns_record import verify_all_dns_records
 from mail.mail.doctype.incoming_mail.incoming_mail import fetch_emails_from_mail_agents
-from mail.mail.doctype.outgoing_mail.outgoing_mail import delete_newsletters, transfer_mails_to_mail_agent
+from mail.mail.doctype.mail_open_event.mail_open_event import delete_old_open_events
+from mail.mail.doctype.mail_open_rollup.mail_open_rollup import set_sent_counts
+from mail.mail.doctype.outgoing_mail.outgoing_mail import (
+	delete_newsletters,
+	flush_opens,
+	transfer_mails_to_mail_agent,
+)
 from mail.utils import enqueue_job
 
 
@@ -10,8 +16,10 @@ from mail.utils import enqueue_job
 def enqueue_transfer_mails_to_mail_agent() -> None:
 	"Called by the scheduler to enqueue the `transfer_mails_to_mail_agent` job."
 
+	# Enqueued on the `short` queue with the fast lane, so that the planner isn't held up behind the bulk lane
+	# batches on the `long` queue.
 	frappe.session.user = "Administrator"
-	enqueue_job(transfer_mails_to_mail_agent, queue="long", deduplicate=True)
+	enqueue_job(transfer_mails_to_mail_agent, queue="short", deduplicate=True)
 
 
 @frappe.whitelist()
@@ -30,6 +38,30 @@ def enqueue_fetch_emails_from_mail_agents() -> None:
 	enqueue_job(fetch_emails_from_mail_agents, queue="long", deduplicate=True)
 
 
+@frappe.whitelist()
+def enqueue_flush_opens() -> None:
+	"Called by the scheduler to enqueue the `flush_opens` job."
+
+	frappe.session.user = "Administrator"
+	enqueue_job(flush_opens, queue="long", deduplicate=True)
+
+
+@frappe.whitelist()
+def enqueue_set_sent_counts() -> None:
+	"Called by the scheduler to enqueue the `set_sent_counts` job."
+
+	frappe.session.user = "Administrator"
+	enqueue_job(set_sent_counts, queue="long", deduplicate=True)
+
+
+@frappe.whitelist()
+def enqueue_delete_old_open_events() -> None:
+	"Called by the scheduler to enqueue the `delete_old_open_events` job."
+
+	frappe.session.user = "Administrator"
+	enqueue_job(delete_old_open_events, queue="long", deduplicate=True)
+
+
 @frappe.whitelist()
 def enqueue_verify_all_dns_records() -> None:
 	"Called by the scheduler to enqueue the `verify_all_dns_records` job."
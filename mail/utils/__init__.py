@@ -5,15 +5,21 @@ import re
 import secrets
 import string
 import zipfile
+from collections import defaultdict
 from collections.abc import Callable
 from io import BytesIO
-from typing import Literal
+from typing import TYPE_CHECKING, Literal
 
 import frappe
 from bs4 import BeautifulSoup
 from frappe import _
+from frappe.query_builder import Case
+from frappe.utils import create_batch, is_html, now
 from frappe.utils.caching import redis_cache, request_cache
 
+if TYPE_CHECKING:
+	from frappe.model.document import Document
+
 
 def encode_image_to_base64(image_path: str) -> str:
 	"""Encodes an image to a base64 string with line breaks every 76 characters."""
@@ -95,6 +101,95 @@ def enqueue_job(method: str | Callable, deduplicate: bool = False, **kwargs) ->
 	frappe.enqueue(method, job_id=job_id, deduplicate=deduplicate, **kwargs)
 
 
+def bulk_update(
+	doctype: str, updates: dict[str, dict], update_modified: bool = True, chunk_size: int = 500
+) -> int:
+	"""Updates multiple documents with a single `UPDATE ... CASE` statement per chunk and returns the number of rows affected.
+
+	Example:
+	    bulk_update("Outgoing Mail", {"mail-1": {"status": "Sent"}, "mail-2": {"status": "Failed"}})
+	"""
+
+	if not updates:
+		return 0
+
+	rows_affected = 0
+	modified = now()
+	table = frappe.qb.DocType(doctype)
+
+	for names in create_batch(list(updates), chunk_size):
+		query = frappe.qb.update(table).where(table.name.isin(names))
+		fields = dict.fromkeys(field for name in names for field in updates[name])
+
+		for field in fields:
+			case = Case()
+			for name in names:
+				if field in updates[name]:
+					case = case.when(table.name == name, updates[name][field])
+
+			query = query.set(table[field], case.else_(table[field]))
+
+		if update_modified:
+			query = query.set(table.modified, modified).set(table.modified_by, frappe.session.user)
+
+		query.run()
+		rows_affected += frappe.db._cursor.rowcount
+
+	return rows_affected
+
+
+def notify_updates(doctype: str, names: list[str]) -> None:
+	"""Publishes the realtime `doc_update` and `list_update` events of documents written with `bulk_update`,
+	as `Document.notify_update` does for a single document. The events are sent after the commit."""
+
+	if not names:
+		return
+
+	modified = now()
+	user = frappe.session.user
+	for name in names:
+		frappe.publish_realtime(
+			"doc_update",
+			{"modified": modified, "doctype": doctype, "name": name},
+			doctype=doctype,
+			docname=name,
+			after_commit=True,
+		)
+		frappe.publish_realtime(
+			"list_update",
+			{"doctype": doctype, "name": name, "user": user},
+			doctype=doctype,
+			after_commit=True,
+		)
+
+
+def bulk_insert_docs(docs: list["Document"], chunk_size: int = 500) -> None:
+	"""Inserts the documents and their child rows with one multi-row `INSERT` per doctype and chunk.
+
+	Controller hooks, link validation and versioning are skipped, so the documents must already be named,
+	validated and carry their final `docstatus`.
+	"""
+
+	if not docs:
+		return
+
+	timestamp = now()
+	rows = defaultdict(list)
+
+	for doc in docs:
+		doc._set_defaults()
+		for d in [doc, *doc.get_all_children()]:
+			d.creation = d.modified = timestamp
+			d.owner = d.modified_by = frappe.session.user
+			d.docstatus = doc.docstatus
+			rows[d.doctype].append(d.get_valid_dict(convert_dates_to_str=True, ignore_nulls=False))
+
+	for doctype, dicts in rows.items():
+		fields = list(dicts[0])
+		values = [[d.get(field) for field in fields] for d in dicts]
+		frappe.db.bulk_insert(doctype, fields, values, chunk_size=chunk_size)
+
+
 @request_cache
 def convert_html_to_text(html: str) -> str:
 	"""Returns plain text from HTML content."""
@@ -109,6 +204,32 @@ def convert_html_to_text(html: str) -> str:
 	return text
 
 
+def get_latest_content(html: str | None, plain: str | None) -> str:
+	"""Returns the latest content from the mail."""
+
+	content = html if html else plain
+	if content is None:
+		return ""
+
+	if is_html(content):
+		soup = BeautifulSoup(content, "html.parser")
+		blockquote = soup.find("blockquote")
+		if blockquote:
+			blockquote.extract()
+		return soup.get_text(strip=True)
+
+	return content
+
+
+def get_snippet(content: str) -> str:
+	"""Returns a snippet of the content."""
+
+	content = re.sub(
+		r"(?<=[.,])(?=[^\s])", r" ", content
+	)  # add space after . and , if not followed by a space
+	return " ".join(content.split()[:50])
+
+
 def get_in_reply_to_mail(
 	message_id: str | None = None,
 ) -> tuple[str, str] | tuple[None, None]:
@@ -124,6 +245,79 @@ def get_in_reply_to_mail(
 	return None, None
 
 
+def get_in_reply_to_mails(message_ids: list[str]) -> dict[str, tuple[str, str]]:
+	"""Returns mail type and name of the mails to which the given messages are replies, by message id,
+	with a single query per mail type."""
+
+	in_reply_to_mails = {}
+	message_ids = list({message_id for message_id in message_ids if message_id})
+
+	if message_ids:
+		for in_reply_to_mail_type in ["Incoming Mail", "Outgoing Mail"]:
+			for mail in frappe.db.get_all(
+				in_reply_to_mail_type, {"message_id": ["in", message_ids]}, ["name", "message_id"]
+			):
+				# Outgoing Mail is looked up last, so that it takes precedence as in `get_in_reply_to_mail`.
+				in_reply_to_mails[mail.message_id] = (in_reply_to_mail_type, mail.name)
+
+	return in_reply_to_mails
+
+
+def get_thread_ids(mails: list[dict]) -> list[str]:
+	"""Returns the thread ids of the mails, in order.
+
+	A thread is identified by the message id of its first mail. A mail joins the thread of the first known
+	mail among itself (e.g. the incoming copy of an outgoing mail), its In-Reply-To and its References (nearest
+	first). Otherwise it starts the thread of the oldest mail it references, or its own. The mails are resolved
+	in order, so that a mail can join the thread of an earlier mail of the same batch.
+
+	Example:
+	    get_thread_ids([{"name": "...", "message_id": "<b@x>", "in_reply_to": "<a@x>", "references": ["<a@x>"]}])
+	"""
+
+	message_ids = set()
+	for mail in mails:
+		message_ids.update([mail.get("message_id"), mail.get("in_reply_to"), *(mail.get("references") or [])])
+
+	message_ids.discard(None)
+	known = get_thread_ids_by_message_id(list(message_ids))
+
+	thread_ids = []
+	for mail in mails:
+		message_id, in_reply_to = mail.get("message_id"), mail.get("in_reply_to")
+		references = mail.get("references") or []
+
+		candidates = [message_id, in_reply_to, *reversed(references)]
+		thread_id = next((known[candidate] for candidate in candidates if candidate in known), None)
+		thread_id = (
+			thread_id or (references[0] if references else in_reply_to) or message_id or mail.get("name")
+		)
+
+		if message_id:
+			known.setdefault(message_id, thread_id)
+
+		thread_ids.append(thread_id)
+
+	return thread_ids
+
+
+def get_thread_ids_by_message_id(message_ids: list[str]) -> dict[str, str]:
+	"""Returns the thread ids of the incoming and outgoing mails with the given message ids."""
+
+	thread_ids = {}
+
+	if message_ids:
+		for mail_type in ["Incoming Mail", "Outgoing Mail"]:
+			for mail in frappe.db.get_all(
+				mail_type,
+				{"message_id": ["in", message_ids], "thread_id": ["is", "set"]},
+				["message_id", "thread_id"],
+			):
+				thread_ids.setdefault(mail.message_id, mail.thread_id)
+
+	return thread_ids
+
+
 def get_in_reply_to(
 	in_reply_to_mail_type: str | None = None,
 	in_reply_to_mail_name: str | None = None,
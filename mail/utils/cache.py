@@ -37,6 +37,7 @@ def get_imap_limits() -> dict:
 			"authenticated_timeout": mail_settings.imap_authenticated_timeout,
 			"unauthenticated_timeout": mail_settings.imap_unauthenticated_timeout,
 			"idle_timeout": mail_settings.imap_idle_timeout,
+			"idle_max_mailboxes": mail_settings.imap_idle_max_mailboxes,
 			"cleanup_interval": mail_settings.imap_cleanup_interval,
 		}
 
@@ -1,46 +1,81 @@
+import hashlib
+import os
 import re
-from email import message_from_string, policy
+from contextlib import suppress
+from dataclasses import dataclass, field
+from email import message_from_bytes, message_from_string
 from email.header import decode_header, make_header
 from email.utils import parseaddr
+from functools import partial
+from tempfile import NamedTemporaryFile
 from typing import TYPE_CHECKING
 from urllib.parse import unquote
 
-from frappe.utils import cint, get_datetime_str
-from frappe.utils.file_manager import save_file
+import frappe
+from frappe.core.doctype.file.utils import get_file_name
+from frappe.utils import cint, get_datetime_str, get_files_path, now
 
 from mail.utils.dt import parsedate_to_datetime
+from mail.utils.mime import iter_decoded_payload
 
 if TYPE_CHECKING:
 	from email.message import Message
 
 
+DSN_FIELDS = ["Final-Recipient", "Action", "Status", "Diagnostic-Code", "Remote-MTA"]
+
+
+@dataclass
+class MessageParts:
+	"""Bodies, attachments and DSN fields of an email, collected with a single walk of the MIME tree."""
+
+	body_html: str = ""
+	body_plain: str = ""
+	attachments: list[dict] = field(default_factory=list)
+	original_envelope_id: str | None = None
+	dsn_recipients: list[dict] = field(default_factory=list)
+
+
 class EmailParser:
-	def __init__(self, message: str) -> None:
+	def __init__(self, message: str | bytes) -> None:
 		self.message = self.get_parsed_message(message)
+		self.size = len(message) if isinstance(message, bytes) else len(message.encode("utf-8"))
 		self.content_id_and_file_url_map = {}
+		self._parts = None
 
 	@staticmethod
-	def get_parsed_message(message: str) -> "Message":
-		"""Returns parsed email message object from string."""
+	def get_parsed_message(message: str | bytes) -> "Message":
+		"""Returns parsed email message object from bytes or string."""
+
+		if isinstance(message, bytes):
+			return message_from_bytes(message)
 
 		return message_from_string(message)
 
 	def get_message_id(self) -> str | None:
 		"""Returns the message ID of the email."""
 
-		if message_id := self.message.get("Message-ID"):
+		if message_id := self.get_header("Message-ID"):
 			return remove_whitespace_characters(message_id)
 
 	def get_in_reply_to(self) -> str | None:
 		"""Returns the in-reply-to message ID of the email."""
 
-		if in_reply_to := self.message.get("In-Reply-To"):
+		if in_reply_to := self.get_header("In-Reply-To"):
 			return remove_whitespace_characters(in_reply_to)
 
+	def get_references(self) -> list[str]:
+		"""Returns the message IDs of the References header of the email, oldest first."""
+
+		if references := self.get_header("References"):
+			return re.findall(r"<[^<>\s]+>", references)
+
+		return []
+
 	def get_subject(self) -> str | None:
 		"""Returns the decoded subject of the email."""
 
-		if subject := self.message["Subject"]:
+		if subject := self.get_header("Subject"):
 			decoded_subject = str(make_header(decode_header(subject)))
 			return remove_whitespace_characters(decoded_subject)
 
@@ -49,18 +84,18 @@ class EmailParser:
 	def get_sender(self) -> tuple[str, str]:
 		"""Returns the display name and email of the sender."""
 
-		return parseaddr(self.message["From"])
+		return parseaddr(self.get_header("From"))
 
 	def get_delivered_to(self) -> str | None:
 		"""Returns the Delivered-To email address of the email."""
 
-		if delivered_to := self.message.get("Delivered-To"):
+		if delivered_to := self.get_header("Delivered-To"):
 			return remove_whitespace_characters(delivered_to)
 
 	def get_reply_to(self) -> str:
 		"""Returns the reply-to email(s) of the email."""
 
-		if reply_to := self.message.get("Reply-To"):
+		if reply_to := self.get_header("Reply-To"):
 			return remove_whitespace_characters(reply_to)
 
 	def get_priority(self) -> int:
@@ -71,7 +106,18 @@ class EmailParser:
 	def get_header(self, header: str) -> str | None:
 		"""Returns the value of the header."""
 
-		return self.message[header]
+		if values := self.get_all_headers(header):
+			return values[0]
+
+	def get_all_headers(self, header: str) -> list[str]:
+		"""Returns the values of all occurrences of the header.
+
+		The raw values are used, as messages parsed from bytes return headers with raw 8-bit bytes
+		(e.g. unencoded UTF-8) as `Header` objects that lose the non-ASCII characters.
+		"""
+
+		header = header.lower()
+		return [decode_8bit_text(value) for name, value in self.message.raw_items() if name.lower() == header]
 
 	def update_header(self, header: str, value: str) -> None:
 		"""Updates the value of the header."""
@@ -84,13 +130,84 @@ class EmailParser:
 	def get_date(self) -> str | None:
 		"""Returns the date of the email."""
 
-		if date_header := self.message.get("Date"):
+		if date_header := self.get_header("Date"):
 			return get_datetime_str(parsedate_to_datetime(date_header))
 
 	def get_size(self) -> int:
-		"""Returns the size of the email."""
+		"""Returns the size of the email in bytes, as received."""
+
+		return self.size
+
+	def is_dsn_report(self) -> bool:
+		"""Returns True if the email is a delivery status notification."""
+
+		return (
+			self.message.get_content_type() == "multipart/report"
+			and self.message.get_param("report-type") == "delivery-status"
+		)
+
+	@property
+	def parts(self) -> MessageParts:
+		"""Returns the bodies, attachments and DSN fields of the email, walking the MIME tree on first access."""
+
+		if self._parts is None:
+			self._parts = self.walk()
+
+		return self._parts
+
+	def walk(self) -> MessageParts:
+		"""Walks the MIME tree once and collects the bodies, attachments and DSN fields of the email."""
+
+		parts = MessageParts()
+		is_dsn_report = self.is_dsn_report()
+		dsn_fields = {}
+
+		for part in self.message.walk():
+			content_type = part.get_content_type()
+			filename = part.get_filename()
+			disposition = part.get("Content-Disposition")
+			payload = None
+
+			if content_type in ("text/html", "text/plain"):
+				payload = part.get_payload(decode=True)
+
+			# Attachments keep a reference to their part and are decoded while being saved.
+			if disposition and filename and not part.is_multipart() and part.get_payload():
+				disposition = disposition.lower()
+				attachment = {
+					"filename": decode_8bit_text(unquote(filename)),
+					"part": part,
+					"content_id": None,
+				}
 
-		return len(self.message.as_string(policy=policy.default).encode("utf-8"))
+				if disposition.startswith("inline"):
+					if content_id := re.sub(r"[<>]", "", str(part.get("Content-ID", ""))):
+						parts.attachments.append({**attachment, "content_id": content_id})
+
+				elif disposition.startswith("attachment"):
+					parts.attachments.append(attachment)
+
+			if payload and content_type in ("text/html", "text/plain"):
+				text = payload.decode(part.get_content_charset() or "utf-8", "ignore")
+				if content_type == "text/html":
+					parts.body_html += text
+				else:
+					parts.body_plain += text
+
+			if is_dsn_report:
+				if not parts.original_envelope_id and part.get("Original-Envelope-Id"):
+					parts.original_envelope_id = part.get("Original-Envelope-Id")
+
+				# Each recipient's fields may be spread over consecutive parts.
+				for header in DSN_FIELDS:
+					if part.get(header):
+						dsn_fields[header] = part.get(header)
+
+				if len(dsn_fields) == len(DSN_FIELDS):
+					parts.dsn_recipients.append(dsn_fields)
+					dsn_fields = {}
+
+		return parts
 
 	def get_recipients(self, types: str | list | None = None) -> list[dict]:
 		"""Returns the list of recipients of the email."""
@@ -102,7 +219,7 @@ class EmailParser:
 
 		recipients = []
 		for type in types:
-			if addresses := self.message.get(type):
+			if addresses := self.get_header(type):
 				for address in addresses.split(","):
 					display_name, email = parseaddr(remove_whitespace_characters(address))
 					if email:
@@ -113,62 +230,15 @@ class EmailParser:
 	def save_attachments(self, doctype: str, docname: str, is_private: bool = True) -> None:
 		"""Saves the attachments of the email."""
 
-		def save_attachment(
-			filename: str, content: bytes, doctype: str, docname: str, is_private: bool
-		) -> dict:
-			"""Saves the attachment as a file."""
-
-			kwargs = {
-				"fname": filename,
-				"content": content,
-				"df": "file",
-				"dt": doctype,
-				"dn": docname,
-				"is_private": cint(is_private),
-			}
-			file = save_file(**kwargs)
-			return {
-				"name": file.name,
-				"file_name": file.file_name,
-				"file_url": file.file_url,
-				"is_private": file.is_private,
-			}
-
-		for part in self.message.walk():
-			filename = part.get_filename()
-			disposition = part.get("Content-Disposition")
-
-			if disposition and filename:
-				filename = unquote(filename)
-				disposition = disposition.lower()
-
-				if disposition.startswith("inline"):
-					if content_id := re.sub(r"[<>]", "", part.get("Content-ID", "")):
-						if payload := part.get_payload(decode=True):
-							file = save_attachment(filename, payload, doctype, docname, is_private)
-							self.content_id_and_file_url_map[content_id] = file["file_url"]
-
-				elif disposition.startswith("attachment"):
-					if payload := part.get_payload(decode=True):
-						save_attachment(filename, payload, doctype, docname, is_private)
+		for attachment in self.parts.attachments:
+			file = save_attachment(attachment["part"], attachment["filename"], doctype, docname, is_private)
+			if content_id := attachment["content_id"]:
+				self.content_id_and_file_url_map[content_id] = file["file_url"]
 
 	def get_body(self) -> tuple[str | None, str | None]:
 		"""Returns the HTML and plain text body of the email."""
 
-		body_html, body_plain = "", ""
-
-		for part in self.message.walk():
-			content_type = part.get_content_type()
-
-			if content_type == "text/html":
-				if payload := part.get_payload(decode=True):
-					charset = part.get_content_charset() or "utf-8"
-					body_html += payload.decode(charset, "ignore")
-
-			elif content_type == "text/plain":
-				if payload := part.get_payload(decode=True):
-					charset = part.get_content_charset() or "utf-8"
-					body_plain += payload.decode(charset, "ignore")
+		body_html, body_plain = self.parts.body_html, self.parts.body_plain
 
 		if self.content_id_and_file_url_map:
 			for content_id, file_url in self.content_id_and_file_url_map.items():
@@ -187,7 +257,7 @@ class EmailParser:
 			result[f"{check}_pass"] = 0
 			result[f"{check}_description"] = "Header not found."
 
-		if headers := self.message.get_all("Authentication-Results"):
+		if headers := self.get_all_headers("Authentication-Results"):
 			if len(headers) == 1:
 				headers = headers[0].split(";")
 
@@ -209,6 +279,124 @@ class EmailParser:
 		return self.message.as_string()
 
 
+def save_attachment(
+	part: "Message", filename: str, doctype: str, docname: str, is_private: bool = True
+) -> dict:
+	"""Saves the payload of the part as a File attached to the document and returns the file details.
+
+	The payload is decoded to disk in chunks while its size and content hash are computed, and a file with
+	the same content is reused instead of being written again. The File row is inserted directly, so the
+	content is never read back into memory.
+	"""
+
+	is_private = cint(is_private)
+	files_path = get_files_path(is_private=is_private)
+	os.makedirs(files_path, exist_ok=True)
+
+	size = 0
+	md5 = hashlib.md5()
+
+	with NamedTemporaryFile(dir=files_path, prefix=".attachment-", delete=False) as temp_file:
+		try:
+			for chunk in iter_decoded_payload(part):
+				size += len(chunk)
+				md5.update(chunk)
+				temp_file.write(chunk)
+		except Exception:
+			os.remove(temp_file.name)
+			raise
+
+	content_hash = md5.hexdigest()
+	file_name = os.path.basename(filename.replace("\\", "/")).strip() or content_hash
+
+	if file_url := get_file_url_by_content_hash(content_hash, is_private):
+		os.remove(temp_file.name)
+	else:
+		if os.path.exists(os.path.join(files_path, file_name)):
+			file_name = get_file_name(file_name, content_hash[-6:])
+
+		file_path = os.path.join(files_path, file_name)
+		os.replace(temp_file.name, file_path)
+		file_url = f"{'/private' if is_private else ''}/files/{file_name}"
+		# The file is written outside the transaction, remove it if the File is rolled back.
+		frappe.db.after_rollback.add(partial(remove_file, file_path))
+
+	file = frappe.get_doc(
+		{
+			"doctype": "File",
+			"file_name": file_name,
+			"file_url": file_url,
+			"file_size": size,
+			"content_hash": content_hash,
+			"attached_to_doctype": doctype,
+			"attached_to_name": docname,
+			"is_private": is_private,
+			"folder": "Home/Attachments",
+		}
+	)
+	# `File.insert` would read the content back to save, hash and dedupe it again, so the row is inserted as is.
+	file._set_defaults()
+	file.set_new_name()
+	file.creation = file.modified = now()
+	file.owner = file.modified_by = frappe.session.user
+	file.db_insert()
+
+	return {
+		"name": file.name,
+		"file_name": file.file_name,
+		"file_url": file.file_url,
+		"is_private": file.is_private,
+	}
+
+
+def remove_file(path: str) -> None:
+	"""Removes the file at the path, if it still exists."""
+
+	with suppress(FileNotFoundError):
+		os.remove(path)
+
+
+def remove_unreferenced_files(files: list[dict]) -> None:
+	"""Removes the files on disk that are no longer referenced by any File, e.g. after a rollback to a savepoint,
+	which does not run the rollback callbacks."""
+
+	if not files:
+		return
+
+	referenced = set(
+		frappe.db.get_all("File", {"file_url": ["in", [file.file_url for file in files]]}, pluck="file_url")
+	)
+
+	for file in files:
+		if file.file_url not in referenced:
+			remove_file(get_files_path(os.path.basename(file.file_url), is_private=file.is_private))
+
+
+def get_file_url_by_content_hash(content_hash: str, is_private: int) -> str | None:
+	"""Returns the URL of an existing file on disk with the given content hash, if any."""
+
+	for file_url in frappe.db.get_all(
+		"File", {"content_hash": content_hash, "is_private": is_private, "is_folder": 0}, pluck="file_url"
+	):
+		if file_url and os.path.exists(get_files_path(os.path.basename(file_url), is_private=is_private)):
+			return file_url
+
+	return None
+
+
+def decode_8bit_text(text: str) -> str:
+	"""Returns the text with raw 8-bit bytes, kept as surrogates by the bytes parser, decoded as UTF-8 or Latin-1."""
+
+	if text.isascii():
+		return text
+
+	raw = text.encode("utf-8", "surrogateescape")
+	try:
+		return raw.decode("utf-8")
+	except UnicodeDecodeError:
+		return raw.decode("latin-1")
+
+
 def remove_whitespace_characters(text: str) -> str:
 	"""Removes whitespace characters from the text."""
 
@@ -0,0 +1,19 @@
+import frappe
+from frappe.utils import now
+
+
+def record_metrics(name: str, **metrics) -> None:
+	"""Records the metrics of the latest run of a job in the cache and the `mail` log."""
+
+	metrics["recorded_at"] = now()
+	frappe.cache.hset("mail-metrics", name, metrics)
+	frappe.logger("mail").info({"metrics": name, **metrics})
+
+
+def get_metrics(name: str | None = None) -> dict:
+	"""Returns the recorded metrics of the given job or of all jobs."""
+
+	if name:
+		return frappe.cache.hget("mail-metrics", name) or {}
+
+	return frappe.cache.hgetall("mail-metrics") or {}
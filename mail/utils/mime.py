@@ -0,0 +1,118 @@
+import base64
+import binascii
+import re
+from collections.abc import Callable, Generator
+from email.message import Message
+from email.mime.base import MIMEBase
+from email.policy import SMTP
+from typing import BinaryIO
+
+from uuid_utils import uuid7
+
+# Multiple of 57 bytes, so that each chunk encodes to complete 76 character base64 lines.
+BASE64_CHUNK_SIZE = 57 * 1024
+BASE64_LINE_LENGTH = 76
+DECODE_CHUNK_SIZE = 64 * 1024
+
+
+def create_streamed_part(maintype: str, subtype: str) -> tuple[MIMEBase, str]:
+	"""Returns a base64 encoded MIME part and the placeholder that `write_message` replaces with the streamed payload."""
+
+	placeholder = f"streamed-payload-{uuid7().hex}"
+	part = MIMEBase(maintype, subtype, policy=SMTP)
+	part["Content-Transfer-Encoding"] = "base64"
+	part.set_payload(placeholder)
+
+	if maintype == "text":
+		part.set_param("charset", "utf-8")
+
+	return part, placeholder
+
+
+def write_message(message: Message, file: BinaryIO, streams: dict[str, Callable[[], BinaryIO]]) -> int:
+	"""Writes the message to the file, base64 encoding the streamed payloads chunk by chunk, and returns the number of bytes written.
+
+	`streams` maps the placeholders returned by `create_streamed_part` to callables opening the payload source.
+	"""
+
+	size = 0
+	position = 0
+	skeleton = message.as_string()
+
+	if streams:
+		linesep = message.policy.linesep.encode()
+		pattern = re.compile("|".join(re.escape(placeholder) for placeholder in streams))
+
+		for match in pattern.finditer(skeleton):
+			size += file.write(skeleton[position : match.start()].encode("utf-8"))
+
+			with streams[match.group()]() as source:
+				size += write_base64(source, file, linesep)
+
+			position = match.end()
+
+	size += file.write(skeleton[position:].encode("utf-8"))
+
+	return size
+
+
+def write_base64(source: BinaryIO, file: BinaryIO, linesep: bytes = b"\r\n") -> int:
+	"""Writes the source base64 encoded in lines of 76 characters to the file and returns the number of bytes written."""
+
+	size = 0
+	first_chunk = True
+
+	while chunk := source.read(BASE64_CHUNK_SIZE):
+		encoded = base64.b64encode(chunk)
+		lines = [encoded[i : i + BASE64_LINE_LENGTH] for i in range(0, len(encoded), BASE64_LINE_LENGTH)]
+
+		if not first_chunk:
+			size += file.write(linesep)
+
+		size += file.write(linesep.join(lines))
+		first_chunk = False
+
+	return size
+
+
+def iter_decoded_payload(part: Message, chunk_size: int = DECODE_CHUNK_SIZE) -> Generator[bytes, None, None]:
+	"""Yields the decoded payload of a non-multipart part in chunks.
+
+	Base64 and quoted-printable payloads are decoded slice by slice (cut at line ends), so the decoded
+	payload is never held in memory as a whole.
+	"""
+
+	encoding = str(part.get("Content-Transfer-Encoding", "")).strip().lower()
+
+	if encoding not in ("base64", "quoted-printable"):
+		if payload := part.get_payload(decode=True):
+			yield payload
+		return
+
+	payload = part.get_payload()
+	position = 0
+	remainder = ""
+
+	while position < len(payload):
+		end = payload.find("\n", position + chunk_size)
+		end = len(payload) if end == -1 else end + 1
+		chunk = payload[position:end]
+		position = end
+
+		if encoding == "base64":
+			# Decode whole 4 character groups only, the rest is carried over to the next slice.
+			chunk = remainder + "".join(chunk.split())
+			usable = len(chunk) - len(chunk) % 4
+			chunk, remainder = chunk[:usable], chunk[usable:]
+			data = binascii.a2b_base64(chunk)
+		else:
+			data = binascii.a2b_qp(chunk.encode("ascii", "surrogateescape"))
+
+		if data:
+			yield data
+
+	if remainder.strip("="):
+		try:
+			yield binascii.a2b_base64(remainder + "=" * (-len(remainder) % 4))
+		except binascii.Error:
+			pass